@@ -0,0 +1,280 @@
+import asyncio
+import os
+from typing import Any, Dict, List, Optional
+
+import metrics
+import vector_search
+from dispatcher import AsyncSingleFlight, request_key
+from embedding_cache import model_name, normalize_query
+from result_cache import result_key
+
+# asyncio versions of the vector_search entry points, so one process can serve many sessions
+
+ASYNC_MAX_CONCURRENCY = int(os.getenv("ASYNC_MAX_CONCURRENCY", "32"))
+COSMOS_POOL_SIZE = int(os.getenv("COSMOS_POOL_SIZE", "100"))
+
+# clients, session, semaphore and in-flight requests belong to the event loop they were created on,
+# a call from another loop (a new asyncio.run, a test) starts over with its own
+
+_loop = None
+_cosmos_client = None
+_container = None
+_session = None
+_limit = None
+_cosmos_flight = None
+_embedding_flight = None
+
+
+def _bind_loop():
+    global _loop, _cosmos_client, _container, _session, _limit, _cosmos_flight, _embedding_flight
+    loop = asyncio.get_running_loop()
+    if loop is not _loop:
+        _loop = loop
+        _cosmos_client = _container = _session = _limit = None
+        _cosmos_flight = AsyncSingleFlight("cosmos_query")
+        _embedding_flight = AsyncSingleFlight("embedding")
+
+
+async def get_container():
+    """Async container client sharing one pooled aiohttp session, created on first use"""
+    global _cosmos_client, _container, _session
+    _bind_loop()
+    if _container is None:
+        import aiohttp
+        from azure.core.pipeline.transport import AioHttpTransport
+        from azure.cosmos.aio import CosmosClient
+
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=COSMOS_POOL_SIZE))
+        transport = AioHttpTransport(session=_session, session_owner=False)
+        _cosmos_client = CosmosClient.from_connection_string(vector_search.COSMOS_CONNECTION_STRING, transport=transport)
+        database = _cosmos_client.get_database_client(vector_search.DATABASE_NAME)
+        _container = database.get_container_client(vector_search.CONTAINER_NAME)
+    return _container
+
+
+def get_limit() -> asyncio.Semaphore:
+    global _limit
+    _bind_loop()
+    if _limit is None:
+        _limit = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+    return _limit
+
+
+async def close():
+    global _loop, _cosmos_client, _container, _session, _limit
+    if _cosmos_client is not None:
+        await _cosmos_client.close()
+    if _session is not None:
+        await _session.close()
+    _loop = _cosmos_client = _container = _session = _limit = None
+
+
+async def guarded(upstream, fn):
+    """fn() through the upstream's timeout and circuit breaker when RESILIENCE_ENABLED is on"""
+    if not vector_search.RESILIENCE_ENABLED:
+        return await fn()
+    return await upstream.call_async(fn)
+
+
+async def shared(flight: AsyncSingleFlight, key: str, fn, copy=None):
+    """fn() once for identical concurrent calls on this loop when COALESCE_REQUESTS is on"""
+    if not vector_search.COALESCE_REQUESTS:
+        return await fn()
+    return await flight.do(key, fn, copy)
+
+
+async def embed_query(query_text: str) -> List[float]:
+    cache = vector_search.embedding_cache
+    model = vector_search.get_embedding_model()
+    deployment = model_name(model)
+
+    async def embed():
+        async with get_limit():
+            return await guarded(vector_search.get_upstream("embedding"), lambda: model.aembed_query(query_text))
+
+    with metrics.stage("embedding"):
+        vector = cache.get(query_text, deployment)
+        if vector is None:
+            _bind_loop()
+            embedding = await shared(_embedding_flight, request_key(deployment, normalize_query(query_text)), embed)
+            vector = cache.put(query_text, embedding, deployment)
+        return vector.tolist()
+
+
+async def query_items(db_query: str, parameters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Identical concurrent queries share one round trip, like vector_search.query_cosmos"""
+    async def query():
+        container = await get_container()
+        async with get_limit():
+            with metrics.stage("cosmos_query") as span:
+                items = container.query_items(query=db_query, parameters=parameters,
+                                              response_hook=metrics.cosmos_response_hook(span))
+                results = [item async for item in items]
+                span["items"] = len(results)
+                return results
+
+    _bind_loop()
+    return await shared(_cosmos_flight, request_key(db_query, parameters),
+                        lambda: guarded(vector_search.get_upstream("cosmos"), query),
+                        copy=lambda items: [dict(item) for item in items])
+
+
+async def get_embedding(movie_name: str, movie_id: Optional[str] = None) -> Optional[List[float]]:
+    if vector_search.TITLE_LOOKUP_ENABLED:
+        try:
+            embedding = await asyncio.to_thread(_lookup_embedding, movie_name, movie_id)
+            if embedding is not None:
+                return embedding.tolist()
+        except Exception as e:
+            print(f"Error loading title lookup: {e}")
+
+    find_movie_query = """
+        SELECT VALUE c.embedding
+        FROM c
+        WHERE c.title = @movie_name
+    """
+    parameters = [{"name": "@movie_name", "value": movie_name}]
+    try:
+        result_items = await query_items(find_movie_query, parameters)
+        return result_items[0] if result_items else None
+    except Exception as e:
+        print(f"Error fetching embedding for movie '{movie_name}': {e}")
+        return None
+
+
+def _lookup_embedding(movie_name: str, movie_id: Optional[str]):
+    lookup = vector_search.get_title_lookup()
+    row = lookup.row_for_id(movie_id) if movie_id is not None else None
+    return lookup.embeddings[row] if row is not None else lookup.get(movie_name)
+
+
+async def vector_search_async(query_text: str, top_k=5) -> List[Dict[str, Any]]:
+    return await search_with_filtersAndPrompt(query_text, top_k, year_range=None, rating_range=None)
+
+
+async def ranked_window(kind: str, query: str, needed: int, year_range, rating_range, genre, compute) -> List[Dict[str, Any]]:
+    """vector_search.ranked_window for a coroutine compute(n, needed), same windows and cache entries"""
+    if not vector_search.RESULT_CACHE_ENABLED:
+        return await compute(needed, needed)
+    window = vector_search.RESULT_WINDOW * max(1, -(-needed // vector_search.RESULT_WINDOW))
+    key = result_key(kind, query, year_range, rating_range, genre, window)
+    results = vector_search.result_cache.get(key)
+    metrics.count("result_cache_total", kind=kind, result="hit" if results is not None and len(results) >= needed else "miss")
+    if results is None or len(results) < needed:
+        results = await compute(window, needed)
+        if results and not vector_search.is_degraded(results):
+            vector_search.result_cache.put(key, results)
+    return results
+
+
+def diversified(compute):
+    """vector_search.diversified for a coroutine compute function"""
+    if not vector_search.DIVERSITY_RERANK_ENABLED:
+        return compute
+
+    async def run(n, needed):
+        results = await compute(max(n, vector_search.DIVERSITY_CANDIDATES), needed)
+        # the first call loads the title lookup
+        return await asyncio.to_thread(vector_search.diversify, results, n)
+
+    return run
+
+
+async def search_with_filtersAndPrompt(query_text: str, top_k=5, year_range=[1921, 2025], rating_range=[0.0, 10.0],
+                                       genre=None) -> List[Dict[str, Any]]:
+    if genre is None:
+        genre = []
+    with metrics.trace("search_with_filtersAndPrompt_async", top_k=top_k):
+        results = await ranked_window("prompt", query_text, top_k, year_range, rating_range, genre,
+                                      diversified(lambda n, needed: _search_with_filtersAndPrompt(query_text, n, year_range, rating_range, genre)))
+        return results[:top_k]
+
+
+async def _search_with_filtersAndPrompt(query_text: str, top_k, year_range, rating_range, genre) -> List[Dict[str, Any]]:
+    lexical_results = None
+    if vector_search.HYBRID_SEARCH_ENABLED:
+        # in memory, but the first call builds the index so it runs off the event loop
+        lexical_results = await asyncio.to_thread(vector_search.lexical_search, query_text, top_k, year_range,
+                                                  rating_range, genre)
+        keyword_results = vector_search.keyword_only_results(query_text, lexical_results, top_k)
+        if keyword_results is not None:
+            return keyword_results
+
+    # start embedding straight away, the container client is warmed up while it runs
+    embedding_task = asyncio.create_task(embed_query(query_text))
+    if vector_search.SEARCH_BACKEND != "local":
+        await get_container()
+    try:
+        query_embedding = await embedding_task
+    except Exception as e:
+        print(f"Error in embedding: {e}")
+        return []
+
+    results = await _vector_results(query_embedding, top_k, year_range, rating_range, genre)
+    if lexical_results is not None:
+        return vector_search.fuse_hybrid(query_embedding, results, lexical_results)[:top_k]
+    return results
+
+
+async def _vector_results(query_embedding, top_k, year_range, rating_range, genre) -> List[Dict[str, Any]]:
+    if vector_search.SEARCH_BACKEND == "local":
+        # the scan (or a round trip to the shard workers) runs off the event loop
+        return await asyncio.to_thread(vector_search.local_search, query_embedding, top_k, year_range,
+                                       rating_range, genre)
+
+    filters, filter_parameters = "", []
+    if year_range is not None and rating_range is not None:
+        filters, filter_parameters = vector_search.get_filter_parameters(year_range, rating_range, genre)
+    parameters = [
+        {"name": "@embedding", "value": query_embedding},
+        {"name": "@num_results", "value": top_k}
+    ] + filter_parameters
+    try:
+        return await query_items(vector_search.build_vector_query(filters), parameters)
+    except Exception as e:
+        print(f"Error in vector search: {e} could not find vector")
+        return []
+
+
+# movie_id picks one movie when several share a title, like vector_search.find_similar
+
+async def find_similar(movie_name: str, top_k=5, year_range=[1921, 2025], rating_range=[0.0, 10.0],
+                       genre=None, movie_id=None) -> List[Dict[str, Any]]:
+    if genre is None:
+        genre = []
+    query = f"{movie_name}\x00{movie_id}" if movie_id is not None else movie_name
+    with metrics.trace("find_similar_async", movie=movie_name, top_k=top_k):
+        results = await ranked_window("similar", query, top_k, year_range, rating_range, genre,
+                                      diversified(lambda n, needed: _find_similar(movie_name, n, year_range, rating_range,
+                                                                                  genre, needed, movie_id)))
+        return results[:top_k]
+
+
+async def _find_similar(movie_name: str, top_k, year_range, rating_range, genre, min_results=None,
+                        movie_id=None) -> List[Dict[str, Any]]:
+
+    precomputed = await asyncio.to_thread(vector_search.similar_from_table, movie_name, top_k, year_range,
+                                          rating_range, genre, min_results, movie_id)
+    if precomputed is not None:
+        return precomputed
+
+    query_embedding = await get_embedding(movie_name, movie_id)
+    if query_embedding is None:
+        print(f"Error: Could not find embedding for source movie '{movie_name}'.")
+        return []
+
+    try:
+        if vector_search.SEARCH_BACKEND == "local":
+            results = await asyncio.to_thread(vector_search.local_search, query_embedding, top_k + 1, year_range,
+                                              rating_range, genre)
+        else:
+            filters, filter_parameters = vector_search.get_filter_parameters(year_range, rating_range, genre)
+            parameters = [
+                {"name": "@embedding", "value": query_embedding},
+                {"name": "@num_results", "value": top_k + 1}
+            ] + filter_parameters
+            results = await query_items(vector_search.build_vector_query(filters), parameters)
+        return vector_search.without_source(results, movie_name, movie_id)[:top_k]
+    except Exception as e:
+        print(f"Error in finding similar movies: {e}")
+        return []
@@ -0,0 +1,174 @@
+import hashlib
+import random
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# local stand-ins for the cosmos container and the embedding model, so the search
+# entry points can be measured without azure
+
+GENRES = [
+    "Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary",
+    "Drama", "Family", "Fantasy", "History", "Horror", "Music", "Mystery",
+    "Romance", "Science Fiction", "TV Movie", "Thriller", "War", "Western"
+]
+MIN_YEAR = 1920
+MAX_YEAR = 2024
+
+WORDS = [
+    "night", "city", "dark", "love", "war", "return", "star", "king", "last", "blue", "river", "ghost",
+    "house", "summer", "storm", "secret", "road", "iron", "silent", "golden", "wild", "lost", "empire", "dream",
+]
+
+
+class Latency:
+    """Sleeps for a base delay plus uniform jitter, both in milliseconds"""
+
+    def __init__(self, base_ms: float = 0.0, jitter_ms: float = 0.0, seed: int = 0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self._random = random.Random(seed)
+
+    def wait(self):
+        delay = self.base_ms + (self._random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+
+def make_catalogue(size: int, dim: int, clusters: int = 64, seed: int = 0) -> List[Dict[str, Any]]:
+    """Synthetic movies with clustered embeddings, uniform years, ratings in half steps and 1-3 genres"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    embeddings = centres[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    years = rng.integers(MIN_YEAR, MAX_YEAR + 1, size)
+    ratings = rng.integers(0, 21, size) / 2
+    movies = []
+    for i in range(size):
+        title = " ".join(WORDS[j] for j in rng.integers(0, len(WORDS), rng.integers(1, 4))).title()
+        movies.append({
+            "id": str(i),
+            "title": f"{title} {i}",
+            "genres": [GENRES[j] for j in rng.choice(len(GENRES), rng.integers(1, 4), replace=False)],
+            "rating": float(ratings[i]),
+            "year": int(years[i]),
+            "plot_summary": f"Summary of movie {i}. " * 20,
+            "plot_synopsis": f"Synopsis of movie {i}. " * 80,
+            "embedding": embeddings[i].tolist(),
+            "_ts": 1,
+        })
+    return movies
+
+
+def text_embedding(text: str, dim: int) -> List[float]:
+    """Deterministic unit vector for a text"""
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddings:
+    """embed_query / embed_documents / aembed_query like AzureOpenAIEmbeddings"""
+
+    deployment = "fake-embeddings"
+
+    def __init__(self, dim: int, latency: Optional[Latency] = None):
+        self.dim = dim
+        self.latency = latency or Latency()
+        self.calls = 0
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        self.latency.wait()
+        return text_embedding(text, self.dim)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.latency.wait()
+        return [text_embedding(text, self.dim) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+SELECT_FIELDS = re.compile(r"SELECT\s+(?:TOP\s+@\w+\s+)?(VALUE\s+)?(.*?)\s+FROM\s+c\b", re.S | re.I)
+VECTOR_DISTANCE = re.compile(r"VectorDistance\([^)]*\)\s+AS\s+\w+", re.I)
+
+
+class FakeContainer:
+    """Answers the query shapes vector_search sends, brute force over an in-memory catalogue"""
+
+    def __init__(self, movies: List[Dict[str, Any]], latency: Optional[Latency] = None,
+                 request_charge: float = 0.0):
+        self.movies = movies
+        self.latency = latency or Latency()
+        self.request_charge = request_charge
+        self.calls = 0
+        self._embeddings = np.asarray([movie["embedding"] for movie in movies], dtype=np.float32)
+        self._years = np.array([movie["year"] for movie in movies])
+        self._ratings = np.array([movie["rating"] for movie in movies])
+        self._by_id = {movie["id"]: row for row, movie in enumerate(movies)}
+
+    def _project(self, row: int, fields: List[str], value: bool, score: Optional[float] = None):
+        movie = self.movies[row]
+        if value:
+            return movie[fields[0]]
+        item = {field: movie.get(field) for field in fields}
+        if score is not None:
+            item["similarity_score"] = float(score)
+        return item
+
+    def _filter_rows(self, params: Dict[str, Any]) -> np.ndarray:
+        mask = np.ones(len(self.movies), dtype=bool)
+        if "@min_year" in params:
+            mask &= (self._years >= params["@min_year"]) & (self._years <= params["@max_year"])
+            mask &= (self._ratings >= params["@min_rating"]) & (self._ratings <= params["@max_rating"])
+        genres = {value for name, value in params.items() if name.startswith("@genre")}
+        if genres:
+            mask &= np.array([bool(genres.intersection(movie["genres"])) for movie in self.movies])
+        if "@since" in params:
+            mask &= np.array([movie["_ts"] > params["@since"] for movie in self.movies])
+        if "@movie_name" in params:
+            mask &= np.array([movie["title"] == params["@movie_name"] for movie in self.movies])
+        if "@exclude_ids" in params:
+            excluded = set(params["@exclude_ids"])
+            mask &= np.array([movie["id"] not in excluded for movie in self.movies])
+        if "@titles" in params:
+            titles, ids = set(params["@titles"]), set(params.get("@ids", []))
+            mask &= np.array([movie["title"] in titles or movie["id"] in ids for movie in self.movies])
+        return np.flatnonzero(mask)
+
+    def query_items(self, query: str, parameters: Optional[List[Dict[str, Any]]] = None,
+                    enable_cross_partition_query: bool = False, response_hook=None, **kwargs):
+        """One page per query, its headers go to response_hook like the azure client's"""
+        items = self._query_items(query, parameters)
+        if response_hook is not None:
+            response_hook({"x-ms-request-charge": str(self.request_charge)}, items)
+        return iter(items)
+
+    def _query_items(self, query: str, parameters: Optional[List[Dict[str, Any]]]) -> List[Any]:
+        self.calls += 1
+        self.latency.wait()
+        params = {p["name"]: p["value"] for p in parameters or []}
+        match = SELECT_FIELDS.search(query)
+        value = bool(match.group(1))
+        fields = re.findall(r"c\.(\w+)", VECTOR_DISTANCE.sub("", match.group(2)))
+
+        if "@ids" in params and "@titles" not in params:
+            rows = [self._by_id[movie_id] for movie_id in params["@ids"] if movie_id in self._by_id]
+            return [self._project(row, fields, value) for row in rows]
+
+        rows = self._filter_rows(params)
+        embedding = params.get("@embedding", params.get("@query_embedding"))
+        if embedding is None:
+            return [self._project(row, fields, value) for row in rows]
+
+        top = params.get("@num_results", params.get("@top_k"))
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        query_vector /= np.linalg.norm(query_vector)
+        scores = self._embeddings[rows] @ query_vector
+        best = np.argsort(-scores, kind="stable")[:top]
+        return [self._project(rows[i], fields, value, scores[i]) for i in best]
@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import vector_search
+from embedding_cache import EmbeddingCache
+from fakes import MIN_YEAR, MAX_YEAR, FakeContainer, FakeEmbeddings, Latency, make_catalogue
+
+# python benchmarks/run_benchmarks.py --sizes 1000,10000 --top-k 5,20 --selectivity 1,0.1,0.01
+
+ENTRY_POINTS = ["vector_search", "find_similar", "search_with_filtersAndPrompt"]
+
+
+def year_range_for(selectivity: float):
+    """Years are uniform in the synthetic catalogue, so a slice of the span keeps that fraction"""
+    span = MAX_YEAR - MIN_YEAR + 1
+    width = max(1, int(round(span * selectivity)))
+    return (MIN_YEAR, MIN_YEAR + width - 1)
+
+
+def percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def measure(call: Callable[[int], Any], iterations: int, warmup: int) -> Dict[str, float]:
+    for i in range(warmup):
+        call(-1 - i)
+    latencies = []
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        call(i)
+        latencies.append((time.perf_counter() - call_started) * 1000)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "throughput_qps": iterations / elapsed if elapsed else 0.0,
+        "peak_mib": peak / (1024 * 1024),
+    }
+
+
+def entry_point(name: str, movies: List[Dict[str, Any]], top_k: int, year_range, repeat: bool) -> Callable[[int], Any]:
+    titles = [movie["title"] for movie in movies]
+    picks = random.Random(0)
+
+    def prompt(i: int) -> str:
+        # unique prompts measure the embedding path, repeated ones the caches
+        return "a moody thriller" if repeat else f"a moody thriller about {i}"
+
+    if name == "vector_search":
+        return lambda i: vector_search.vector_search(prompt(i), top_k)
+    if name == "find_similar":
+        return lambda i: vector_search.find_similar(titles[picks.randrange(len(titles))], top_k, year_range)
+    return lambda i: vector_search.search_with_filtersAndPrompt(prompt(i), top_k, year_range)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the search entry points against local stand-ins")
+    parser.add_argument("--sizes", default="1000,10000", help="catalogue sizes, comma separated")
+    parser.add_argument("--dim", type=int, default=256, help="embedding dimension")
+    parser.add_argument("--top-k", default="5,20", help="top_k values, comma separated")
+    parser.add_argument("--selectivity", default="1,0.1,0.01", help="fraction of the catalogue the year filter keeps")
+    parser.add_argument("--backend", default=vector_search.SEARCH_BACKEND, choices=["cosmos", "local"])
+    parser.add_argument("--entry-points", default=",".join(ENTRY_POINTS))
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--with-cache", action="store_true", help="keep the result cache on and repeat queries")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    vector_search.SEARCH_BACKEND = args.backend
+    vector_search.RESULT_CACHE_ENABLED = args.with_cache
+    vector_search.SIMILAR_TABLE_PATH = os.devnull
+    # a memory-only cache of its own: clearing it between runs must never touch the sqlite tier from .env
+    vector_search.embedding_cache = EmbeddingCache(vector_search.EMBEDDING_CACHE_BYTES)
+
+    rows = []
+    print(f"{'entry point':<30} {'size':>8} {'top_k':>5} {'sel':>6} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'qps':>9} {'peak MiB':>9}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        movies = make_catalogue(size, args.dim)
+        container = FakeContainer(movies, Latency(args.cosmos_latency_ms, args.jitter_ms, seed=1))
+        embeddings = FakeEmbeddings(args.dim, Latency(args.embedding_latency_ms, args.jitter_ms, seed=2))
+        vector_search.set_clients(container, embeddings)
+        for top_k in [int(k) for k in args.top_k.split(",")]:
+            for selectivity in [float(s) for s in args.selectivity.split(",")]:
+                year_range = year_range_for(selectivity)
+                for name in args.entry_points.split(","):
+                    # vector_search has no filters, one run per top_k is enough
+                    if name == "vector_search" and selectivity != 1.0:
+                        continue
+                    if not args.with_cache:
+                        vector_search.embedding_cache.clear(persistent=False)
+                    result = measure(entry_point(name, movies, top_k, year_range, args.with_cache),
+                                     args.iterations, args.warmup)
+                    result.update({"entry_point": name, "size": size, "top_k": top_k, "selectivity": selectivity,
+                                   "backend": args.backend})
+                    rows.append(result)
+                    print(f"{name:<30} {size:>8} {top_k:>5} {selectivity:>6g} {result['p50_ms']:>8.2f} "
+                          f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['throughput_qps']:>9.1f} "
+                          f"{result['peak_mib']:>9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
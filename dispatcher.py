@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional
+
+import metrics
+from embedding_cache import model_name, normalize_query
+
+# shared by every session in the process: identical requests already in flight are joined instead of sent
+# again (singleflight), and distinct prompts arriving within a short window go out as one embed_documents call
+
+
+class SingleFlight:
+    def __init__(self, kind: str = "request"):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any], copy: Optional[Callable[[Any], Any]] = None) -> Any:
+        """fn() once for all concurrent callers with the same key. Followers get copy(result) when given,
+        so no caller can change another's result."""
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            metrics.count("coalesced_requests_total", kind=self.kind)
+            result = future.result()
+            return copy(result) if copy is not None else result
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines, on the event loop it is used from. The shared call runs as its own
+    task, so a caller that is cancelled doesn't cancel it for the others."""
+
+    def __init__(self, kind: str = "request"):
+        self.kind = kind
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]],
+                 copy: Optional[Callable[[Any], Any]] = None) -> Any:
+        future = self._in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = self._in_flight[key] = asyncio.ensure_future(fn())
+            future.add_done_callback(lambda done: self._done(key, done))
+        else:
+            metrics.count("coalesced_requests_total", kind=self.kind)
+        result = await asyncio.shield(future)
+        return copy(result) if copy is not None and not leader else result
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # every caller may have gone, don't log the error as never retrieved
+        if not future.cancelled():
+            future.exception()
+
+
+class _Batch:
+    def __init__(self):
+        self.items: List[Any] = []
+        self.futures: List[Future] = []
+
+
+class MicroBatcher:
+    """Collects items for up to window_seconds (or max_batch items) and runs fn(items) once for all of them.
+    The first caller of a batch waits out the window and runs it, no background thread. A caller with no
+    other request in flight runs straight away, there is nothing to wait for."""
+
+    def __init__(self, fn: Callable[[List[Any]], List[Any]], window_seconds: float, max_batch: int = 64):
+        self.fn = fn
+        self.window_seconds = window_seconds
+        self.max_batch = max(1, max_batch)
+        self._lock = threading.Lock()
+        self._open: Optional[_Batch] = None
+        # callers inside submit(), waiting for or running a batch
+        self._in_flight = 0
+
+    def submit(self, item: Any) -> Any:
+        future = Future()
+        with self._lock:
+            self._in_flight += 1
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            batch.items.append(item)
+            batch.futures.append(future)
+            full = len(batch.items) >= self.max_batch
+            alone = leader and self._in_flight == 1
+            if full or alone:
+                self._open = None
+        try:
+            if full or alone:
+                self._run(batch)
+            elif leader:
+                time.sleep(self.window_seconds)
+                with self._lock:
+                    mine = self._open is batch
+                    if mine:
+                        self._open = None
+                # a full batch was already run by the caller that filled it
+                if mine:
+                    self._run(batch)
+            return future.result()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _run(self, batch: _Batch):
+        metrics.get_sink().observe("micro_batch_size", len(batch.items))
+        try:
+            results = list(self.fn(batch.items))
+            if len(results) != len(batch.items):
+                raise ValueError(f"batch of {len(batch.items)} items returned {len(results)} results")
+            for future, result in zip(batch.futures, results):
+                future.set_result(result)
+        except BaseException as e:
+            # every caller gets an answer, none is left waiting on its future
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+
+
+class CoalescingEmbeddings:
+    """Wraps an embeddings client: embed_query joins identical in-flight texts and batches distinct ones
+    through embed_documents. Everything else goes to the wrapped model."""
+
+    def __init__(self, model, window_seconds: float = 0.01, max_batch: int = 64):
+        self.model = model
+        self.deployment = model_name(model)
+        self._flight = SingleFlight("embedding")
+        self._batcher = MicroBatcher(model.embed_documents, window_seconds, max_batch) if window_seconds > 0 else None
+
+    def embed_query(self, text: str) -> List[float]:
+        def embed():
+            if self._batcher is None:
+                return self.model.embed_query(text)
+            return self._batcher.submit(text)
+
+        return self._flight.do(normalize_query(text), embed, copy=list)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def request_key(*parts) -> str:
+    """Stable key for a query and its parameters (parameters may hold a whole embedding)"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
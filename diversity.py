@@ -0,0 +1,82 @@
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from title_lookup import normalize_title
+
+# maximal marginal relevance over an over-fetched candidate list: every pick trades its relevance against its
+# similarity to the movies already picked, and a franchise gets one title until the other candidates run out,
+# so sequels, remakes and near-duplicates don't fill a page
+
+SEQUEL_SUFFIX = re.compile(r"(\s+(part|chapter|vol\.?|volume|episode))?\s+([0-9]+|[ivx]+)$")
+
+
+def franchise_key(title: str) -> str:
+    """'The Matrix Reloaded: Part II' and 'The Matrix Reloaded' share a key, as do numbered sequels"""
+    key = normalize_title(title or "")
+    key = re.split(r":| - ", key, maxsplit=1)[0].strip()
+    key = SEQUEL_SUFFIX.sub("", key)
+    if key.startswith("the "):
+        key = key[4:]
+    return key
+
+
+def genre_similarity(genres: List[List[str]]) -> np.ndarray:
+    """Jaccard similarity of the genre sets, (n, n)"""
+    vocabulary = {name: i for i, name in enumerate(sorted({name for names in genres for name in names or []}))}
+    one_hot = np.zeros((len(genres), max(1, len(vocabulary))), dtype=np.float32)
+    for row, names in enumerate(genres):
+        for name in names or []:
+            one_hot[row, vocabulary[name]] = 1.0
+    shared = one_hot @ one_hot.T
+    sizes = one_hot.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - shared
+    return shared / np.maximum(union, 1.0)
+
+
+def pairwise_similarity(results: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None,
+                        known: Optional[np.ndarray] = None) -> np.ndarray:
+    """Cosine similarity between candidates whose embeddings are known, genre overlap for the rest"""
+    similarity = genre_similarity([movie.get("genres") or [] for movie in results])
+    if embeddings is not None and known is not None and known.any():
+        both = known[:, None] & known[None, :]
+        similarity = np.where(both, embeddings @ embeddings.T, similarity)
+    return similarity
+
+
+def mmr_order(relevance: np.ndarray, similarity: np.ndarray, lambda_: float, k: int,
+              franchises: Optional[np.ndarray] = None) -> np.ndarray:
+    """Greedy MMR: next = argmax lambda * relevance - (1 - lambda) * max similarity to the picked ones.
+    A second title from an already picked franchise only comes once every other candidate is used."""
+    n = len(relevance)
+    k = min(k, n)
+    picked = np.empty(k, dtype=np.int64)
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    fresh = np.ones(n, dtype=bool)
+    for i in range(k):
+        score = lambda_ * relevance - (1 - lambda_) * redundancy
+        allowed = available & fresh
+        score[~(allowed if allowed.any() else available)] = -np.inf
+        best = int(np.argmax(score))
+        picked[i] = best
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+        if franchises is not None:
+            fresh &= franchises != franchises[best]
+    return picked
+
+
+def rerank(results: List[Dict[str, Any]], top_k: int, lambda_: float = 0.5, embeddings: Optional[np.ndarray] = None,
+           known: Optional[np.ndarray] = None) -> List[Dict[str, Any]]:
+    """The top_k of `results` (ranked by similarity_score) in MMR order.
+    embeddings are unit length rows aligned with results, known marks the rows that were found."""
+    if len(results) < 2:
+        return results[:top_k]
+    # relevance is rescaled to 0..1 over the candidates so lambda means the same for cosine and fused scores
+    relevance = np.array([movie.get("similarity_score") or 0.0 for movie in results], dtype=np.float32)
+    relevance = (relevance - relevance.min()) / ((relevance.max() - relevance.min()) or 1.0)
+    similarity = pairwise_similarity(results, embeddings, known)
+    _, franchises = np.unique([franchise_key(movie.get("title")) for movie in results], return_inverse=True)
+    return [results[row] for row in mmr_order(relevance, similarity, lambda_, top_k, franchises)]
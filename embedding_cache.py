@@ -0,0 +1,112 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    """Case and whitespace insensitive form of a query, used as the cache key"""
+    return " ".join(text.split()).casefold()
+
+
+def model_name(model) -> str:
+    return getattr(model, "deployment", None) or getattr(model, "model", None) or ""
+
+
+# query embedding cache: in-memory LRU bounded by bytes, optional sqlite tier on disk
+
+class EmbeddingCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, db_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+            self._db.commit()
+
+    @staticmethod
+    def key(text: str, deployment: str = "") -> str:
+        raw = f"{deployment}\x00{normalize_query(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, text: str, deployment: str = "") -> Optional[np.ndarray]:
+        key = self.key(text, deployment)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.hits += 1
+                    return vector
+            self.misses += 1
+            return None
+
+    def put(self, text: str, vector, deployment: str = "") -> np.ndarray:
+        key = self.key(text, deployment)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                 (key, vector.tobytes()))
+                self._db.commit()
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.current_bytes -= previous.nbytes
+        self._entries[key] = vector
+        self.current_bytes += vector.nbytes
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def clear(self, persistent: bool = True):
+        """Drops the in-memory entries, and the sqlite table too unless persistent is False"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            if persistent and self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                self._db.commit()
+
+    def embed_query(self, model, text: str) -> List[float]:
+        """Return the cached embedding for text, calling the model only on a miss"""
+        deployment = model_name(model)
+        vector = self.get(text, deployment)
+        if vector is None:
+            vector = self.put(text, model.embed_query(text), deployment)
+        return vector.tolist()
+
+    def embed_queries(self, model, texts: List[str], batch_size: int = 256) -> np.ndarray:
+        """Embeddings for many texts as one float32 matrix, misses go through embed_documents in batches"""
+        deployment = model_name(model)
+        vectors = [self.get(text, deployment) for text in texts]
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(normalize_query(texts[i]), []).append(i)
+        pending = list(missing.values())
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            embedded = model.embed_documents([texts[positions[0]] for positions in batch])
+            for positions, embedding in zip(batch, embedded):
+                vector = self.put(texts[positions[0]], embedding, deployment)
+                for i in positions:
+                    vectors[i] = vector
+        return np.vstack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
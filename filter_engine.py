@@ -0,0 +1,128 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# year / rating / genre filtering over the local catalogue:
+# sorted columns answer range lookups, one bitset per genre, combined into a candidate mask
+
+
+class FilterEngine:
+    def __init__(self, years: np.ndarray, ratings: np.ndarray, genres: List[List[str]]):
+        vocabulary = sorted({genre for movie_genres in genres for genre in movie_genres or []})
+        codes = {genre: code for code, genre in enumerate(vocabulary)}
+        offsets = np.zeros(len(genres) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(movie_genres or []) for movie_genres in genres])
+        genre_codes = np.array([codes[genre] for movie_genres in genres for genre in movie_genres or []], dtype=np.int64)
+        self._build(years, ratings, vocabulary, offsets, genre_codes)
+
+    @classmethod
+    def from_genre_codes(cls, years: np.ndarray, ratings: np.ndarray, vocabulary: List[str],
+                         offsets: np.ndarray, codes: np.ndarray) -> "FilterEngine":
+        """Row i has genres vocabulary[codes[offsets[i]:offsets[i + 1]]], vocabulary sorted"""
+        engine = cls.__new__(cls)
+        engine._build(years, ratings, vocabulary, offsets, codes)
+        return engine
+
+    @classmethod
+    def from_catalogue(cls, catalogue, start: int = 0, end: Optional[int] = None) -> "FilterEngine":
+        """Over catalogue rows start..end, row 0 of the engine being catalogue row `start`"""
+        end = len(catalogue) if end is None else end
+        years, ratings = catalogue.years[start:end], catalogue.ratings[start:end]
+        if hasattr(catalogue.records, "genre_codes"):
+            vocabulary, offsets, codes = catalogue.records.genre_codes()
+            return cls.from_genre_codes(years, ratings, vocabulary, offsets[start:end + 1] - offsets[start],
+                                        codes[offsets[start]:offsets[end]])
+        return cls(years, ratings, [catalogue.records[row].get("genres") or [] for row in range(start, end)])
+
+    def _build(self, years: np.ndarray, ratings: np.ndarray, vocabulary: List[str], offsets: np.ndarray,
+               codes: np.ndarray):
+        self.size = len(years)
+        self.years = years
+        self.ratings = ratings
+        self._year_order = np.argsort(years, kind="stable")
+        self._sorted_years = years[self._year_order]
+        self._rating_order = np.argsort(ratings, kind="stable")
+        self._sorted_ratings = ratings[self._rating_order]
+
+        self.genres = list(vocabulary)
+        self._codes = {genre: code for code, genre in enumerate(self.genres)}
+        codes = np.asarray(codes, dtype=np.int64)
+        code_rows = np.repeat(np.arange(self.size), np.diff(offsets))
+        members = {genre: np.unique(code_rows[codes == code]) for genre, code in self._codes.items()}
+        self.genre_counts = {genre: len(rows) for genre, rows in members.items()}
+        self._genre_bitsets = {}
+        for genre, rows in members.items():
+            bits = np.zeros(self.size, dtype=bool)
+            bits[rows] = True
+            self._genre_bitsets[genre] = np.packbits(bits)
+        # per-row genre codes for checking a handful of candidates without building a full mask
+        self._row_genres = np.zeros((self.size, max(1, -(-len(self.genres) // 64))), dtype=np.uint64)
+        for genre, rows in members.items():
+            word, bit = divmod(self._codes[genre], 64)
+            self._row_genres[rows, word] |= np.uint64(1) << np.uint64(bit)
+
+    def _range(self, sorted_values: np.ndarray, bounds) -> Tuple[int, int]:
+        lo = np.searchsorted(sorted_values, bounds[0], side="left")
+        hi = np.searchsorted(sorted_values, bounds[1], side="right")
+        return int(lo), int(hi)
+
+    def _genre_query(self, genres: Optional[List[str]]) -> np.ndarray:
+        wanted = np.zeros(self._row_genres.shape[1], dtype=np.uint64)
+        for genre in genres or []:
+            if genre in self._codes:
+                word, bit = divmod(self._codes[genre], 64)
+                wanted[word] |= np.uint64(1) << np.uint64(bit)
+        return wanted
+
+    def is_unfiltered(self, year_range, rating_range, genres) -> bool:
+        return year_range is None and rating_range is None and not genres
+
+    def estimate_selectivity(self, year_range, rating_range, genres: Optional[List[str]] = None) -> float:
+        """Fraction of the catalogue expected to pass, assuming the three filters are independent"""
+        if self.size == 0:
+            return 0.0
+        selectivity = 1.0
+        if year_range is not None:
+            lo, hi = self._range(self._sorted_years, year_range)
+            selectivity *= (hi - lo) / self.size
+        if rating_range is not None:
+            lo, hi = self._range(self._sorted_ratings, rating_range)
+            selectivity *= (hi - lo) / self.size
+        if genres:
+            # genres are OR-ed, the sum over-counts multi-genre movies so cap it
+            selectivity *= min(1.0, sum(self.genre_counts.get(genre, 0) for genre in genres) / self.size)
+        return selectivity
+
+    def mask(self, year_range, rating_range, genres: Optional[List[str]] = None) -> np.ndarray:
+        """Boolean mask over every catalogue row passing the filters"""
+        mask = np.ones(self.size, dtype=bool)
+        if year_range is not None:
+            lo, hi = self._range(self._sorted_years, year_range)
+            in_range = np.zeros(self.size, dtype=bool)
+            in_range[self._year_order[lo:hi]] = True
+            mask &= in_range
+        if rating_range is not None:
+            lo, hi = self._range(self._sorted_ratings, rating_range)
+            in_range = np.zeros(self.size, dtype=bool)
+            in_range[self._rating_order[lo:hi]] = True
+            mask &= in_range
+        if genres:
+            packed = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+            for genre in genres:
+                if genre in self._genre_bitsets:
+                    packed |= self._genre_bitsets[genre]
+            mask &= np.unpackbits(packed, count=self.size).astype(bool)
+        return mask
+
+    def matches(self, rows: np.ndarray, year_range, rating_range, genres: Optional[List[str]] = None) -> np.ndarray:
+        """Which of the given rows pass the filters, without touching the rest of the catalogue"""
+        keep = np.ones(len(rows), dtype=bool)
+        if year_range is not None:
+            years = self.years[rows]
+            keep &= (years >= year_range[0]) & (years <= year_range[1])
+        if rating_range is not None:
+            ratings = self.ratings[rows]
+            keep &= (ratings >= rating_range[0]) & (ratings <= rating_range[1])
+        if genres:
+            keep &= (self._row_genres[rows] & self._genre_query(genres)).any(axis=1)
+        return keep
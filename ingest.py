@@ -0,0 +1,301 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional
+
+# streaming ingestion: read the dataset in chunks, embed changed movies in batches and upsert them,
+# with a checkpoint so an interrupted run picks up where it stopped
+
+INGEST_FIELDS = ["id", "title", "genres", "rating", "year", "plot_summary", "plot_synopsis"]
+
+EXISTING_HASHES_QUERY = """
+    SELECT c.id, c.content_hash
+    FROM c
+    WHERE ARRAY_CONTAINS(@ids, c.id)
+"""
+
+
+def read_chunks(path: str, chunk_rows: int, skip_rows: int = 0) -> Iterator[List[Dict[str, Any]]]:
+    """Lists of at most chunk_rows raw records, the first skip_rows records are dropped"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        chunks = _jsonl_chunks(path, chunk_rows)
+    elif extension == ".csv":
+        import pandas as pd
+        chunks = (frame.to_dict("records") for frame in pd.read_csv(path, chunksize=chunk_rows))
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pylist() for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows))
+    else:
+        raise ValueError(f"Unsupported dataset format: {path}")
+
+    for chunk in chunks:
+        if skip_rows >= len(chunk):
+            skip_rows -= len(chunk)
+            continue
+        yield chunk[skip_rows:]
+        skip_rows = 0
+
+
+def _jsonl_chunks(path: str, chunk_rows: int) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                chunk.append(json.loads(line))
+                if len(chunk) == chunk_rows:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
+
+
+def _missing(value) -> bool:
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def parse_genres(value) -> List[str]:
+    """Genres arrive as lists, "['Drama', 'Crime']" strings or "Drama|Crime" / "Drama, Crime" strings"""
+    if _missing(value):
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith("["):
+            try:
+                value = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
+                value = value.strip("[]")
+        if isinstance(value, str):
+            separator = "|" if "|" in value else ","
+            value = value.split(separator)
+    return [str(genre).strip().strip("'\"") for genre in value if str(genre).strip().strip("'\"")]
+
+
+def normalize_record(raw: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Container document for a dataset row, without the embedding. None when the row has no id or title"""
+    movie_id = raw.get("id", raw.get("movie_id"))
+    title = raw.get("title")
+    if _missing(movie_id) or _missing(title):
+        return None
+    if isinstance(movie_id, float) and movie_id.is_integer():
+        movie_id = int(movie_id)
+    year = raw.get("year")
+    rating = raw.get("rating")
+    return {
+        "id": str(movie_id),
+        "title": str(title),
+        "genres": parse_genres(raw.get("genres")),
+        "rating": None if _missing(rating) else float(rating),
+        "year": None if _missing(year) else int(year),
+        "plot_summary": "" if _missing(raw.get("plot_summary")) else str(raw["plot_summary"]),
+        "plot_synopsis": "" if _missing(raw.get("plot_synopsis")) else str(raw["plot_synopsis"]),
+    }
+
+
+def embedding_text(record: Dict[str, Any], max_chars: int) -> str:
+    text = "\n\n".join(part for part in (record["plot_summary"], record["plot_synopsis"]) if part)
+    return (text or record["title"])[:max_chars]
+
+
+def content_hash(record: Dict[str, Any], deployment: str) -> str:
+    """Hash of everything a document is built from, including the embedding deployment"""
+    payload = json.dumps([deployment] + [record[field] for field in INGEST_FIELDS], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def is_rate_limited(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "RateLimit" in type(error).__name__
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(error, "headers", None) or getattr(getattr(error, "response", None), "headers", None) or {}
+    for name in ("retry-after-ms", "x-ms-retry-after-ms"):
+        if headers.get(name):
+            return float(headers[name]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            return None
+    return None
+
+
+def with_backoff(call, max_retries: int = 8, base_delay: float = 1.0, max_delay: float = 60.0):
+    """Runs call(), retrying rate-limit errors with exponential backoff and full jitter"""
+    for attempt in range(max_retries + 1):
+        try:
+            return call()
+        except Exception as e:
+            if attempt == max_retries or not is_rate_limited(e):
+                raise
+            delay = retry_after(e) or random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            time.sleep(delay)
+
+
+# checkpoint: number of leading dataset rows fully written, only advanced over contiguous finished chunks
+
+def load_checkpoint(path: Optional[str], source: str) -> int:
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("source") != os.path.abspath(source):
+        print(f"Checkpoint {path} belongs to {checkpoint.get('source')}, starting from the beginning")
+        return 0
+    return int(checkpoint.get("rows_done", 0))
+
+
+def save_checkpoint(path: Optional[str], source: str, rows_done: int):
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"source": os.path.abspath(source), "rows_done": rows_done, "saved_at": time.time()}, f)
+    os.replace(tmp, path)
+
+
+class Ingestor:
+    def __init__(self, container, embedding_model, batch_size: int = 256, max_chars: int = 20000,
+                 upsert_workers: int = 8, force: bool = False):
+        self.container = container
+        self.embedding_model = embedding_model
+        self.batch_size = batch_size
+        self.max_chars = max_chars
+        self.force = force
+        self.deployment = getattr(embedding_model, "deployment", None) or getattr(embedding_model, "model", None) or ""
+        self._upserts = ThreadPoolExecutor(max_workers=upsert_workers)
+
+    def existing_hashes(self, ids: List[str]) -> Dict[str, str]:
+        items = with_backoff(lambda: list(self.container.query_items(
+            query=EXISTING_HASHES_QUERY,
+            parameters=[{"name": "@ids", "value": ids}],
+            enable_cross_partition_query=True,
+        )))
+        return {item["id"]: item.get("content_hash") for item in items}
+
+    def process_chunk(self, chunk: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Embeds and upserts the changed movies of one chunk, returns counters"""
+        stats = {"rows": len(chunk), "invalid": 0, "unchanged": 0, "upserted": 0}
+        records = {}
+        for raw in chunk:
+            record = normalize_record(raw)
+            if record is None:
+                stats["invalid"] += 1
+                continue
+            record["content_hash"] = content_hash(record, self.deployment)
+            # a later duplicate id in the same chunk wins, like it would across chunks
+            records[record["id"]] = record
+
+        if not self.force and records:
+            existing = self.existing_hashes(list(records))
+            for movie_id in [movie_id for movie_id, record in records.items()
+                             if existing.get(movie_id) == record["content_hash"]]:
+                del records[movie_id]
+                stats["unchanged"] += 1
+
+        pending = list(records.values())
+        # the previous batch's upserts run while the next batch is being embedded
+        upserting = []
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            texts = [embedding_text(record, self.max_chars) for record in batch]
+            embeddings = with_backoff(lambda: self.embedding_model.embed_documents(texts))
+            for record, embedding in zip(batch, embeddings):
+                record["embedding"] = [float(x) for x in embedding]
+            stats["upserted"] += self._wait_upserts(upserting)
+            upserting = [self._upserts.submit(with_backoff, lambda record=record: self.container.upsert_item(record))
+                         for record in batch]
+        stats["upserted"] += self._wait_upserts(upserting)
+        return stats
+
+    @staticmethod
+    def _wait_upserts(futures) -> int:
+        for future in futures:
+            future.result()
+        return len(futures)
+
+    def run(self, path: str, chunk_rows: int = 1000, workers: int = 4, checkpoint_path: Optional[str] = None) -> Dict[str, int]:
+        """Streams the dataset through process_chunk with at most `workers` chunks in flight"""
+        rows_done = load_checkpoint(checkpoint_path, path)
+        if rows_done:
+            print(f"Resuming after {rows_done} rows")
+        totals = {"rows": 0, "invalid": 0, "unchanged": 0, "upserted": 0}
+        started = time.perf_counter()
+        # chunks finish out of order, the checkpoint only moves past rows whose chunk and all earlier ones are done
+        finished: Dict[int, int] = {}
+        next_index = 0
+        in_flight = {}
+
+        def collect(done):
+            nonlocal rows_done, next_index
+            for future in done:
+                index, size = in_flight.pop(future)
+                for key, value in future.result().items():
+                    totals[key] += value
+                finished[index] = size
+            while next_index in finished:
+                rows_done += finished.pop(next_index)
+                next_index += 1
+            save_checkpoint(checkpoint_path, path, rows_done)
+            elapsed = time.perf_counter() - started
+            print(f"{rows_done} rows done, {totals['upserted']} upserted, {totals['unchanged']} unchanged, "
+                  f"{totals['rows'] / elapsed if elapsed else 0:.0f} rows/s")
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            try:
+                for index, chunk in enumerate(read_chunks(path, chunk_rows, rows_done)):
+                    # bounded read-ahead: never more than `workers` chunks in memory
+                    if len(in_flight) >= workers:
+                        collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                    in_flight[pool.submit(self.process_chunk, chunk)] = (index, len(chunk))
+                while in_flight:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+            finally:
+                # let running chunks finish so the checkpoint covers them, drop the ones not started
+                for future in list(in_flight):
+                    future.cancel()
+                wait(in_flight)
+                done = [future for future in in_flight if not future.cancelled() and future.exception() is None]
+                if done:
+                    collect(done)
+                self._upserts.shutdown(wait=True)
+        return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed a movie dataset and upsert it into the container")
+    parser.add_argument("dataset", help="CSV, JSONL or Parquet file with id, title, genres, rating, year, "
+                                        "plot_summary and plot_synopsis columns")
+    parser.add_argument("--chunk-rows", type=int, default=1000, help="rows read and processed together")
+    parser.add_argument("--workers", type=int, default=4, help="chunks embedded and upserted concurrently")
+    parser.add_argument("--upsert-workers", type=int, default=8, help="concurrent upserts per process")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("EMBEDDING_BATCH_SIZE", "256")),
+                        help="texts per embedding request")
+    parser.add_argument("--max-chars", type=int, default=20000, help="plot text is cut to this many characters")
+    parser.add_argument("--checkpoint", default=None, help="progress file, defaults to <dataset>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--force", action="store_true", help="re-embed rows even when their content hash is unchanged")
+    args = parser.parse_args()
+
+    checkpoint = args.checkpoint or f"{args.dataset}.checkpoint.json"
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    import vector_search
+    ingestor = Ingestor(vector_search.get_container(), vector_search.get_embedding_model(), args.batch_size,
+                        args.max_chars, args.upsert_workers, args.force)
+    totals = ingestor.run(args.dataset, args.chunk_rows, args.workers, checkpoint)
+    print(f"Read {totals['rows']} rows: {totals['upserted']} upserted, {totals['unchanged']} unchanged, "
+          f"{totals['invalid']} skipped without id or title")
+    if totals["upserted"]:
+        print("Catalogue changed, refresh the similar table with: python similar_table.py update")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import re
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from filter_engine import FilterEngine
+from local_index import RANKING_FIELDS, top_k_rows
+
+# BM25 keyword search over title + plot text, fused with the vector results for hybrid search
+
+TEXT_QUERY = """
+    SELECT c.id, c.title, c.genres, c.rating, c.year, c.plot_summary, c.plot_synopsis
+    FROM c
+"""
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "he", "her", "his", "in",
+    "is", "it", "its", "me", "movie", "movies", "of", "on", "or", "she", "so", "that", "the", "their", "them",
+    "they", "this", "to", "was", "with", "who", "film", "films", "about", "something", "some", "like", "want",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN.findall((text or "").casefold()) if len(token) > 1 and token not in STOPWORDS]
+
+
+class BM25Index:
+    """Inverted index in CSR form: postings of term t are docs[offsets[t]:offsets[t + 1]] with their
+    precomputed BM25 term weights, so a query is one scatter-add per query term"""
+
+    def __init__(self, documents: Iterable[Tuple[str, str]], k1: float = 1.2, b: float = 0.75,
+                 title_weight: float = 2.0):
+        postings: Dict[str, Tuple[List[int], List[float]]] = {}
+        lengths = []
+        for doc, (title, body) in enumerate(documents):
+            counts = Counter(tokenize(body))
+            for token in tokenize(title):
+                counts[token] += title_weight
+            lengths.append(sum(counts.values()))
+            for token, count in counts.items():
+                docs, tfs = postings.setdefault(token, ([], []))
+                docs.append(doc)
+                tfs.append(count)
+
+        self.size = len(lengths)
+        lengths = np.asarray(lengths, dtype=np.float32)
+        average = float(lengths.mean()) if self.size and lengths.mean() > 0 else 1.0
+        terms = sorted(postings)
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(postings[term][0]) for term in terms])
+        self.docs = np.empty(self.offsets[-1], dtype=np.int32)
+        self.weights = np.empty(self.offsets[-1], dtype=np.float32)
+        document_frequency = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log(1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        for i, term in enumerate(terms):
+            docs, tfs = postings.pop(term)
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = np.asarray(docs, dtype=np.int32)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            self.docs[start:end] = docs
+            self.weights[start:end] = tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths[docs] / average))
+
+    def search(self, query: str, top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, scores) of the best top_k documents containing at least one query term"""
+        terms = [self.vocabulary[token] for token in set(tokenize(query)) if token in self.vocabulary]
+        if not terms or self.size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = np.zeros(self.size, dtype=np.float32)
+        for term in terms:
+            start, end = self.offsets[term], self.offsets[term + 1]
+            scores[self.docs[start:end]] += self.idf[term] * self.weights[start:end]
+        if mask is not None:
+            scores[~mask] = 0
+        rows = np.flatnonzero(scores)
+        best = top_k_rows(scores[rows], top_k)
+        return rows[best], scores[rows[best]]
+
+
+# keyword search returning the same movie dicts as the vector search, with the same filters
+
+class LexicalSearch:
+    def __init__(self, index: BM25Index, filters: FilterEngine, result: Callable[[int, float], Dict[str, Any]]):
+        self.index = index
+        self.filters = filters
+        self.result = result
+
+    @classmethod
+    def from_catalogue(cls, catalogue, filters: FilterEngine, **params) -> "LexicalSearch":
+        """Shares row numbers and filters with the local search backend"""
+        documents = zip(catalogue.column("title"),
+                        (f"{summary or ''}\n{synopsis or ''}" for summary, synopsis in
+                         zip(catalogue.column("plot_summary"), catalogue.column("plot_synopsis"))))
+        return cls(BM25Index(documents, **params), filters, catalogue.result)
+
+    @classmethod
+    def from_container(cls, container, **params) -> "LexicalSearch":
+        """Reads the plot text once to build the index, only the ranking fields are kept"""
+        movies = []
+
+        def documents():
+            for item in container.query_items(query=TEXT_QUERY, enable_cross_partition_query=True):
+                movies.append({field: item.get(field) for field in RANKING_FIELDS})
+                yield item.get("title") or "", f"{item.get('plot_summary') or ''}\n{item.get('plot_synopsis') or ''}"
+
+        index = BM25Index(documents(), **params)
+        filters = FilterEngine(np.array([movie.get("year") or 0 for movie in movies], dtype=np.int32),
+                               np.array([movie.get("rating") or 0.0 for movie in movies], dtype=np.float32),
+                               [movie.get("genres") or [] for movie in movies])
+
+        def result(row: int, score: float) -> Dict[str, Any]:
+            return {**movies[row], "similarity_score": float(score)}
+
+        return cls(index, filters, result)
+
+    def search(self, query: str, top_k: int, year_range=None, rating_range=None,
+               genre: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        mask = None
+        if not self.filters.is_unfiltered(year_range, rating_range, genre):
+            mask = self.filters.mask(year_range, rating_range, genre)
+        rows, scores = self.index.search(query, top_k, mask)
+        return [self.result(row, score) for row, score in zip(rows, scores)]
+
+
+def fuse(vector_results: List[Dict[str, Any]], lexical_results: List[Dict[str, Any]], lexical_weight: float,
+         vector_scores: Optional[Callable[[List[str]], Dict[str, float]]] = None) -> List[Dict[str, Any]]:
+    """Weighted sum of min-max normalised vector scores and max normalised BM25 scores.
+    vector_scores(ids) fills in the similarity of keyword-only matches when it is cheap to compute,
+    otherwise they count as the weakest vector match."""
+    similarity = {movie["id"]: movie["similarity_score"] for movie in vector_results}
+    missing = [movie["id"] for movie in lexical_results if movie["id"] not in similarity]
+    if missing and vector_scores is not None:
+        similarity.update(vector_scores(missing))
+    lexical = {movie["id"]: movie["similarity_score"] for movie in lexical_results}
+
+    low = min(similarity.values(), default=0.0)
+    spread = (max(similarity.values(), default=0.0) - low) or 1.0
+    top_lexical = max(lexical.values(), default=0.0) or 1.0
+    movies = {movie["id"]: movie for movie in lexical_results}
+    movies.update({movie["id"]: movie for movie in vector_results})
+    fused = {
+        movie_id: (1 - lexical_weight) * (similarity[movie_id] - low) / spread if movie_id in similarity else 0.0
+        for movie_id in movies
+    }
+    for movie_id, score in lexical.items():
+        fused[movie_id] += lexical_weight * score / top_lexical
+    ranked = sorted(movies, key=lambda movie_id: -fused[movie_id])
+    return [{**movies[movie_id], "similarity_score": fused[movie_id]} for movie_id in ranked]
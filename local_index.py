@@ -0,0 +1,329 @@
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+
+from filter_engine import FilterEngine
+from quantization import build_store, make_store, PQStore
+
+# fields returned for every movie, same shape as the cosmos queries
+MOVIE_FIELDS = ["id", "title", "genres", "rating", "year", "plot_summary", "plot_synopsis"]
+
+# searches only return what the cards show, the long plot text is fetched on demand
+RANKING_FIELDS = ["id", "title", "genres", "rating", "year"]
+DETAIL_FIELDS = ["plot_summary", "plot_synopsis"]
+
+SNAPSHOT_QUERY = """
+    SELECT
+        c.id,
+        c.title,
+        c.genres,
+        c.rating,
+        c.year,
+        c.plot_summary,
+        c.plot_synopsis,
+        c.embedding,
+        c._ts
+    FROM c
+"""
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale every row to unit length so a dot product is the cosine similarity"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def top_k_matrix(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise top_k_rows for a (queries x candidates) score matrix"""
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def score_top_k(embeddings, query: np.ndarray, top_k: int, rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Best top_k rows of an embedding store (optionally only among `rows`) with their scores.
+    Approximate stores shortlist `rerank` times more candidates and re-score those exactly."""
+    scores = embeddings.scores(query, rows)
+    if not embeddings.approximate:
+        best = top_k_rows(scores, top_k)
+        return (best if rows is None else rows[best]), scores[best]
+    shortlist = top_k_rows(scores, top_k * embeddings.rerank)
+    candidates = shortlist if rows is None else rows[shortlist]
+    exact = embeddings.exact.scores(query, candidates)
+    best = top_k_rows(exact, top_k)
+    return candidates[best], exact[best]
+
+
+# in memory copy of the movie container
+
+class Catalogue:
+    def __init__(self, records: List[Dict[str, Any]], embeddings, last_modified: int = 0,
+                 storage: str = "float32", pq_subspaces: int = 0, rerank: int = 8,
+                 years: Optional[np.ndarray] = None, ratings: Optional[np.ndarray] = None):
+        self.records = records
+        self.last_modified = last_modified
+        # a float32 matrix is encoded here, stores built while streaming from the container are kept as they are
+        if isinstance(embeddings, (np.ndarray, list)):
+            embeddings = make_store(normalize_rows(embeddings), storage)
+        if pq_subspaces and not embeddings.approximate and len(embeddings):
+            embeddings = PQStore.train(embeddings, pq_subspaces, rerank)
+        self.embeddings = embeddings
+        # snapshots pass their columns in directly instead of walking every record
+        self.years = years if years is not None else np.array([r.get("year") or 0 for r in records], dtype=np.int32)
+        self.ratings = ratings if ratings is not None else np.array([r.get("rating") or 0.0 for r in records], dtype=np.float32)
+
+    def __len__(self):
+        return len(self.records)
+
+    def column(self, field: str) -> List[Any]:
+        """One field of every record, read straight from the columns when the records support it"""
+        if hasattr(self.records, "column"):
+            return self.records.column(field)
+        return [record.get(field) for record in self.records]
+
+    @classmethod
+    def from_container(cls, container, storage: str = "float32", pq_subspaces: int = 0, rerank: int = 8,
+                       chunk_rows: int = 4096) -> "Catalogue":
+        """Read every movie and its embedding out of the container.
+        Embeddings are encoded a chunk at a time, never held as one big list of Python floats."""
+        records = []
+        state = {"last_modified": 0}
+
+        def chunks():
+            pending = []
+            for item in container.query_items(query=SNAPSHOT_QUERY, enable_cross_partition_query=True):
+                embedding = item.pop("embedding", None)
+                if not embedding:
+                    continue
+                records.append({field: item.get(field) for field in MOVIE_FIELDS})
+                pending.append(embedding)
+                state["last_modified"] = max(state["last_modified"], item.get("_ts") or 0)
+                if len(pending) == chunk_rows:
+                    yield normalize_rows(pending)
+                    pending = []
+            if pending:
+                yield normalize_rows(pending)
+
+        embeddings = build_store(chunks(), storage)
+        return cls(records, embeddings, state["last_modified"], pq_subspaces=pq_subspaces, rerank=rerank)
+
+    def result(self, row: int, score: float) -> Dict[str, Any]:
+        record = self.records[row]
+        movie = {field: record.get(field) for field in RANKING_FIELDS}
+        movie["similarity_score"] = float(score)
+        return movie
+
+
+# exact search, scores the whole matrix
+
+class FlatIndex:
+    def __init__(self, embeddings: np.ndarray):
+        self.embeddings = embeddings
+
+    def search(self, query: np.ndarray, top_k: int, mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.flatnonzero(mask) if mask is not None else None
+        return score_top_k(self.embeddings, query, top_k, rows)
+
+
+# inverted file index: k-means coarse quantizer, only the n_probe closest lists are scanned
+
+class IVFIndex:
+    def __init__(self, embeddings: np.ndarray, n_lists: Optional[int] = None, n_probe: int = 8,
+                 iterations: int = 10, seed: int = 0):
+        self.embeddings = embeddings
+        n = embeddings.shape[0]
+        if n_lists is None:
+            n_lists = int(np.sqrt(n)) or 1
+        self.n_lists = max(1, min(n_lists, n))
+        self.n_probe = max(1, min(n_probe, self.n_lists))
+        self.centroids = self._train(iterations, seed)
+        assignments = self._assign(embeddings)
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(self.n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.n_lists)]
+
+    @classmethod
+    def from_lists(cls, embeddings, centroids: np.ndarray, order: np.ndarray, bounds: np.ndarray,
+                   n_probe: int = 8) -> "IVFIndex":
+        """Index from saved centroids and list members, skips k-means and assignment"""
+        index = cls.__new__(cls)
+        index.embeddings = embeddings
+        index.centroids = centroids
+        index.n_lists = len(centroids)
+        index.n_probe = max(1, min(n_probe, index.n_lists))
+        index.lists = [order[bounds[i]:bounds[i + 1]] for i in range(index.n_lists)]
+        return index
+
+    def list_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(order, bounds): list members concatenated, list i is order[bounds[i]:bounds[i + 1]]"""
+        sizes = [len(members) for members in self.lists]
+        bounds = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+        order = np.concatenate(self.lists) if self.lists else np.empty(0, dtype=np.int64)
+        return order.astype(np.int64), bounds
+
+    def _train(self, iterations: int, seed: int) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        n = self.embeddings.shape[0]
+        # train on a sample, a few hundred points per list is plenty for spherical k-means
+        sample_size = min(n, self.n_lists * 256)
+        sample = self.embeddings[rng.choice(n, sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = np.bincount(labels, minlength=self.n_lists) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        return centroids
+
+    def _assign(self, vectors: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        labels = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk):
+            labels[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ self.centroids.T, axis=1)
+        return labels
+
+    def search(self, query: np.ndarray, top_k: int, mask: Optional[np.ndarray] = None,
+               n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        probe = top_k_rows(self.centroids @ query, n_probe)
+        rows = np.concatenate([self.lists[i] for i in probe])
+        if mask is not None:
+            rows = rows[mask[rows]]
+            # selective filter left too few candidates in the probed lists, scan the whole subset
+            if rows.shape[0] < top_k:
+                rows = np.flatnonzero(mask)
+        return score_top_k(self.embeddings, query, top_k, rows)
+
+
+def build_index(embeddings: np.ndarray, index_type: str = "ivf", **params):
+    if index_type == "flat":
+        return FlatIndex(embeddings)
+    if index_type == "ivf":
+        return IVFIndex(embeddings, **params)
+    raise ValueError(f"Unknown index type '{index_type}'")
+
+
+# search backend answering from the local snapshot instead of cosmos
+
+class LocalSearchBackend:
+    def __init__(self, catalogue: Catalogue, index_type: str = "ivf", prefilter_selectivity: float = 0.05,
+                 overfetch: float = 2.0, index=None, **params):
+        self.catalogue = catalogue
+        # a prebuilt index (e.g. loaded from a snapshot) skips training
+        self.index = index if index is not None else build_index(catalogue.embeddings, index_type, **params)
+        self.filters = FilterEngine.from_catalogue(catalogue)
+        # filters expected to keep less than this fraction are searched by brute force over the
+        # matching rows, anything looser searches the index and drops rows that don't match
+        self.prefilter_selectivity = prefilter_selectivity
+        self.overfetch = overfetch
+        self._title_lookup = None
+
+    @property
+    def title_lookup(self):
+        # row numbers line up with the catalogue, unlike a lookup loaded from the container
+        if self._title_lookup is None:
+            from title_lookup import TitleLookup
+            self._title_lookup = TitleLookup.from_catalogue(self.catalogue)
+        return self._title_lookup
+
+    def _mask(self, year_range, rating_range, genre) -> Optional[np.ndarray]:
+        if self.filters.is_unfiltered(year_range, rating_range, genre):
+            return None
+        return self.filters.mask(year_range, rating_range, genre)
+
+    def _prefiltered(self, query: np.ndarray, top_k: int, year_range, rating_range, genre) -> Tuple[np.ndarray, np.ndarray]:
+        rows = np.flatnonzero(self.filters.mask(year_range, rating_range, genre))
+        return score_top_k(self.catalogue.embeddings, query, top_k, rows)
+
+    def search(self, query_embedding, top_k=5, year_range=None, rating_range=None,
+               genre: Optional[List[str]] = None, exclude_rows: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """top_k results passing the filters, never any of exclude_rows"""
+        query = normalize_rows(query_embedding)
+        excluded = np.unique(np.asarray(exclude_rows if exclude_rows is not None else [], dtype=np.int64))
+        # at most len(excluded) of the results can be dropped, fetch that many more
+        rows, scores = self._search_rows(query, top_k + len(excluded), year_range, rating_range, genre)
+        if len(excluded):
+            keep = ~np.isin(rows, excluded)
+            rows, scores = rows[keep][:top_k], scores[keep][:top_k]
+        return [self.catalogue.result(row, score) for row, score in zip(rows, scores)]
+
+    def _search_rows(self, query: np.ndarray, top_k: int, year_range, rating_range, genre) -> Tuple[np.ndarray, np.ndarray]:
+        if self.filters.is_unfiltered(year_range, rating_range, genre):
+            rows, scores = self.index.search(query, top_k)
+        else:
+            selectivity = self.filters.estimate_selectivity(year_range, rating_range, genre)
+            if isinstance(self.index, FlatIndex) or selectivity <= self.prefilter_selectivity:
+                rows, scores = self._prefiltered(query, top_k, year_range, rating_range, genre)
+            else:
+                fetch = int(np.ceil(top_k * self.overfetch / selectivity))
+                rows, scores = self.index.search(query, fetch)
+                keep = self.filters.matches(rows, year_range, rating_range, genre)
+                rows, scores = rows[keep][:top_k], scores[keep][:top_k]
+                # the estimate was off or the matches sit outside the probed lists
+                if len(rows) < top_k:
+                    rows, scores = self._prefiltered(query, top_k, year_range, rating_range, genre)
+        return rows, scores
+
+    def search_batch(self, query_embeddings, top_k=5, year_range=None, rating_range=None,
+                     genre: Optional[List[str]] = None, exclude_rows: Optional[List[List[int]]] = None,
+                     chunk_bytes: int = 256 * 1024 * 1024) -> List[List[Dict[str, Any]]]:
+        """Exact top_k for many queries at once, one matrix multiply per chunk of queries.
+        exclude_rows[i] lists catalogue rows that must not be returned for query i."""
+        queries = normalize_rows(query_embeddings)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        mask = self._mask(year_range, rating_range, genre)
+        embeddings = self.catalogue.embeddings
+        allowed = None
+        if mask is not None:
+            allowed = np.flatnonzero(mask)
+        candidates = len(embeddings) if allowed is None else len(allowed)
+        if candidates == 0:
+            return [[] for _ in range(queries.shape[0])]
+
+        # approximate stores keep a longer shortlist per query and re-rank it exactly
+        shortlist = top_k * embeddings.rerank if embeddings.approximate else top_k
+        chunk = max(1, chunk_bytes // (4 * candidates))
+        results = []
+        for start in range(0, queries.shape[0], chunk):
+            scores = embeddings.scores(queries[start:start + chunk], allowed)
+            if exclude_rows is not None:
+                for offset, rows in enumerate(exclude_rows[start:start + chunk]):
+                    if not rows:
+                        continue
+                    rows = np.asarray(rows)
+                    if allowed is not None:
+                        rows = np.searchsorted(allowed, rows[np.isin(rows, allowed)])
+                    scores[offset, rows] = -np.inf
+            best = top_k_matrix(scores, shortlist)
+            for offset, columns in enumerate(best):
+                row_scores = scores[offset, columns]
+                keep = np.isfinite(row_scores)
+                columns, row_scores = columns[keep], row_scores[keep]
+                rows = allowed[columns] if allowed is not None else columns
+                if embeddings.approximate:
+                    exact = embeddings.exact.scores(queries[start + offset], rows)
+                    order = top_k_rows(exact, top_k)
+                    rows, row_scores = rows[order], exact[order]
+                results.append([self.catalogue.result(row, score) for row, score in zip(rows, row_scores)])
+        return results
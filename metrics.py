@@ -0,0 +1,266 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# per-stage instrumentation for the search entry points.
+# stages report to a pluggable sink (no-op by default, Prometheus text exporter available) and, when a
+# trace is active, to that trace so one request can be inspected on its own
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HISTOGRAM_BUCKETS = {
+    "cosmos_request_charge": (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    "search_results": (0, 1, 5, 10, 20, 50, 100, 200, 500),
+    "micro_batch_size": (1, 2, 4, 8, 16, 32, 64, 128, 256),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class NullSink:
+    """Default sink, drops everything"""
+
+    def observe(self, name: str, value: float, **labels):
+        pass
+
+    def increment(self, name: str, value: float = 1, **labels):
+        pass
+
+
+class PrometheusSink:
+    """Keeps histograms and counters in memory and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> labels -> [bucket counts..., sum, count]
+        self._histograms: Dict[str, Dict[Labels, List[float]]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._server = None
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = HISTOGRAM_BUCKETS.get(name, LATENCY_BUCKETS)
+        key = _labels(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            values = series.get(key)
+            if values is None:
+                values = series[key] = [0.0] * (len(buckets) + 2)
+            # first bucket whose upper bound is >= value, anything past the last bound only counts in +Inf
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                values[index] += 1
+            values[-2] += value
+            values[-1] += 1
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = _labels(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def render(self) -> str:
+        def label_text(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+            pairs = list(labels) + ([extra] if extra else [])
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                buckets = HISTOGRAM_BUCKETS.get(name, LATENCY_BUCKETS)
+                lines.append(f"# TYPE {name} histogram")
+                for labels, values in sorted(self._histograms[name].items()):
+                    cumulative = 0.0
+                    for bound, count in zip(buckets, values):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{label_text(labels, ('le', f'{bound:g}'))} {cumulative:g}")
+                    lines.append(f"{name}_bucket{label_text(labels, ('le', '+Inf'))} {values[-1]:g}")
+                    lines.append(f"{name}_sum{label_text(labels)} {values[-2]:g}")
+                    lines.append(f"{name}_count{label_text(labels)} {values[-1]:g}")
+            for name in sorted(self._counters):
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{label_text(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "0.0.0.0"):
+        """Expose /metrics on a background thread"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+
+_sink = NullSink()
+
+
+def get_sink():
+    return _sink
+
+
+def set_sink(sink):
+    global _sink
+    _sink = sink if sink is not None else NullSink()
+
+
+# per-request traces
+
+class Trace:
+    def __init__(self, entry_point: str, **attrs):
+        self.entry_point = entry_point
+        self.attrs = attrs
+        self.spans: List[Dict[str, Any]] = []
+        self.started = time.perf_counter()
+        self.total_ms: Optional[float] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"entry_point": self.entry_point, **self.attrs, "total_ms": self.total_ms, "stages": self.spans}
+
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("search_trace", default=None)
+_collected: contextvars.ContextVar = contextvars.ContextVar("search_traces", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def collect_traces() -> Iterator[List[Trace]]:
+    """Every trace finished inside the block is appended to the yielded list (for the UI debug panel)"""
+    traces: List[Trace] = []
+    token = _collected.set(traces)
+    try:
+        yield traces
+    finally:
+        _collected.reset(token)
+
+
+@contextmanager
+def trace(entry_point: str, **attrs) -> Iterator[Trace]:
+    """One search request. Nested entry points (search_with_filtersAndPrompt -> search_page) join the
+    trace already open instead of starting another"""
+    active = _current_trace.get()
+    if active is not None:
+        yield active
+        return
+    current = Trace(entry_point, **attrs)
+    token = _current_trace.set(current)
+    status = "ok"
+    try:
+        yield current
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        elapsed = time.perf_counter() - current.started
+        current.total_ms = round(elapsed * 1000, 3)
+        _sink.observe("search_seconds", elapsed, entry_point=entry_point)
+        _sink.increment("search_requests_total", entry_point=entry_point, status=status)
+        collected = _collected.get()
+        if collected is not None:
+            collected.append(current)
+
+
+def add_traces(traces: List[Dict[str, Any]]):
+    """Traces recorded in another process (the recommendation service), collected like local ones"""
+    collected = _collected.get()
+    if collected is None:
+        return
+    for data in traces:
+        remote = Trace(data.get("entry_point", "remote"))
+        remote.attrs = {name: value for name, value in data.items() if name not in ("entry_point", "total_ms", "stages")}
+        remote.spans = data.get("stages", [])
+        remote.total_ms = data.get("total_ms")
+        collected.append(remote)
+
+
+@contextmanager
+def stage(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """Times one stage of the current request. The yielded dict is the trace span, callers may add
+    attributes to it (result counts, request charge). Exceptions are counted and re-raised."""
+    active = _current_trace.get()
+    entry_point = active.entry_point if active is not None else "none"
+    span = {"stage": name, **attrs}
+    started = time.perf_counter()
+    try:
+        yield span
+    except Exception as e:
+        span["error"] = f"{type(e).__name__}: {e}"
+        _sink.increment("search_errors_total", stage=name, entry_point=entry_point)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        span["ms"] = round(elapsed * 1000, 3)
+        _sink.observe("search_stage_seconds", elapsed, stage=name, entry_point=entry_point)
+        if active is not None:
+            active.spans.append(span)
+
+
+def count(name: str, value: float = 1, **labels):
+    _sink.increment(name, value, **labels)
+
+
+# cosmos request charge and throttling retries, read from the headers of each response of one query. The
+# client's last_response_headers is shared by every request on the connection (prefetch, hedged and concurrent
+# searches), so the headers come from a response_hook passed to that query only.
+
+def record_cosmos_headers(headers: Dict[str, Any], span: Dict[str, Any]):
+    entry_point = current_trace().entry_point if current_trace() is not None else "none"
+    charge = float(headers.get("x-ms-request-charge") or 0.0)
+    retries = int(headers.get("x-ms-throttle-retry-count") or 0)
+    span["request_charge"] = round(span.get("request_charge", 0.0) + charge, 3)
+    span["retries"] = span.get("retries", 0) + retries
+    span["pages"] = span.get("pages", 0) + 1
+    if charge:
+        _sink.observe("cosmos_request_charge", charge, entry_point=entry_point)
+        _sink.increment("cosmos_request_units_total", charge, entry_point=entry_point)
+    if retries:
+        _sink.increment("cosmos_throttle_retries_total", retries, entry_point=entry_point)
+
+
+def cosmos_response_hook(span: Dict[str, Any]):
+    """response_hook for one query_items call that adds every page's headers to span"""
+    def hook(headers, result=None):
+        # query_items also calls the hook once with the pager itself, before any page was fetched and
+        # with whatever the connection answered last
+        if hasattr(result, "by_page"):
+            return
+        record_cosmos_headers(dict(headers or {}), span)
+    return hook
+
+
+def query_cosmos(container, query: str, parameters: Optional[List[Dict[str, Any]]] = None,
+                 stage_name: str = "cosmos_query") -> List[Dict[str, Any]]:
+    """list(container.query_items(...)) as an instrumented stage, every page's request charge is counted"""
+    with stage(stage_name) as span:
+        items = container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True,
+                                      response_hook=cosmos_response_hook(span))
+        results = list(items)
+        span["items"] = len(results)
+        return results
@@ -0,0 +1,79 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+# speculative searches started while the user is still choosing (a title picked, a prompt entered), so the
+# button only has to pick up the result. one Prefetcher per session keeps just the work for its latest inputs
+
+PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "8"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Worker threads shared by every session in the process"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    return _executor
+
+
+Prefetched = Tuple[Any, List[Dict[str, Any]]]
+
+
+class Prefetcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.key: Optional[str] = None
+        self.future: Optional[Future] = None
+        self._wake = threading.Event()
+
+    def start(self, key: str, fn: Callable[[], Any], delay: float = 0.0):
+        """Run fn() in the background for `key`, replacing the work for any other key (cancelled if it hasn't
+        started, its result dropped otherwise). With a delay fn only runs if the inputs are unchanged by then."""
+        with self._lock:
+            if key == self.key:
+                return
+            if self.future is not None:
+                self.future.cancel()
+            # a debouncing prefetch wakes up, sees the new key and gives its thread back
+            self._wake.set()
+            self._wake = threading.Event()
+            self.key = key
+            self.future = get_executor().submit(self._run, key, fn, delay, self._wake)
+
+    def _run(self, key: str, fn: Callable[[], Any], delay: float, wake: threading.Event) -> Optional[Prefetched]:
+        if delay > 0:
+            wake.wait(delay)
+        if self.key != key:
+            metrics.count("prefetch_total", result="debounced")
+            return None
+        with metrics.collect_traces() as traces:
+            results = fn()
+        return results, [trace.as_dict() for trace in traces]
+
+    def take(self, key: str) -> Optional[Prefetched]:
+        """(results, traces) prefetched for `key`, waiting for it if still running. None when the inputs
+        differ or the prefetch failed. The key is kept, so a rerun with the same inputs doesn't fetch again."""
+        future = None
+        with self._lock:
+            if key == self.key:
+                future, self.future = self.future, None
+                # the button was pressed, no point waiting out the debounce
+                self._wake.set()
+        if future is None:
+            metrics.count("prefetch_total", result="miss")
+            return None
+        try:
+            prefetched = future.result()
+        except Exception as e:
+            print(f"Error in prefetched search: {e}")
+            prefetched = None
+        metrics.count("prefetch_total", result="hit" if prefetched is not None else "miss")
+        return prefetched
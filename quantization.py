@@ -0,0 +1,281 @@
+import abc
+import argparse
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+
+# compact storage for the catalogue embeddings. every store takes unit length float32 rows and exposes:
+#   store[rows]                    -> float32 vectors (decoded)
+#   store.scores(queries, rows)    -> dot products, (n,) for one query or (q, n) for a matrix of queries
+# scalar stores score exactly on the decoded vectors; the product quantized store scores approximately
+# and keeps an exact store to re-rank its shortlist
+
+STORAGE_TYPES = ["float32", "float16", "int8"]
+
+# rows decoded to float32 at a time while scoring, bounds the temporary memory
+SCORE_CHUNK_ROWS = 65536
+
+
+def _select(array: np.ndarray, rows):
+    return array if rows is None else array[rows]
+
+
+class Float32Store:
+    approximate = False
+    storage = "float32"
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.exact = self
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return self.matrix[rows]
+
+    def scores(self, queries: np.ndarray, rows=None) -> np.ndarray:
+        matrix = _select(self.matrix, rows)
+        return queries @ matrix.T
+
+
+class _DecodedStore(abc.ABC):
+    """Stores that decode chunks of rows to float32 and multiply those"""
+    approximate = False
+
+    def __len__(self):
+        return self.shape[0]
+
+    @abc.abstractmethod
+    def _decode(self, rows) -> np.ndarray:
+        """float32 vectors of the given rows"""
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return self._decode(rows)
+
+    def scores(self, queries: np.ndarray, rows=None) -> np.ndarray:
+        n = len(self) if rows is None else len(rows)
+        out = np.empty(queries.shape[:-1] + (n,), dtype=np.float32)
+        for start in range(0, n, SCORE_CHUNK_ROWS):
+            chunk = slice(start, start + SCORE_CHUNK_ROWS) if rows is None else rows[start:start + SCORE_CHUNK_ROWS]
+            out[..., start:start + SCORE_CHUNK_ROWS] = queries @ self._decode(chunk).T
+        return out
+
+
+class Float16Store(_DecodedStore):
+    storage = "float16"
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float16)
+        self.shape = self.matrix.shape
+        self.exact = self
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def _decode(self, rows) -> np.ndarray:
+        return self.matrix[rows].astype(np.float32)
+
+
+class Int8Store(_DecodedStore):
+    """Symmetric scalar quantization with one scale per row"""
+    storage = "int8"
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = scales
+        self.shape = codes.shape
+        self.exact = self
+
+    @classmethod
+    def encode(cls, matrix: np.ndarray) -> "Int8Store":
+        matrix = np.asarray(matrix, dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+    def _decode(self, rows) -> np.ndarray:
+        return self.codes[rows].astype(np.float32) * self.scales[rows, None]
+
+
+def _kmeans(sample: np.ndarray, k: int, iterations: int, rng) -> np.ndarray:
+    """Euclidean k-means, empty clusters keep their previous centroid"""
+    centroids = sample[rng.choice(sample.shape[0], k, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (centroids ** 2).sum(axis=1) - 2 * sample @ centroids.T
+        labels = np.argmin(distances, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class PQStore:
+    """Product quantization: the vector is split into m sub-vectors, each stored as the uint8 id of its
+    nearest sub-centroid. Scores come from per-query lookup tables; `exact` re-ranks the shortlist."""
+    approximate = True
+
+    def __init__(self, exact, centroids: np.ndarray, codes: np.ndarray, rerank: int = 8):
+        self.exact = exact
+        self.centroids = centroids
+        self.codes = codes
+        self.rerank = max(1, rerank)
+        self.m, self.ks, self.sub_dim = centroids.shape
+        self.shape = exact.shape
+        self.storage = f"pq{self.m}+{exact.storage}"
+
+    @classmethod
+    def train(cls, exact, m: int, rerank: int = 8, sample_size: int = 65536, iterations: int = 15,
+              seed: int = 0) -> "PQStore":
+        n, dim = exact.shape
+        rng = np.random.default_rng(seed)
+        sub_dim = -(-dim // m)
+        ks = min(256, n)
+        sample = cls._split(exact[np.sort(rng.choice(n, min(n, sample_size), replace=False))], m, sub_dim)
+        centroids = np.stack([_kmeans(sample[:, j], ks, iterations, rng) for j in range(m)])
+        store = cls(exact, centroids.astype(np.float32), np.empty((n, m), dtype=np.uint8), rerank)
+        for start in range(0, n, SCORE_CHUNK_ROWS):
+            store.codes[start:start + SCORE_CHUNK_ROWS] = store._encode(exact[start:start + SCORE_CHUNK_ROWS])
+        return store
+
+    @staticmethod
+    def _split(vectors: np.ndarray, m: int, sub_dim: int) -> np.ndarray:
+        """(n, dim) -> (n, m, sub_dim), zero padding the last sub-vector"""
+        padded = np.zeros(vectors.shape[:-1] + (m * sub_dim,), dtype=np.float32)
+        padded[..., :vectors.shape[-1]] = vectors
+        return padded.reshape(vectors.shape[:-1] + (m, sub_dim))
+
+    def _encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self._split(vectors, self.m, self.sub_dim)
+        codes = np.empty((vectors.shape[0], self.m), dtype=np.uint8)
+        for j in range(self.m):
+            distances = (self.centroids[j] ** 2).sum(axis=1) - 2 * parts[:, j] @ self.centroids[j].T
+            codes[:, j] = np.argmin(distances, axis=1)
+        return codes
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of the codes and codebooks, the exact store is counted separately"""
+        return self.codes.nbytes + self.centroids.nbytes
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        return self.exact[rows]
+
+    def scores(self, queries: np.ndarray, rows=None) -> np.ndarray:
+        # lookup table: dot product of every query sub-vector with every sub-centroid, (q, m, ks)
+        tables = np.einsum("qms,mks->qmk", self._split(np.atleast_2d(queries), self.m, self.sub_dim), self.centroids)
+        codes = _select(self.codes, rows)
+        out = np.zeros((tables.shape[0], codes.shape[0]), dtype=np.float32)
+        for j in range(self.m):
+            out += tables[:, j, codes[:, j]]
+        return out[0] if queries.ndim == 1 else out
+
+
+def build_store(chunks: Iterable[np.ndarray], storage: str = "float32", dim: Optional[int] = None):
+    """Encode unit length float32 chunks as they arrive, so the full float32 matrix never exists
+    (except for float32 storage)"""
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown embedding storage '{storage}', expected one of {STORAGE_TYPES}")
+    parts, scales = [], []
+    for chunk in chunks:
+        if storage == "float32":
+            parts.append(np.asarray(chunk, dtype=np.float32))
+        elif storage == "float16":
+            parts.append(np.asarray(chunk, dtype=np.float16))
+        else:
+            encoded = Int8Store.encode(chunk)
+            parts.append(encoded.codes)
+            scales.append(encoded.scales)
+    if not parts:
+        parts = [np.empty((0, dim or 0), dtype=np.float32)]
+        scales = [np.empty(0, dtype=np.float32)]
+    matrix = np.concatenate(parts) if len(parts) > 1 else parts[0]
+    if storage == "float32":
+        return Float32Store(matrix)
+    if storage == "float16":
+        return Float16Store(matrix)
+    return Int8Store(matrix.astype(np.int8, copy=False), np.concatenate(scales))
+
+
+def make_store(matrix: np.ndarray, storage: str = "float32", pq_subspaces: int = 0, rerank: int = 8):
+    """Store for a unit length float32 matrix, optionally product quantized on top"""
+    store = build_store([matrix[start:start + SCORE_CHUNK_ROWS] for start in range(0, matrix.shape[0], SCORE_CHUNK_ROWS)],
+                        storage, matrix.shape[1] if matrix.ndim == 2 else None)
+    if pq_subspaces and len(store):
+        store = PQStore.train(store, pq_subspaces, rerank)
+    return store
+
+
+def slice_store(store, start: int, end: int):
+    """Rows start..end of a store as views of its arrays, nothing is copied (memory-mapped snapshots stay mapped)"""
+    if isinstance(store, PQStore):
+        return PQStore(slice_store(store.exact, start, end), store.centroids, store.codes[start:end], store.rerank)
+    if isinstance(store, Int8Store):
+        return Int8Store(store.codes[start:end], store.scales[start:end])
+    return type(store)(store.matrix[start:end])
+
+
+def measure_recall(exact: np.ndarray, store, queries: np.ndarray, top_k: int = 10):
+    """recall@k of searching `store` against exact float32 search, and mean ms per query"""
+    from local_index import score_top_k, top_k_rows
+    hits = 0
+    elapsed = 0.0
+    for query in queries:
+        truth = top_k_rows(exact @ query, top_k)
+        started = time.perf_counter()
+        found, _ = score_top_k(store, query, top_k)
+        elapsed += time.perf_counter() - started
+        hits += len(np.intersect1d(truth, found))
+    return hits / (len(queries) * top_k), 1000 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and recall of the embedding storage options")
+    parser.add_argument("--queries", type=int, default=200, help="catalogue rows used as queries")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--pq-subspaces", default="0,32,64", help="product quantization sub-vectors, 0 for none")
+    parser.add_argument("--rerank", type=int, default=8, help="PQ shortlist size as a multiple of top_k")
+    args = parser.parse_args()
+
+    import vector_search
+    from local_index import Catalogue
+    catalogue = Catalogue.from_container(vector_search.get_container())
+    exact = catalogue.embeddings.matrix
+    rng = np.random.default_rng(0)
+    # perturb the query rows so a movie doesn't trivially find itself
+    queries = exact[rng.choice(len(exact), min(args.queries, len(exact)), replace=False)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    print(f"{len(exact)} movies x {exact.shape[1]} dims")
+    print(f"{'storage':<16} {'MiB':>9} {'recall@' + str(args.top_k):>10} {'ms/query':>9}")
+    for storage in STORAGE_TYPES:
+        for m in [int(m) for m in args.pq_subspaces.split(",")]:
+            store = make_store(exact, storage, m, args.rerank)
+            recall, ms = measure_recall(exact, store, queries, args.top_k)
+            nbytes = store.nbytes + (store.exact.nbytes if store.approximate else 0)
+            print(f"{store.storage:<16} {nbytes / 2 ** 20:>9.1f} {recall:>10.3f} {ms:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
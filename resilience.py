@@ -0,0 +1,321 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterator, List, Optional
+
+import metrics
+from embedding_cache import model_name
+
+# tail-latency protection for the upstream calls (embedding endpoint, Cosmos DB). Every call runs on a worker
+# thread and is given up on after a timeout derived from that upstream's recent latency, a duplicate is sent
+# once it runs past the upstream's p95 (first answer wins), and an upstream that keeps failing is not called
+# at all for a while. The caller only ever waits until the request deadline.
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("search_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """Upstream calls inside the block must finish within `seconds` from now. A deadline already set
+    further out is tightened, never extended."""
+    if not seconds:
+        yield
+        return
+    ends = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(ends if current is None else min(ends, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """Timeouts, lost connections, throttling (429) and server errors (5xx) say the upstream is unhealthy.
+    Anything else, like a Cosmos 400 for a bad query, is the request's fault and must not open the circuit."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # openai APITimeoutError / APIConnectionError / RateLimitError, azure ServiceRequestError / ServiceResponseError
+    name = type(error).__name__
+    return any(kind in name for kind in ("Timeout", "Connection", "RateLimit", "ServiceRequest", "ServiceResponse"))
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the request deadline, None without one"""
+    ends = _deadline.get()
+    return None if ends is None else ends - time.monotonic()
+
+
+class LatencyWindow:
+    """The last `size` call durations of one upstream"""
+
+    def __init__(self, size: int = 256, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """None until min_samples calls were seen"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+
+class CircuitBreaker:
+    """Opens after `failures` failures in a row and rejects calls for reset_seconds. Then one trial call is
+    let through (half open): success closes the circuit, failure opens it again."""
+
+    def __init__(self, name: str, failures: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failures = max(1, failures)
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failed = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self._trial or time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print(f"{self.name} recovered, circuit closed")
+            self._failed = 0
+            self._opened_at = None
+            self._trial = False
+
+    def release(self):
+        """A call that ended without telling whether the upstream works, a half open circuit may try again"""
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failed += 1
+            if self._trial or (self._opened_at is None and self._failed >= self.failures):
+                self._opened_at = time.monotonic()
+                self._trial = False
+                metrics.count("circuit_open_total", upstream=self.name)
+                print(f"Error: {self.name} failed {self._failed} times in a row, circuit open for {self.reset_seconds}s")
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers: int = 32) -> ThreadPoolExecutor:
+    """Threads the upstream calls run on, shared by every upstream. A call given up on keeps its thread
+    until the client returns, so this bounds how many stalled calls can pile up."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(workers, thread_name_prefix="upstream")
+    return _executor
+
+
+class Upstream:
+    """Calls to one upstream service with an adaptive timeout, hedging and a circuit breaker.
+
+    timeout: timeout_multiplier x the p99 of recent calls, stalls included, within [timeout_floor,
+    timeout_ceiling] (the ceiling until enough calls were seen) and never past the request deadline.
+    hedge: a second identical call once the first has run for the p95 of recent answers, while hedges
+    stay under hedge_budget of all calls."""
+
+    def __init__(self, name: str, timeout_floor: float = 1.0, timeout_ceiling: float = 10.0,
+                 timeout_multiplier: float = 3.0, hedge: bool = True, hedge_budget: float = 0.1,
+                 breaker: Optional[CircuitBreaker] = None, workers: int = 32):
+        self.name = name
+        self.timeout_floor = timeout_floor
+        self.timeout_ceiling = max(timeout_floor, timeout_ceiling)
+        self.timeout_multiplier = timeout_multiplier
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.breaker = breaker or CircuitBreaker(name)
+        self.latency = LatencyWindow()
+        # answers only: stalls cut off at the timeout would drag the hedge delay up to the timeout itself
+        self.answered = LatencyWindow()
+        self.workers = workers
+        # calls and hedges are counted from every thread calling this upstream
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._hedges = 0
+
+    def timeout(self) -> float:
+        p99 = self.latency.percentile(99)
+        if p99 is None:
+            return self.timeout_ceiling
+        return min(self.timeout_ceiling, max(self.timeout_floor, p99 * self.timeout_multiplier))
+
+    def hedge_delay(self) -> Optional[float]:
+        with self._lock:
+            if not self.hedge or self._hedges >= self.hedge_budget * self._calls:
+                return None
+        return self.answered.percentile(95)
+
+    def _take_hedge(self) -> bool:
+        """Counts a hedge if the budget still allows one, calls running at the same time share it"""
+        with self._lock:
+            if self._hedges >= self.hedge_budget * self._calls:
+                return False
+            self._hedges += 1
+            return True
+
+    def _count_failure(self, error: BaseException):
+        if is_upstream_failure(error):
+            self.breaker.failure()
+        else:
+            # the upstream answered, with an error about the request
+            self.breaker.success()
+
+    def _submit(self, fn: Callable[[], Any]) -> Future:
+        # the attempt records its stages into the caller's trace
+        return get_executor(self.workers).submit(contextvars.copy_context().run, fn)
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        """fn() on a worker thread. Raises CircuitOpenError without calling when the circuit is open,
+        DeadlineExceeded when no attempt answered in time, or the error of the last failed attempt."""
+        own_timeout = self.timeout()
+        left = remaining()
+        timeout = own_timeout if left is None else min(own_timeout, left)
+        if timeout <= 0:
+            raise DeadlineExceeded(f"request deadline passed before calling {self.name}")
+        if not self.breaker.allow():
+            metrics.count("upstream_rejected_total", upstream=self.name)
+            raise CircuitOpenError(f"{self.name} circuit open")
+        hedge_at = self.hedge_delay()
+        with self._lock:
+            self._calls += 1
+
+        started = time.monotonic()
+        pending = {self._submit(fn)}
+        hedged = False
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                elapsed = time.monotonic() - started
+                if elapsed >= timeout:
+                    break
+                wait_for = timeout - elapsed
+                if not hedged and hedge_at is not None and hedge_at < timeout:
+                    wait_for = min(wait_for, max(0.0, hedge_at - elapsed))
+                done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        self.latency.add(time.monotonic() - started)
+                        self.answered.add(time.monotonic() - started)
+                        self.breaker.success()
+                        return future.result()
+                    error = future.exception()
+                # a failed call isn't hedged, it's an error rather than a straggler
+                if error is not None and not pending:
+                    break
+                if not hedged and hedge_at is not None and time.monotonic() - started >= hedge_at and pending:
+                    hedged = True
+                    if self._take_hedge():
+                        metrics.count("hedged_requests_total", upstream=self.name)
+                        pending.add(self._submit(fn))
+        finally:
+            # attempts still queued never start, running ones finish in the background and are dropped
+            for future in pending:
+                future.cancel()
+
+        if error is not None and not pending:
+            self._count_failure(error)
+            raise error
+        if timeout >= own_timeout:
+            # stalls count as samples too, so the timeout grows if the upstream gets slower across the board
+            self.latency.add(time.monotonic() - started)
+            self.breaker.failure()
+        else:
+            # cut short by the request deadline, says nothing about the upstream
+            self.breaker.release()
+        metrics.count("upstream_timeouts_total", upstream=self.name)
+        raise DeadlineExceeded(f"{self.name} did not answer within {timeout:.2f}s")
+
+    async def call_async(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """call() for a coroutine function, awaited on the running event loop: the same timeout, circuit
+        breaker and latency samples, without hedging"""
+        own_timeout = self.timeout()
+        left = remaining()
+        timeout = own_timeout if left is None else min(own_timeout, left)
+        if timeout <= 0:
+            raise DeadlineExceeded(f"request deadline passed before calling {self.name}")
+        if not self.breaker.allow():
+            metrics.count("upstream_rejected_total", upstream=self.name)
+            raise CircuitOpenError(f"{self.name} circuit open")
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(), timeout)
+        except asyncio.TimeoutError:
+            if timeout >= own_timeout:
+                self.latency.add(time.monotonic() - started)
+                self.breaker.failure()
+            else:
+                self.breaker.release()
+            metrics.count("upstream_timeouts_total", upstream=self.name)
+            raise DeadlineExceeded(f"{self.name} did not answer within {timeout:.2f}s") from None
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self._count_failure(e)
+            raise
+        self.latency.add(time.monotonic() - started)
+        self.answered.add(time.monotonic() - started)
+        self.breaker.success()
+        return result
+
+
+class GuardedEmbeddings:
+    """Wraps an embeddings client so embed_query and embed_documents go through an Upstream.
+    Everything else goes to the wrapped model."""
+
+    def __init__(self, model, upstream: Upstream):
+        self.model = model
+        self.upstream = upstream
+        self.deployment = model_name(model)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.upstream.call(lambda: self.model.embed_query(text))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.upstream.call(lambda: self.model.embed_documents(texts))
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
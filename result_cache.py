@@ -0,0 +1,91 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from embedding_cache import normalize_query
+
+
+def result_key(kind: str, query: str, year_range, rating_range, genres: Optional[List[str]], top_k: int) -> Tuple:
+    """Cache key for a search: same query and filters in any order map to the same key"""
+    return (
+        kind,
+        normalize_query(query),
+        tuple(year_range) if year_range is not None else None,
+        tuple(float(r) for r in rating_range) if rating_range is not None else None,
+        tuple(sorted(genres or [])),
+        top_k,
+    )
+
+
+# search results shared by every session: TTL + size-bounded LRU with hit/miss counters
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._invalidation_hooks: List[Callable[[], None]] = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Tuple) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                # callers may add keys to the dicts, never hand out the cached ones
+                return copy.deepcopy(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Tuple, results: List[Dict[str, Any]]):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), copy.deepcopy(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key: Tuple, compute: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        results = self.get(key)
+        if results is None:
+            results = compute()
+            # empty lists are usually errors, don't pin them for a whole TTL
+            if results:
+                self.put(key, results)
+        return results
+
+    def on_invalidate(self, hook: Callable[[], None]):
+        """Register a callback run whenever the cache is invalidated, e.g. to drop other catalogue state"""
+        self._invalidation_hooks.append(hook)
+
+    def invalidate(self, predicate: Optional[Callable[[Tuple], bool]] = None):
+        """Drop every entry, or only the keys matching predicate. Call after the catalogue changes."""
+        with self._lock:
+            if predicate is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if predicate(key)]:
+                    del self._entries[key]
+        for hook in self._invalidation_hooks:
+            hook()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
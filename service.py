@@ -0,0 +1,148 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+import metrics
+import vector_search
+
+# recommendation service: the vector_search entry points behind a local JSON API, so every UI process shares
+# one set of clients, caches and (with --shards) a pool of search worker processes. service_client.py is the
+# matching client, ui.py uses it when RECOMMENDER_SERVICE_URL is set.
+#
+#   POST /search      {"query", "offset", "limit", "year_range", "rating_range", "genre"}
+#   POST /similar     {"movie", "movie_id", "offset", "limit", ...filters}
+#   POST /recommend   {"liked", "disliked", "liked_ids", "disliked_ids", "method", "offset", "limit", ...filters}
+#   POST /details     {"ids"}
+#   GET  /titles      catalogue titles for the autocomplete index
+#   GET  /health
+#
+# responses are {"results": ..., "traces": [...]}, errors {"error": "..."} with status 400 or 500
+
+
+def _page_args(body: Dict[str, Any]) -> Dict[str, Any]:
+    args = {"offset": int(body.get("offset", 0)), "limit": int(body.get("limit", 5))}
+    for name in ("year_range", "rating_range", "genre"):
+        if body.get(name) is not None:
+            args[name] = body[name]
+    return args
+
+
+def search(body: Dict[str, Any]):
+    return vector_search.search_page(body["query"], **_page_args(body))
+
+
+def similar(body: Dict[str, Any]):
+    return vector_search.similar_page(body["movie"], movie_id=body.get("movie_id"), **_page_args(body))
+
+
+def recommend(body: Dict[str, Any]):
+    return vector_search.recommend_page(body["liked"], body.get("disliked"), method=body.get("method"),
+                                        liked_ids=body.get("liked_ids"), disliked_ids=body.get("disliked_ids"),
+                                        **_page_args(body))
+
+
+def details(body: Dict[str, Any]):
+    return vector_search.get_movie_details(body["ids"])
+
+
+def titles(body: Dict[str, Any]):
+    index = vector_search.get_title_autocomplete()
+    return [{"id": movie_id, "title": title, "year": year, "rating": float(rating)}
+            for movie_id, title, year, rating in zip(index.ids, index.titles, index.years, index.ratings)]
+
+
+def health(body: Dict[str, Any]):
+    backend = vector_search._local_backend
+    return {
+        "backend": vector_search.SEARCH_BACKEND,
+        "shards": len(getattr(backend, "pools", [])),
+        "snapshot": vector_search._snapshot_version,
+        "titles": vector_search.title_index_version(),
+    }
+
+
+POST_ROUTES = {"/search": search, "/similar": similar, "/recommend": recommend, "/details": details}
+GET_ROUTES = {"/titles": titles, "/health": health}
+
+
+def _json_default(value):
+    # numpy scalars from the local catalogue
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self, status: int, payload: Dict[str, Any]):
+        body = json.dumps(payload, default=_json_default).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, routes, body: Dict[str, Any]):
+        operation = routes.get(self.path.split("?")[0])
+        if operation is None:
+            self._respond(404, {"error": f"Unknown endpoint {self.path}"})
+            return
+        try:
+            with metrics.collect_traces() as traces:
+                results = operation(body)
+            self._respond(200, {"results": results, "traces": [trace.as_dict() for trace in traces]})
+        except (KeyError, TypeError, ValueError) as e:
+            self._respond(400, {"error": f"Bad request: {e}"})
+        except Exception as e:
+            print(f"Error in {self.path}: {e}")
+            self._respond(500, {"error": str(e)})
+
+    def do_GET(self):
+        self._handle(GET_ROUTES, {})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._respond(400, {"error": f"Bad request: {e}"})
+            return
+        self._handle(POST_ROUTES, body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the recommendation API for thin UI clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--shards", type=int, default=None,
+                        help="search worker processes over the snapshot (default SEARCH_SHARDS, local backend only)")
+    args = parser.parse_args()
+
+    if args.shards is not None:
+        vector_search.SEARCH_SHARDS = args.shards
+    if vector_search.SEARCH_BACKEND == "local":
+        # load the snapshot and start the shard workers before taking requests
+        started = time.perf_counter()
+        vector_search.get_local_backend()
+        print(f"Local backend ready in {time.perf_counter() - started:.1f}s")
+    elif vector_search.SEARCH_SHARDS:
+        print("Error: --shards only applies to SEARCH_BACKEND=local, searching Cosmos DB directly")
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Recommendation service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
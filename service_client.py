@@ -0,0 +1,97 @@
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Dict, List, Optional
+
+import metrics
+from title_autocomplete import TitleAutocomplete
+
+# thin client of service.py with the same functions ui.py calls on vector_search,
+# the UI process holds no clients, embeddings or indexes of its own
+
+RECOMMENDER_SERVICE_URL = os.getenv("RECOMMENDER_SERVICE_URL", "http://127.0.0.1:8600")
+SERVICE_TIMEOUT_SECONDS = float(os.getenv("SERVICE_TIMEOUT_SECONDS", "30"))
+TITLE_INDEX_CHECK_SECONDS = float(os.getenv("TITLE_INDEX_CHECK_SECONDS", "30"))
+
+
+def call(path: str, body: Optional[Dict[str, Any]] = None):
+    """One request to the service. Traces recorded there are added to metrics.collect_traces() here."""
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    request = urllib.request.Request(RECOMMENDER_SERVICE_URL.rstrip("/") + path, data=data,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=SERVICE_TIMEOUT_SECONDS) as response:
+            payload = json.load(response)
+    except urllib.error.HTTPError as e:
+        raise RuntimeError(f"{path} failed with {e.code}: {e.read().decode('utf-8', 'replace')}") from e
+    metrics.add_traces(payload.get("traces", []))
+    return payload["results"]
+
+
+def _page(path: str, body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    try:
+        return call(path, body)
+    except Exception as e:
+        print(f"Error calling recommendation service {path}: {e}")
+        return []
+
+
+def search_page(query_text: str, offset=0, limit=5, year_range=[1921, 2025], rating_range=[0.0, 10.0], genre=None):
+    return _page("/search", {"query": query_text, "offset": offset, "limit": limit, "year_range": year_range,
+                             "rating_range": rating_range, "genre": genre or []})
+
+
+def search_with_filtersAndPrompt(query_text: str, top_k=5, year_range=[1921, 2025], rating_range=[0.0, 10.0], genre=None):
+    return search_page(query_text, 0, top_k, year_range, rating_range, genre)
+
+
+def similar_page(movie_name: str, offset=0, limit=5, year_range=[1921, 2025], rating_range=[0.0, 10.0], genre=None,
+                 movie_id=None):
+    return _page("/similar", {"movie": movie_name, "movie_id": movie_id, "offset": offset, "limit": limit,
+                              "year_range": year_range, "rating_range": rating_range, "genre": genre or []})
+
+
+def find_similar(movie_name: str, top_k=5, year_range=[1921, 2025], rating_range=[0.0, 10.0], genre=None, movie_id=None):
+    return similar_page(movie_name, 0, top_k, year_range, rating_range, genre, movie_id)
+
+
+def recommend_page(liked: List[str], disliked: Optional[List[str]] = None, offset=0, limit=5,
+                   year_range=[1921, 2025], rating_range=[0.0, 10.0], genre=None, method: Optional[str] = None,
+                   liked_ids: Optional[List[Optional[str]]] = None, disliked_ids: Optional[List[Optional[str]]] = None):
+    return _page("/recommend", {"liked": liked, "disliked": disliked or [], "liked_ids": liked_ids,
+                                "disliked_ids": disliked_ids, "method": method, "offset": offset, "limit": limit,
+                                "year_range": year_range, "rating_range": rating_range, "genre": genre or []})
+
+
+def recommend(liked: List[str], disliked: Optional[List[str]] = None, top_k=5, year_range=[1921, 2025],
+              rating_range=[0.0, 10.0], genre=None, method: Optional[str] = None,
+              liked_ids: Optional[List[Optional[str]]] = None, disliked_ids: Optional[List[Optional[str]]] = None):
+    return recommend_page(liked, disliked, 0, top_k, year_range, rating_range, genre, method, liked_ids, disliked_ids)
+
+
+def get_movie_details(movie_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    try:
+        return call("/details", {"ids": list(movie_ids)})
+    except Exception as e:
+        print(f"Error calling recommendation service /details: {e}")
+        return {}
+
+
+def get_title_autocomplete() -> TitleAutocomplete:
+    """Built locally from the service's title list, errors are raised so the UI can fall back"""
+    return TitleAutocomplete(call("/titles"))
+
+
+_titles_version = None
+_titles_checked_at = 0.0
+
+
+def title_index_version():
+    """Version of the service's title index, asked for at most every TITLE_INDEX_CHECK_SECONDS"""
+    global _titles_version, _titles_checked_at
+    if time.time() - _titles_checked_at > TITLE_INDEX_CHECK_SECONDS:
+        _titles_version = call("/health")["titles"]
+        _titles_checked_at = time.time()
+    return _titles_version
@@ -0,0 +1,135 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from filter_engine import FilterEngine
+from local_index import normalize_rows, score_top_k, top_k_rows
+from quantization import slice_store
+from snapshot import Snapshot
+
+# the catalogue split into contiguous row ranges, one worker process per range. every worker memory-maps the
+# same snapshot (the pages are shared), a query is scattered to all of them and the per-shard top_k merged
+
+Found = Tuple[np.ndarray, np.ndarray]
+
+
+class Shard:
+    """Exact search over rows start..end of the catalogue, returns catalogue row numbers"""
+
+    def __init__(self, catalogue, shard: int, shards: int):
+        bounds = np.linspace(0, len(catalogue), shards + 1).astype(np.int64)
+        self.start, self.end = int(bounds[shard]), int(bounds[shard + 1])
+        self.embeddings = slice_store(catalogue.embeddings, self.start, self.end)
+        # filters over this shard's rows only, masks are built per shard rather than over the whole catalogue
+        self.filters = FilterEngine.from_catalogue(catalogue, self.start, self.end)
+
+    def search(self, queries: np.ndarray, top_k: int, year_range, rating_range, genre,
+               exclude_rows: Optional[List[List[int]]] = None) -> List[Found]:
+        rows = None
+        if not self.filters.is_unfiltered(year_range, rating_range, genre):
+            rows = np.flatnonzero(self.filters.mask(year_range, rating_range, genre))
+        found = []
+        for i, query in enumerate(queries):
+            excluded = np.asarray(exclude_rows[i] if exclude_rows else [], dtype=np.int64) - self.start
+            excluded = excluded[(excluded >= 0) & (excluded < self.end - self.start)]
+            candidates = rows
+            if len(excluded):
+                candidates = np.arange(self.end - self.start) if rows is None else rows
+                candidates = candidates[~np.isin(candidates, excluded)]
+            best, scores = score_top_k(self.embeddings, query, top_k, candidates)
+            found.append((best + self.start, scores))
+        return found
+
+
+# state of a worker process, set once by the pool initializer
+
+_shard: Optional[Shard] = None
+
+
+def _init_shard(root: str, version: str, shard: int, shards: int, rerank: int, pq_subspaces: int):
+    global _shard
+    snapshot = Snapshot.load(root, version, rerank=rerank, pq_subspaces=pq_subspaces)
+    _shard = Shard(snapshot.catalogue, shard, shards)
+
+
+def _search_shard(queries, top_k, year_range, rating_range, genre, exclude_rows) -> List[Found]:
+    return _shard.search(queries, top_k, year_range, rating_range, genre, exclude_rows)
+
+
+def _ready() -> bool:
+    return _shard is not None
+
+
+class ShardedSearchBackend:
+    """Drop-in for LocalSearchBackend (search, search_batch, catalogue, filters, title_lookup) that runs the
+    scoring in `shards` worker processes. Shards scan exactly, so results match a flat index."""
+
+    def __init__(self, root: str, version: Optional[str] = None, shards: int = 2, rerank: int = 8,
+                 pq_subspaces: int = 0, verify: bool = False):
+        # checksums are verified here once, the workers map the version that passed
+        snapshot = Snapshot.load(root, version, verify, rerank=rerank, pq_subspaces=pq_subspaces)
+        self.version = snapshot.version
+        self.catalogue = snapshot.catalogue
+        self.filters = FilterEngine.from_catalogue(self.catalogue)
+        self._title_lookup = None
+        # spawn, not fork: the parent runs HTTP and refresh threads
+        context = multiprocessing.get_context("spawn")
+        self.pools = [
+            ProcessPoolExecutor(1, mp_context=context, initializer=_init_shard,
+                                initargs=(root, self.version, shard, shards, rerank, pq_subspaces))
+            for shard in range(shards)
+        ]
+        # start every worker now so the first search doesn't pay for it
+        wait([pool.submit(_ready) for pool in self.pools])
+
+    @property
+    def title_lookup(self):
+        if self._title_lookup is None:
+            from title_lookup import TitleLookup
+            self._title_lookup = TitleLookup.from_catalogue(self.catalogue)
+        return self._title_lookup
+
+    def _scatter(self, queries: np.ndarray, top_k: int, year_range, rating_range, genre,
+                 exclude_rows: Optional[List[List[int]]]) -> List[Found]:
+        futures = [pool.submit(_search_shard, queries, top_k, year_range, rating_range, genre, exclude_rows)
+                   for pool in self.pools]
+        per_shard = [future.result() for future in futures]
+        merged = []
+        for i in range(len(queries)):
+            rows = np.concatenate([found[i][0] for found in per_shard])
+            scores = np.concatenate([found[i][1] for found in per_shard])
+            best = top_k_rows(scores, top_k)
+            merged.append((rows[best], scores[best]))
+        return merged
+
+    def search(self, query_embedding, top_k=5, year_range=None, rating_range=None,
+               genre: Optional[List[str]] = None, exclude_rows: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        queries = normalize_rows(query_embedding)[None, :]
+        rows, scores = self._scatter(queries, top_k, year_range, rating_range, genre,
+                                     [list(exclude_rows)] if exclude_rows else None)[0]
+        return [self.catalogue.result(row, score) for row, score in zip(rows, scores)]
+
+    def search_batch(self, query_embeddings, top_k=5, year_range=None, rating_range=None,
+                     genre: Optional[List[str]] = None, exclude_rows: Optional[List[List[int]]] = None,
+                     chunk_bytes: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        queries = normalize_rows(query_embeddings)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        found = self._scatter(queries, top_k, year_range, rating_range, genre, exclude_rows)
+        return [[self.catalogue.result(row, score) for row, score in zip(rows, scores)] for rows, scores in found]
+
+    def close(self, delay: float = 0.0):
+        """Stop the workers, after `delay` seconds so searches still holding this backend can finish"""
+        def shutdown():
+            for pool in self.pools:
+                pool.shutdown(wait=False)
+
+        if delay > 0:
+            timer = threading.Timer(delay, shutdown)
+            timer.daemon = True
+            timer.start()
+        else:
+            shutdown()
@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from local_index import Catalogue, top_k_matrix
+from title_lookup import normalize_title
+
+TABLE_VERSION = 1
+TABLE_ARRAYS = ["ids", "titles", "years", "ratings", "genre_bits", "hashes", "neighbours", "scores"]
+
+
+def embedding_hashes(embeddings, chunk_rows: int = 4096) -> np.ndarray:
+    """64-bit content hash per row, used to spot re-embedded movies"""
+    hashes = np.empty(embeddings.shape[0], dtype=np.uint64)
+    for start in range(0, embeddings.shape[0], chunk_rows):
+        block = np.ascontiguousarray(embeddings[start:start + chunk_rows])
+        for offset, vector in enumerate(block):
+            digest = hashlib.blake2b(vector.tobytes(), digest_size=8).digest()
+            hashes[start + offset] = int.from_bytes(digest, "little")
+    return hashes
+
+
+def genre_bits(records: List[Dict], genres: List[str]) -> np.ndarray:
+    codes = {genre: bit for bit, genre in enumerate(genres)}
+    bits = np.zeros(len(records), dtype=np.uint64)
+    for row, record in enumerate(records):
+        for genre in record.get("genres") or []:
+            bits[row] |= np.uint64(1) << np.uint64(codes[genre])
+    return bits
+
+
+def nearest_neighbours(embeddings, rows: np.ndarray, top_n: int,
+                       chunk_rows: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-n neighbours of the given rows against the whole (exact) embedding store, chunked to bound memory"""
+    neighbours = np.empty((len(rows), top_n), dtype=np.int32)
+    scores = np.empty((len(rows), top_n), dtype=np.float16)
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        chunk_scores = embeddings.scores(embeddings[chunk])
+        chunk_scores[np.arange(len(chunk)), chunk] = -np.inf
+        best = top_k_matrix(chunk_scores, top_n)
+        neighbours[start:start + len(chunk)] = best
+        scores[start:start + len(chunk)] = np.take_along_axis(chunk_scores, best, axis=1)
+    return neighbours, scores
+
+
+# precomputed top-n neighbours for every movie in the catalogue
+
+class SimilarTable:
+    def __init__(self, arrays: Dict[str, np.ndarray], genres: List[str], top_n: int):
+        self.arrays = arrays
+        self.genres = genres
+        self.top_n = top_n
+        self._rows_by_id: Optional[Dict[str, int]] = None
+        self._rows_by_title: Dict[str, List[int]] = {}
+        for row, title in enumerate(arrays["titles"]):
+            self._rows_by_title.setdefault(normalize_title(str(title)), []).append(row)
+
+    def __len__(self):
+        return len(self.arrays["ids"])
+
+    @classmethod
+    def build(cls, catalogue: Catalogue, top_n: int = 50, chunk_rows: int = 1024) -> "SimilarTable":
+        records = catalogue.records
+        genres = sorted({genre for record in records for genre in record.get("genres") or []})
+        if len(genres) > 64:
+            raise ValueError(f"At most 64 genres fit in the genre bitmask, found {len(genres)}")
+        top_n = min(top_n, max(len(records) - 1, 0))
+        neighbours, scores = nearest_neighbours(catalogue.embeddings.exact, np.arange(len(records)), top_n, chunk_rows)
+        arrays = {
+            "ids": np.array([record["id"] for record in records], dtype=str),
+            "titles": np.array([record.get("title") or "" for record in records], dtype=str),
+            "years": catalogue.years.astype(np.int16),
+            "ratings": catalogue.ratings.astype(np.float32),
+            "genre_bits": genre_bits(records, genres),
+            "hashes": embedding_hashes(catalogue.embeddings),
+            "neighbours": neighbours,
+            "scores": scores,
+        }
+        return cls(arrays, genres, top_n)
+
+    def update(self, catalogue: Catalogue, chunk_rows: int = 1024) -> "SimilarTable":
+        """New table for the current catalogue, recomputing only rows affected by added,
+        re-embedded or removed movies"""
+        records = catalogue.records
+        genres = list(self.genres)
+        genres += sorted({g for record in records for g in record.get("genres") or []} - set(genres))
+        if len(genres) > 64:
+            return SimilarTable.build(catalogue, self.top_n, chunk_rows)
+
+        ids = np.array([record["id"] for record in records], dtype=str)
+        hashes = embedding_hashes(catalogue.embeddings)
+        old_rows = {movie_id: row for row, movie_id in enumerate(self.arrays["ids"])}
+        old_to_new = np.full(len(self), -1, dtype=np.int64)
+        changed = np.ones(len(records), dtype=bool)
+        for row, movie_id in enumerate(ids):
+            old = old_rows.get(movie_id)
+            if old is not None:
+                old_to_new[old] = row
+                changed[row] = self.arrays["hashes"][old] != hashes[row]
+        # a row that was dropped or re-embedded invalidates every stored neighbour pointing at it
+        kept_old = np.flatnonzero(old_to_new >= 0)
+        stale_old = old_to_new < 0
+        stale_old[kept_old] = changed[old_to_new[kept_old]]
+
+        top_n = min(self.top_n, max(len(records) - 1, 0))
+        neighbours = np.empty((len(records), top_n), dtype=np.int32)
+        scores = np.empty((len(records), top_n), dtype=np.float16)
+        embeddings = catalogue.embeddings.exact
+        changed_rows = np.flatnonzero(changed)
+        unchanged_rows = np.flatnonzero(~changed)
+        recompute = [changed_rows]
+
+        for start in range(0, len(unchanged_rows), chunk_rows):
+            chunk = unchanged_rows[start:start + chunk_rows]
+            old = np.array([old_rows[movie_id] for movie_id in ids[chunk]])
+            old_neighbours = np.asarray(self.arrays["neighbours"][old])
+            stale = stale_old[old_neighbours]
+            kept_rows = old_to_new[old_neighbours]
+            kept_scores = np.asarray(self.arrays["scores"][old], dtype=np.float32)
+            kept_scores[stale] = -np.inf
+            # surviving neighbours are exact only as far as they go, short lists need a full recompute
+            short = (~stale).sum(axis=1) < top_n
+            fresh_scores = embeddings[chunk] @ embeddings[changed_rows].T
+            merged_rows = np.hstack([kept_rows, np.broadcast_to(changed_rows, fresh_scores.shape)])
+            merged_scores = np.hstack([kept_scores, fresh_scores])
+            best = top_k_matrix(merged_scores, top_n)
+            neighbours[chunk] = np.take_along_axis(merged_rows, best, axis=1)
+            scores[chunk] = np.take_along_axis(merged_scores, best, axis=1)
+            recompute.append(chunk[short])
+
+        recompute = np.sort(np.concatenate(recompute))
+        if len(recompute):
+            neighbours[recompute], scores[recompute] = nearest_neighbours(embeddings, recompute, top_n, chunk_rows)
+
+        arrays = {
+            "ids": ids,
+            "titles": np.array([record.get("title") or "" for record in records], dtype=str),
+            "years": catalogue.years.astype(np.int16),
+            "ratings": catalogue.ratings.astype(np.float32),
+            "genre_bits": genre_bits(records, genres),
+            "hashes": hashes,
+            "neighbours": neighbours,
+            "scores": scores,
+        }
+        return SimilarTable(arrays, genres, top_n)
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        # write next to the old files and swap in, readers may still have them memory-mapped
+        for name in TABLE_ARRAYS:
+            target = os.path.join(path, f"{name}.npy")
+            with open(target + ".tmp", "wb") as f:
+                np.save(f, self.arrays[name])
+            os.replace(target + ".tmp", target)
+        with open(os.path.join(path, "manifest.json.tmp"), "w") as f:
+            json.dump({"version": TABLE_VERSION, "top_n": self.top_n, "genres": self.genres}, f)
+        os.replace(os.path.join(path, "manifest.json.tmp"), os.path.join(path, "manifest.json"))
+
+    @classmethod
+    def load(cls, path: str) -> "SimilarTable":
+        """Memory-map a saved table, nothing is read until it's used"""
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        if manifest["version"] != TABLE_VERSION:
+            raise ValueError(f"Unsupported similar table version {manifest['version']}")
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in TABLE_ARRAYS}
+        return cls(arrays, manifest["genres"], manifest["top_n"])
+
+    def genre_mask(self, genres: List[str]) -> np.uint64:
+        bits = np.uint64(0)
+        for genre in genres:
+            if genre in self.genres:
+                bits |= np.uint64(1) << np.uint64(self.genres.index(genre))
+        return bits
+
+    def row_for_id(self, movie_id: str) -> Optional[int]:
+        if self._rows_by_id is None:
+            self._rows_by_id = {str(movie_id): row for row, movie_id in enumerate(self.arrays["ids"])}
+        return self._rows_by_id.get(movie_id)
+
+    def lookup(self, movie_name: str, top_k: int, year_range, rating_range,
+               genres: Optional[List[str]] = None, min_results: Optional[int] = None,
+               movie_id: Optional[str] = None) -> Optional[List[Tuple[str, float]]]:
+        """(id, score) of up to top_k stored neighbours passing the filters, excluding the source
+        movie (by id when given, otherwise every movie with the same title). None when the movie is
+        unknown or fewer than min_results (default top_k) pass."""
+        if movie_id is not None:
+            row = self.row_for_id(movie_id)
+            rows = [row] if row is not None else []
+        else:
+            rows = self._rows_by_title.get(normalize_title(movie_name))
+        if not rows:
+            return None
+        candidates = np.asarray(self.arrays["neighbours"][rows[0]])
+        candidate_scores = np.asarray(self.arrays["scores"][rows[0]], dtype=np.float32)
+        years = self.arrays["years"][candidates]
+        ratings = self.arrays["ratings"][candidates]
+        keep = (years >= year_range[0]) & (years <= year_range[1])
+        keep &= (ratings >= rating_range[0]) & (ratings <= rating_range[1])
+        if genres:
+            keep &= (self.arrays["genre_bits"][candidates] & self.genre_mask(genres)) != 0
+        keep &= ~np.isin(candidates, rows)
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+        if len(candidates) < (top_k if min_results is None else min_results):
+            return None
+        return [(str(self.arrays["ids"][row]), float(score))
+                for row, score in zip(candidates[:top_k], candidate_scores[:top_k])]
+
+
+# python similar_table.py build|update --path similar_table
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the similar movies table")
+    parser.add_argument("command", choices=["build", "update"])
+    parser.add_argument("--path", default=os.getenv("SIMILAR_TABLE_PATH", "similar_table"))
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--chunk-rows", type=int, default=1024)
+    args = parser.parse_args()
+
+    import vector_search
+    catalogue = Catalogue.from_container(vector_search.get_container())
+    if args.command == "update" and os.path.exists(os.path.join(args.path, "manifest.json")):
+        table = SimilarTable.load(args.path).update(catalogue, args.chunk_rows)
+    else:
+        table = SimilarTable.build(catalogue, args.top_n, args.chunk_rows)
+    table.save(args.path)
+    print(f"Saved {len(table)} movies x {table.top_n} neighbours to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
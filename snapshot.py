@@ -0,0 +1,303 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from local_index import Catalogue, IVFIndex, build_index
+from quantization import Float16Store, Float32Store, Int8Store, PQStore
+
+# on-disk catalogue snapshot, memory-mapped by every worker on the host so they share one page cache.
+#
+#   <root>/CURRENT             name of the active version, replaced atomically
+#   <root>/<version>/          one directory per export, never modified once CURRENT points at it
+#       manifest.json          format version, row count, genres, storage, sha256 + size of every file
+#       *.npy                  columns: embeddings, years, ratings, genre codes, utf-8 string blobs + offsets,
+#                              optionally the IVF lists and product quantization codes
+
+SNAPSHOT_FORMAT = 1
+STRING_FIELDS = ["id", "title", "plot_summary", "plot_synopsis"]
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def current_version(root: str) -> Optional[str]:
+    try:
+        with open(os.path.join(root, "CURRENT")) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(name for name in os.listdir(root)
+                  if os.path.exists(os.path.join(root, name, "manifest.json")))
+
+
+def activate(root: str, version: str):
+    """Point CURRENT at a version, running apps pick it up on their next check"""
+    if not os.path.exists(os.path.join(root, version, "manifest.json")):
+        raise ValueError(f"No snapshot version '{version}' in {root}")
+    tmp = os.path.join(root, "CURRENT.tmp")
+    with open(tmp, "w") as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, "CURRENT"))
+
+
+# lazy records over the string, genre and number columns, only rows that are asked for become dicts
+
+class SnapshotRecords:
+    def __init__(self, arrays: Dict[str, np.ndarray], genres: List[str]):
+        self.arrays = arrays
+        self.genres = genres
+
+    def __len__(self):
+        return len(self.arrays["years"])
+
+    def _string(self, field: str, row: int) -> str:
+        offsets = self.arrays[f"{field}_offsets"]
+        return self.arrays[f"{field}_bytes"][offsets[row]:offsets[row + 1]].tobytes().decode("utf-8")
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        offsets = self.arrays["genre_offsets"]
+        codes = self.arrays["genre_codes"][offsets[row]:offsets[row + 1]]
+        year = int(self.arrays["years"][row])
+        rating = float(self.arrays["ratings"][row])
+        record = {field: self._string(field, row) for field in STRING_FIELDS}
+        record["genres"] = [self.genres[code] for code in codes]
+        record["year"] = year or None
+        record["rating"] = None if rating != rating else rating
+        return record
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def column(self, field: str) -> List[Any]:
+        if field in STRING_FIELDS:
+            data = self.arrays[f"{field}_bytes"].tobytes()
+            offsets = self.arrays[f"{field}_offsets"].tolist()
+            return [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        return [record[field] for record in self]
+
+    def genre_codes(self):
+        return self.genres, self.arrays["genre_offsets"], self.arrays["genre_codes"]
+
+
+def _string_column(values: List[Optional[str]]):
+    encoded = [(value or "").encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in encoded])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def snapshot_arrays(catalogue: Catalogue, index=None) -> Dict[str, Any]:
+    """Columns of a catalogue (and optionally its IVF index) as arrays, plus manifest fields"""
+    records = catalogue.records
+    genres = sorted({genre for record in records for genre in record.get("genres") or []})
+    codes = {genre: code for code, genre in enumerate(genres)}
+    arrays = {}
+    for field in STRING_FIELDS:
+        arrays[f"{field}_bytes"], arrays[f"{field}_offsets"] = _string_column(catalogue.column(field))
+    arrays["years"] = np.array([record.get("year") or 0 for record in records], dtype=np.int32)
+    # float64 so ratings read back exactly as they were stored
+    arrays["ratings"] = np.array([np.nan if record.get("rating") is None else record["rating"] for record in records],
+                                 dtype=np.float64)
+    arrays["genre_offsets"] = np.zeros(len(records) + 1, dtype=np.int64)
+    arrays["genre_offsets"][1:] = np.cumsum([len(record.get("genres") or []) for record in records])
+    arrays["genre_codes"] = np.array([codes[genre] for record in records for genre in record.get("genres") or []],
+                                     dtype=np.uint16)
+
+    store = catalogue.embeddings
+    pq = None
+    if store.approximate:
+        pq, store = store, store.exact
+    if isinstance(store, Int8Store):
+        arrays["embedding_codes"], arrays["embedding_scales"] = store.codes, store.scales
+    else:
+        arrays["embeddings"] = np.asarray(store.matrix)
+    if pq is not None:
+        arrays["pq_centroids"], arrays["pq_codes"] = pq.centroids, pq.codes
+    if isinstance(index, IVFIndex):
+        arrays["ivf_centroids"] = index.centroids
+        arrays["ivf_order"], arrays["ivf_bounds"] = index.list_arrays()
+    return {"arrays": arrays, "genres": genres, "storage": store.storage,
+            "dim": int(store.shape[1]) if len(store.shape) > 1 else 0}
+
+
+def write_snapshot(root: str, catalogue: Catalogue, index=None, keep: int = 3, make_current: bool = True) -> str:
+    """Write a new version next to the existing ones and (by default) make it current"""
+    os.makedirs(root, exist_ok=True)
+    version = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+    suffix = 1
+    while os.path.exists(os.path.join(root, version)):
+        version = f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}-{suffix}"
+        suffix += 1
+    staging = os.path.join(root, f".{version}.tmp")
+    os.makedirs(staging)
+
+    columns = snapshot_arrays(catalogue, index)
+    files = {}
+    for name, array in columns["arrays"].items():
+        path = os.path.join(staging, f"{name}.npy")
+        np.save(path, array)
+        files[name] = {"sha256": _sha256(path), "bytes": os.path.getsize(path)}
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "created_at": time.time(),
+        "rows": len(catalogue),
+        "dim": columns["dim"],
+        "storage": columns["storage"],
+        "genres": columns["genres"],
+        "last_modified": catalogue.last_modified,
+        "files": files,
+    }
+    with open(os.path.join(staging, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    # the version only becomes visible once complete
+    os.rename(staging, os.path.join(root, version))
+    if make_current:
+        activate(root, version)
+    prune(root, keep)
+    return version
+
+
+def prune(root: str, keep: int):
+    """Delete all but the newest `keep` versions, never the current one. Workers still mapping a deleted
+    version keep reading it until they swap, the files only go away once unmapped."""
+    current = current_version(root)
+    for version in list_versions(root)[:-keep or None]:
+        if version != current:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def verify_snapshot(path: str, checksums: bool = True) -> List[str]:
+    """Problems with a version directory, empty when sizes (and checksums) match the manifest"""
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    problems = []
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        problems.append(f"unsupported snapshot format {manifest.get('format')}")
+    for name, expected in manifest["files"].items():
+        file_path = os.path.join(path, f"{name}.npy")
+        if not os.path.exists(file_path):
+            problems.append(f"{name}.npy is missing")
+        elif os.path.getsize(file_path) != expected["bytes"]:
+            problems.append(f"{name}.npy has {os.path.getsize(file_path)} bytes, expected {expected['bytes']}")
+        elif checksums and _sha256(file_path) != expected["sha256"]:
+            problems.append(f"{name}.npy checksum mismatch")
+    return problems
+
+
+class Snapshot:
+    def __init__(self, version: str, manifest: Dict[str, Any], catalogue: Catalogue, index=None):
+        self.version = version
+        self.manifest = manifest
+        self.catalogue = catalogue
+        self.index = index
+
+    @classmethod
+    def load(cls, root: str, version: Optional[str] = None, verify: bool = False, rerank: int = 8,
+             pq_subspaces: int = 0, n_probe: int = 8) -> "Snapshot":
+        """Memory-map a version (CURRENT by default). Sizes are always checked against the manifest,
+        checksums only with verify=True since they read every byte."""
+        version = version or current_version(root)
+        if version is None:
+            raise FileNotFoundError(f"No current snapshot in {root}")
+        path = os.path.join(root, version)
+        problems = verify_snapshot(path, checksums=verify)
+        if problems:
+            raise ValueError(f"Snapshot {version} is damaged: {'; '.join(problems)}")
+        with open(os.path.join(path, "manifest.json")) as f:
+            manifest = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in manifest["files"]}
+
+        if "embedding_codes" in arrays:
+            store = Int8Store(arrays["embedding_codes"], arrays["embedding_scales"])
+        elif manifest["storage"] == "float16":
+            store = Float16Store(arrays["embeddings"])
+        else:
+            store = Float32Store(arrays["embeddings"])
+        if "pq_codes" in arrays:
+            store = PQStore(store, np.asarray(arrays["pq_centroids"]), arrays["pq_codes"], rerank)
+
+        ratings = np.nan_to_num(np.asarray(arrays["ratings"]), nan=0.0).astype(np.float32)
+        records = SnapshotRecords(arrays, manifest["genres"])
+        catalogue = Catalogue(records, store, manifest["last_modified"], pq_subspaces=pq_subspaces, rerank=rerank,
+                              years=np.asarray(arrays["years"]), ratings=ratings)
+        index = None
+        if "ivf_centroids" in arrays:
+            index = IVFIndex.from_lists(catalogue.embeddings, np.asarray(arrays["ivf_centroids"]),
+                                        arrays["ivf_order"], np.asarray(arrays["ivf_bounds"]), n_probe)
+        return cls(version, manifest, catalogue, index)
+
+    def config_mismatches(self, storage: str, n_lists: Optional[int] = None) -> List[str]:
+        """Where the snapshot was exported with other settings than the ones asked for, which only reach it
+        through a new export"""
+        mismatches = []
+        exported = self.catalogue.embeddings.exact.storage
+        if exported != storage:
+            mismatches.append(f"embeddings stored as {exported}, not EMBEDDING_STORAGE={storage}")
+        if n_lists and self.index is not None and self.index.n_lists != n_lists:
+            mismatches.append(f"{self.index.n_lists} IVF lists, not IVF_N_LISTS={n_lists}")
+        return mismatches
+
+
+def main():
+    from tuning import apply_search_config
+    # export with the storage, PQ and IVF lists of a tuned config unless given here
+    apply_search_config(os.getenv("SEARCH_CONFIG_PATH", "search_config.json"))
+    parser = argparse.ArgumentParser(description="Export, inspect and switch catalogue snapshots")
+    parser.add_argument("command", choices=["export", "list", "verify", "activate"])
+    parser.add_argument("version", nargs="?", help="version for verify / activate, defaults to CURRENT")
+    parser.add_argument("--path", default=os.getenv("SNAPSHOT_PATH", "snapshots"))
+    parser.add_argument("--storage", default=os.getenv("EMBEDDING_STORAGE", "float32"),
+                        choices=["float32", "float16", "int8"])
+    parser.add_argument("--pq-subspaces", type=int, default=int(os.getenv("PQ_SUBSPACES", "0")))
+    parser.add_argument("--index", default=os.getenv("LOCAL_INDEX_TYPE", "ivf"), choices=["ivf", "flat"],
+                        help="ivf also saves the trained lists so workers skip k-means")
+    parser.add_argument("--ivf-lists", type=int, default=int(os.getenv("IVF_N_LISTS")) if os.getenv("IVF_N_LISTS") else None)
+    parser.add_argument("--keep", type=int, default=3, help="versions kept on disk")
+    parser.add_argument("--no-activate", action="store_true", help="export without making it current")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        import vector_search
+        started = time.perf_counter()
+        catalogue = Catalogue.from_container(vector_search.get_container(), args.storage, args.pq_subspaces)
+        index = build_index(catalogue.embeddings, "ivf", n_lists=args.ivf_lists) if args.index == "ivf" else None
+        version = write_snapshot(args.path, catalogue, index, args.keep, not args.no_activate)
+        print(f"Exported {len(catalogue)} movies to {os.path.join(args.path, version)} "
+              f"in {time.perf_counter() - started:.1f}s")
+    elif args.command == "list":
+        current = current_version(args.path)
+        for version in list_versions(args.path):
+            with open(os.path.join(args.path, version, "manifest.json")) as f:
+                manifest = json.load(f)
+            size = sum(entry["bytes"] for entry in manifest["files"].values())
+            print(f"{'*' if version == current else ' '} {version}  {manifest['rows']} movies  "
+                  f"{manifest['storage']}  {size / 2 ** 20:.1f} MiB")
+    elif args.command == "verify":
+        version = args.version or current_version(args.path)
+        problems = verify_snapshot(os.path.join(args.path, version))
+        print(f"{version}: " + ("ok" if not problems else "; ".join(problems)))
+    else:
+        activate(args.path, args.version)
+        print(f"{args.version} is now current")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+# tests never pick up a developer's tuned search config or Cosmos settings
+os.environ.setdefault("SEARCH_CONFIG_PATH", "")
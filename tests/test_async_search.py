@@ -0,0 +1,152 @@
+import asyncio
+import threading
+
+import pytest
+
+import async_search
+import vector_search
+from dispatcher import AsyncSingleFlight
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, Upstream
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+
+
+@pytest.fixture
+def movies(monkeypatch):
+    movies = make_catalogue(60, DIM)
+    # a remake: same title, another id and embedding
+    movies[1]["title"] = movies[0]["title"]
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "SIMILAR_TABLE_PATH", "no_similar_table")
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(DIM))
+    yield movies
+    vector_search.set_clients()
+
+
+def test_find_similar_picks_the_movie_by_id(movies):
+    title = movies[0]["title"]
+    by_id = asyncio.run(async_search.find_similar(title, 5, YEARS, RATINGS, movie_id=movies[1]["id"]))
+    assert by_id == vector_search.find_similar(title, 5, YEARS, RATINGS, movie_id=movies[1]["id"])
+    assert movies[1]["id"] not in [movie["id"] for movie in by_id]
+    assert by_id != asyncio.run(async_search.find_similar(title, 5, YEARS, RATINGS, movie_id=movies[0]["id"]))
+
+
+def test_find_similar_shares_the_sync_result_window(movies, monkeypatch):
+    title, movie_id = movies[2]["title"], movies[2]["id"]
+    page = vector_search.similar_page(title, 0, 5, YEARS, RATINGS, movie_id=movie_id)
+    # a larger top_k within the same window is served from the cache, no search runs
+    monkeypatch.setattr(vector_search.get_local_backend(), "search", None)
+    assert asyncio.run(async_search.find_similar(title, 8, YEARS, RATINGS, movie_id=movie_id))[:5] == page
+
+
+class AsyncContainer:
+    """The async client's query_items over a FakeContainer, each query taking `delay` seconds"""
+
+    def __init__(self, container, delay=0.0, error=None):
+        self.container = container
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def query_items(self, query, parameters=None, response_hook=None, **kwargs):
+        async def items():
+            self.calls += 1
+            await asyncio.sleep(self.delay)
+            if self.error is not None:
+                raise self.error
+            for item in self.container.query_items(query, parameters, response_hook=response_hook):
+                yield item
+        return items()
+
+
+@pytest.fixture
+def cosmos(monkeypatch):
+    movies = make_catalogue(30, DIM)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "cosmos")
+    monkeypatch.setattr(vector_search, "SIMILAR_TABLE_PATH", "no_similar_table")
+    monkeypatch.setitem(vector_search._upstreams, "cosmos",
+                        Upstream("cosmos", breaker=CircuitBreaker("cosmos", failures=2, reset_seconds=60)))
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(DIM))
+    container = AsyncContainer(FakeContainer(movies), delay=0.02)
+
+    async def get_container():
+        return container
+
+    monkeypatch.setattr(async_search, "get_container", get_container)
+    yield container
+    vector_search.set_clients()
+
+
+def test_identical_queries_share_one_round_trip(cosmos):
+    async def run():
+        return await asyncio.gather(*[async_search.query_items("SELECT c.id FROM c", []) for _ in range(4)])
+
+    results = asyncio.run(run())
+    assert cosmos.calls == 1
+    assert all(len(items) == 30 for items in results)
+    results[0][0]["id"] = "changed"
+    assert all(items[0]["id"] != "changed" for items in results[1:])
+
+
+def test_failing_cosmos_opens_the_circuit(cosmos):
+    cosmos.error = ConnectionError("cosmos down")
+    for _ in range(2):
+        with pytest.raises(ConnectionError, match="cosmos down"):
+            asyncio.run(async_search.query_items("SELECT c.id FROM c", []))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(async_search.query_items("SELECT c.id FROM c", []))
+    assert cosmos.calls == 2
+
+
+def test_stalled_query_times_out(cosmos, monkeypatch):
+    monkeypatch.setitem(vector_search._upstreams, "cosmos", Upstream("cosmos", timeout_floor=0.05, timeout_ceiling=0.05))
+    cosmos.delay = 1.0
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(async_search.query_items("SELECT c.id FROM c", []))
+
+
+def test_local_search_runs_off_the_event_loop(movies, monkeypatch):
+    threads = []
+    search = vector_search.local_search
+
+    def local_search(*args):
+        threads.append(threading.current_thread())
+        return search(*args)
+
+    monkeypatch.setattr(vector_search, "RESULT_CACHE_ENABLED", False)
+    monkeypatch.setattr(vector_search, "local_search", local_search)
+    asyncio.run(async_search.find_similar(movies[3]["title"], 5, YEARS, RATINGS))
+    asyncio.run(async_search.search_with_filtersAndPrompt("a quiet drama", 5, YEARS, RATINGS))
+    assert len(threads) == 2 and threading.main_thread() not in threads
+
+
+def test_each_event_loop_gets_its_own_semaphore():
+    async def limit():
+        return async_search.get_limit()
+
+    first = asyncio.run(limit())
+    second = asyncio.run(limit())
+    assert first is not second
+    asyncio.run(async_search.close())
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    flight = AsyncSingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.02)
+        return [{"id": "1"}]
+
+    async def run():
+        leader = asyncio.ensure_future(flight.do("key", slow))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", slow, copy=list))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == [{"id": "1"}]
@@ -0,0 +1,105 @@
+import threading
+import time
+
+from dispatcher import CoalescingEmbeddings, MicroBatcher, SingleFlight
+from fakes import FakeEmbeddings
+
+
+def run_concurrently(fn, args):
+    results = [None] * len(args)
+    errors = [None] * len(args)
+    start = threading.Barrier(len(args))
+
+    def worker(i):
+        start.wait()
+        try:
+            results[i] = fn(args[i])
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(args))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads), "a caller was left waiting"
+    return results, errors
+
+
+def test_singleflight_runs_once_and_copies_for_followers():
+    calls = []
+    gate = threading.Event()
+    flight = SingleFlight()
+
+    def fetch():
+        calls.append(1)
+        gate.wait(1)
+        return [1, 2]
+
+    threading.Timer(0.1, gate.set).start()
+    results, errors = run_concurrently(lambda _: flight.do("key", fetch, copy=list), range(4))
+    assert len(calls) == 1
+    assert errors == [None] * 4
+    assert all(result == [1, 2] for result in results)
+    assert len({id(result) for result in results}) > 1
+
+
+def test_singleflight_error_reaches_every_caller_and_is_not_kept():
+    gate = threading.Event()
+    flight = SingleFlight()
+
+    def fail():
+        gate.wait(1)
+        raise RuntimeError("upstream down")
+
+    threading.Timer(0.1, gate.set).start()
+    _, errors = run_concurrently(lambda _: flight.do("key", fail), range(3))
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_lone_call_does_not_wait_out_the_window():
+    batcher = MicroBatcher(lambda items: [item * 2 for item in items], window_seconds=1.0)
+    started = time.perf_counter()
+    assert batcher.submit(21) == 42
+    assert time.perf_counter() - started < 0.5
+
+
+def test_concurrent_calls_share_a_batch():
+    sizes = []
+
+    def double(items):
+        sizes.append(len(items))
+        time.sleep(0.05)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, window_seconds=0.05)
+    results, errors = run_concurrently(batcher.submit, list(range(8)))
+    assert errors == [None] * 8
+    assert results == [item * 2 for item in range(8)]
+    assert len(sizes) < 8
+
+
+def test_short_batch_result_fails_every_caller():
+    batcher = MicroBatcher(lambda items: [0] * (len(items) - 1), window_seconds=0.05)
+    _, errors = run_concurrently(batcher.submit, list(range(4)))
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_batch_error_reaches_every_caller():
+    def fail(items):
+        raise RuntimeError("embedding endpoint down")
+
+    batcher = MicroBatcher(fail, window_seconds=0.05)
+    _, errors = run_concurrently(batcher.submit, list(range(4)))
+    assert all(isinstance(error, RuntimeError) for error in errors)
+
+
+def test_coalescing_embeddings_match_the_model():
+    model = FakeEmbeddings(8)
+    embeddings = CoalescingEmbeddings(model, window_seconds=0.02)
+    texts = ["a", "b", "a", "c"]
+    results, errors = run_concurrently(embeddings.embed_query, texts)
+    assert errors == [None] * 4
+    assert results == [model.embed_query(text) for text in texts]
+    assert embeddings.deployment == "fake-embeddings"
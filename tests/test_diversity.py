@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import vector_search
+from diversity import franchise_key, mmr_order, rerank
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from local_index import normalize_rows
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+
+
+def redundancy(embeddings: np.ndarray) -> float:
+    """Mean cosine similarity between the picked movies"""
+    similarity = embeddings @ embeddings.T
+    n = len(embeddings)
+    return float((similarity.sum() - np.trace(similarity)) / (n * (n - 1)))
+
+
+def test_sequels_share_a_franchise():
+    assert franchise_key("The Matrix") == franchise_key("Matrix 2") == franchise_key("The Matrix: Part III")
+    assert franchise_key("Alien") != franchise_key("Aliens")
+
+
+def test_lambda_one_keeps_the_relevance_order():
+    rng = np.random.default_rng(0)
+    relevance = rng.random(20).astype(np.float32)
+    similarity = rng.random((20, 20)).astype(np.float32)
+    assert list(mmr_order(relevance, similarity, 1.0, 10)) == list(np.argsort(-relevance)[:10])
+
+
+def test_near_duplicates_give_way_below_lambda_one():
+    rng = np.random.default_rng(1)
+    base = rng.standard_normal(DIM)
+    # five near copies of one movie ahead of five unrelated ones
+    embeddings = normalize_rows(np.vstack([base + 0.05 * rng.standard_normal((5, DIM)),
+                                           rng.standard_normal((5, DIM))]).astype(np.float32))
+    results = [{"id": str(i), "title": f"Movie {chr(65 + i)}", "genres": [], "similarity_score": 1.0 - i / 20}
+               for i in range(10)]
+    known = np.ones(10, dtype=bool)
+    plain = rerank(results, 4, 1.0, embeddings, known)
+    diverse = rerank(results, 4, 0.5, embeddings, known)
+    assert [movie["id"] for movie in plain] == ["0", "1", "2", "3"]
+    assert diverse[0]["id"] == "0"
+    assert redundancy(embeddings[[int(m["id"]) for m in diverse]]) < redundancy(embeddings[[0, 1, 2, 3]])
+
+
+@pytest.fixture
+def catalogue(monkeypatch):
+    movies = make_catalogue(500, DIM, clusters=8)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "HYBRID_SEARCH_ENABLED", False)
+    monkeypatch.setattr(vector_search, "RESULT_CACHE_ENABLED", False)
+    monkeypatch.setattr(vector_search, "DIVERSITY_CANDIDATES", 100)
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(DIM))
+    yield {movie["id"]: np.asarray(movie["embedding"], dtype=np.float32) for movie in movies}
+    vector_search.set_clients()
+
+
+def test_search_results_are_less_redundant_with_mmr(catalogue, monkeypatch):
+    def picked(lambda_):
+        monkeypatch.setattr(vector_search, "DIVERSITY_RERANK_ENABLED", lambda_ is not None)
+        monkeypatch.setattr(vector_search, "MMR_LAMBDA", lambda_ or 1.0)
+        results = vector_search.search_with_filtersAndPrompt("a heist in the rain", 10, YEARS, RATINGS)
+        return [movie["id"] for movie in results]
+
+    plain = picked(None)
+    assert picked(1.0) == plain
+    diverse = picked(0.5)
+    assert set(diverse) != set(plain)
+    vectors = lambda ids: np.array([catalogue[movie_id] for movie_id in ids])
+    assert redundancy(vectors(diverse)) < redundancy(vectors(plain))
@@ -0,0 +1,28 @@
+import numpy as np
+
+import vector_search
+from embedding_cache import EmbeddingCache
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+
+
+def test_clear_keeps_the_sqlite_tier_unless_asked(tmp_path):
+    cache = EmbeddingCache(db_path=str(tmp_path / "embeddings.db"))
+    cache.put("The Dark Knight", [1.0, 2.0], "model")
+
+    cache.clear(persistent=False)
+    assert cache.current_bytes == 0
+    assert np.array_equal(cache.get("the dark  knight", "model"), [1.0, 2.0])
+
+    cache.clear()
+    assert cache.get("The Dark Knight", "model") is None
+
+
+def test_set_clients_keeps_persisted_embeddings(tmp_path, monkeypatch):
+    cache = EmbeddingCache(db_path=str(tmp_path / "embeddings.db"))
+    monkeypatch.setattr(vector_search, "embedding_cache", cache)
+    cache.put("heist movie", [0.5, 0.5], FakeEmbeddings.deployment)
+
+    vector_search.set_clients(FakeContainer(make_catalogue(10, 4)), FakeEmbeddings(4))
+    assert len(cache._entries) == 0
+    assert cache.get("heist movie", FakeEmbeddings.deployment) is not None
+    vector_search.set_clients(None, None)
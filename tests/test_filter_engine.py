@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from fakes import GENRES, make_catalogue
+from filter_engine import FilterEngine
+from local_index import Catalogue, LocalSearchBackend
+
+FILTERS = [
+    (None, None, []),
+    ([1990, 2000], None, []),
+    (None, [7.0, 10.0], []),
+    (None, None, ["Drama"]),
+    ([1950, 1980], [5.0, 10.0], ["Crime", "Horror"]),
+    ([2000, 2000], [0.0, 10.0], ["Not A Genre"]),
+    ([1921, 2025], [9.5, 10.0], GENRES[:3]),
+]
+
+
+def passes(movie, year_range, rating_range, genres):
+    if year_range is not None and not year_range[0] <= movie["year"] <= year_range[1]:
+        return False
+    if rating_range is not None and not rating_range[0] <= movie["rating"] <= rating_range[1]:
+        return False
+    return not genres or any(genre in movie["genres"] for genre in genres)
+
+
+@pytest.fixture(scope="module")
+def movies():
+    return make_catalogue(2000, 16)
+
+
+@pytest.mark.parametrize("year_range, rating_range, genres", FILTERS)
+def test_mask_and_matches_agree_with_brute_force(movies, year_range, rating_range, genres):
+    engine = FilterEngine(np.array([movie["year"] for movie in movies]),
+                          np.array([movie["rating"] for movie in movies]), [movie["genres"] for movie in movies])
+    expected = np.array([passes(movie, year_range, rating_range, genres) for movie in movies])
+    assert np.array_equal(engine.mask(year_range, rating_range, genres), expected)
+    rows = np.arange(0, len(movies), 7)
+    assert np.array_equal(engine.matches(rows, year_range, rating_range, genres), expected[rows])
+
+
+@pytest.mark.parametrize("prefilter_selectivity", [1.0, 0.0])
+@pytest.mark.parametrize("year_range, rating_range, genres", FILTERS)
+def test_pre_and_post_filtered_search_agree_with_brute_force(movies, prefilter_selectivity, year_range,
+                                                              rating_range, genres):
+    embeddings = np.array([movie["embedding"] for movie in movies], dtype=np.float32)
+    # every list probed, so the post-filtered index search is exact too
+    backend = LocalSearchBackend(Catalogue(movies, embeddings), "ivf", prefilter_selectivity, n_lists=16, n_probe=16)
+    query = embeddings[3] + 0.5 * embeddings[40]
+    query /= np.linalg.norm(query)
+
+    allowed = [row for row, movie in enumerate(movies) if passes(movie, year_range, rating_range, genres)]
+    scores = embeddings[allowed] @ query
+    expected = [movies[allowed[i]]["id"] for i in np.argsort(-scores)[:10]]
+
+    results = backend.search(query, 10, year_range, rating_range, genres)
+    assert [movie["id"] for movie in results] == expected
@@ -0,0 +1,28 @@
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+
+
+@pytest.fixture(params=["local", "cosmos"])
+def movies(request, monkeypatch):
+    movies = make_catalogue(60, DIM)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", request.param)
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "SIMILAR_TABLE_PATH", "no_similar_table")
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(DIM))
+    yield movies
+    vector_search.set_clients()
+
+
+def test_source_is_excluded_however_the_title_is_typed(movies):
+    title = movies[5]["title"]
+    typed = "  " + "  ".join(title.lower().split()) + " "
+    for query in (typed, title):
+        results = vector_search.find_similar(query, 5, YEARS, RATINGS)
+        assert len(results) == 5
+        assert movies[5]["id"] not in [movie["id"] for movie in results]
@@ -0,0 +1,70 @@
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from lexical_index import fuse
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+
+
+def movie(movie_id, score):
+    return {"id": movie_id, "title": movie_id, "similarity_score": score}
+
+
+VECTOR = [movie("a", 0.9), movie("b", 0.8), movie("c", 0.5)]
+LEXICAL = [movie("c", 12.0), movie("d", 6.0)]
+
+
+def order(results):
+    return [result["id"] for result in results]
+
+
+def test_weights_move_between_vector_and_keyword_ranking():
+    assert order(fuse(VECTOR, LEXICAL, 0.0)) == ["a", "b", "c", "d"]
+    assert order(fuse(VECTOR, LEXICAL, 1.0))[:2] == ["c", "d"]
+    fused = {result["id"]: result["similarity_score"] for result in fuse(VECTOR, LEXICAL, 0.5)}
+    # min-max normalised similarity, BM25 divided by the best BM25 score
+    assert fused == pytest.approx({"a": 0.5, "b": 0.5 * 0.3 / 0.4, "c": 0.5, "d": 0.25})
+
+
+def test_keyword_only_matches_get_their_real_similarity_when_known():
+    without = {result["id"]: result["similarity_score"] for result in fuse(VECTOR, LEXICAL, 0.5)}
+    scores = {result["id"]: result["similarity_score"]
+              for result in fuse(VECTOR, LEXICAL, 0.5, lambda ids: {movie_id: 0.7 for movie_id in ids})}
+    assert scores["d"] == pytest.approx(without["d"] + 0.5 * (0.7 - 0.5) / 0.4)
+
+
+def test_empty_lists_fuse_to_the_other_one():
+    assert order(fuse([], LEXICAL, 1.0)) == ["c", "d"]
+    assert fuse([], LEXICAL, 1.0)[0]["similarity_score"] == 1.0
+    assert order(fuse(VECTOR, [], 0.3)) == ["a", "b", "c"]
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "HYBRID_SEARCH_ENABLED", True)
+    monkeypatch.setattr(vector_search, "HYBRID_KEYWORD_ONLY_TERMS", 2)
+    monkeypatch.setattr(vector_search, "RESULT_CACHE_ENABLED", False)
+    model = FakeEmbeddings(DIM)
+    vector_search.set_clients(FakeContainer(make_catalogue(300, DIM)), model)
+    yield model
+    vector_search.set_clients()
+
+
+def test_short_keyword_query_skips_the_embedding(embeddings):
+    results = vector_search.search_with_filtersAndPrompt("ghost storm", 5, YEARS, RATINGS)
+    assert len(results) == 5
+    assert all({"ghost", "storm"} & set(result["title"].lower().split()) for result in results)
+    assert embeddings.calls == 0
+
+
+def test_longer_or_rarer_queries_are_embedded(embeddings):
+    vector_search.search_with_filtersAndPrompt("ghost storm river night", 5, YEARS, RATINGS)
+    assert embeddings.calls == 1
+    # fewer titles contain the word than were asked for
+    vector_search.search_with_filtersAndPrompt("ghost", 200, YEARS, RATINGS)
+    assert embeddings.calls == 2
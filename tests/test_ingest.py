@@ -0,0 +1,44 @@
+import threading
+
+from fakes import FakeEmbeddings
+from ingest import Ingestor
+
+
+class SlowEmbeddings(FakeEmbeddings):
+    """Signals every embed_documents call"""
+
+    def __init__(self, dim: int):
+        super().__init__(dim)
+        self.embedding = [threading.Event() for _ in range(8)]
+
+    def embed_documents(self, texts):
+        self.embedding[self.calls].set()
+        return super().embed_documents(texts)
+
+
+class RecordingContainer:
+    def __init__(self, embeddings: SlowEmbeddings):
+        self.embeddings = embeddings
+        self.items = {}
+        self.overlapped = []
+
+    def upsert_item(self, item):
+        # the first batch's upserts wait for the second batch's embedding to start
+        if item["id"] in ("0", "1"):
+            self.overlapped.append(self.embeddings.embedding[1].wait(5))
+        self.items[item["id"]] = item
+
+
+def test_upserts_overlap_the_next_embedding_batch():
+    embeddings = SlowEmbeddings(8)
+    container = RecordingContainer(embeddings)
+    ingestor = Ingestor(container, embeddings, batch_size=2, force=True)
+    chunk = [{"id": i, "title": f"Movie {i}", "plot_summary": f"plot {i}", "year": 2000, "rating": 7.0}
+             for i in range(5)]
+
+    stats = ingestor.process_chunk(chunk)
+
+    assert stats == {"rows": 5, "invalid": 0, "unchanged": 0, "upserted": 5}
+    assert container.overlapped == [True, True]
+    assert sorted(container.items) == ["0", "1", "2", "3", "4"]
+    assert all(len(item["embedding"]) == 8 for item in container.items.values())
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from fakes import make_catalogue
+from local_index import Catalogue, FlatIndex, IVFIndex, LocalSearchBackend, normalize_rows
+
+TOP_K = 10
+
+
+@pytest.fixture(scope="module")
+def data():
+    movies = make_catalogue(3000, 32)
+    embeddings = np.array([movie["embedding"] for movie in movies], dtype=np.float32)
+    rng = np.random.default_rng(7)
+    queries = normalize_rows(embeddings[rng.choice(len(embeddings), 50, replace=False)]
+                             + 0.3 * rng.standard_normal((50, 32)).astype(np.float32))
+    truth = [set(np.argsort(-(embeddings @ query))[:TOP_K]) for query in queries]
+    return movies, Catalogue(movies, embeddings), queries, truth
+
+
+def recall(index, queries, truth, **params) -> float:
+    found = [len(set(index.search(query, TOP_K, **params)[0]) & expected) for query, expected in zip(queries, truth)]
+    return sum(found) / (TOP_K * len(queries))
+
+
+def test_flat_index_is_brute_force(data):
+    _, catalogue, queries, truth = data
+    assert recall(FlatIndex(catalogue.embeddings), queries, truth) == 1.0
+
+
+def test_ivf_recall_grows_with_the_lists_probed(data):
+    _, catalogue, queries, truth = data
+    index = IVFIndex(catalogue.embeddings, n_lists=32, n_probe=8)
+    recalls = [recall(index, queries, truth, n_probe=n_probe) for n_probe in (1, 8, 32)]
+    assert recalls[0] <= recalls[1] <= recalls[2]
+    assert recalls[1] >= 0.9
+    # probing every list scans the whole catalogue
+    assert recalls[2] == 1.0
+
+
+def test_every_row_is_in_exactly_one_list(data):
+    _, catalogue, _, _ = data
+    index = IVFIndex(catalogue.embeddings, n_lists=32)
+    assert np.array_equal(np.sort(np.concatenate(index.lists)), np.arange(len(catalogue)))
+
+
+def test_backends_return_the_brute_force_movies(data):
+    movies, catalogue, queries, truth = data
+    flat = LocalSearchBackend(catalogue, "flat")
+    ivf = LocalSearchBackend(catalogue, "ivf", n_lists=32, n_probe=32)
+    for query, expected in zip(queries[:10], truth):
+        ids = {movies[row]["id"] for row in expected}
+        assert {movie["id"] for movie in flat.search(query, TOP_K)} == ids
+        assert {movie["id"] for movie in ivf.search(query, TOP_K)} == ids
@@ -0,0 +1,40 @@
+import threading
+
+import metrics
+from fakes import FakeContainer, make_catalogue
+
+QUERY = "SELECT c.id, c.title FROM c"
+
+
+def test_query_cosmos_charges_its_own_pages():
+    movies = make_catalogue(20, 8)
+    containers = [FakeContainer(movies, request_charge=2.5), FakeContainer(movies, request_charge=40.0)]
+    traces = [None, None]
+
+    def search(i):
+        with metrics.trace("test") as trace:
+            for _ in range(20):
+                metrics.query_cosmos(containers[i], QUERY)
+        traces[i] = trace
+
+    threads = [threading.Thread(target=search, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for trace, charge in zip(traces, (2.5, 40.0)):
+        assert [span["request_charge"] for span in trace.spans] == [charge] * 20
+        assert all(span["pages"] == 1 and span["items"] == 20 for span in trace.spans)
+
+
+def test_response_hook_skips_the_pager():
+    class Pager:
+        def by_page(self):
+            return iter([])
+
+    span = {}
+    hook = metrics.cosmos_response_hook(span)
+    hook({"x-ms-request-charge": "99"}, Pager())
+    hook({"x-ms-request-charge": "3", "x-ms-throttle-retry-count": "1"}, {"Documents": []})
+    assert span == {"request_charge": 3.0, "retries": 1, "pages": 1}
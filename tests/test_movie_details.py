@@ -0,0 +1,69 @@
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from local_index import DETAIL_FIELDS, RANKING_FIELDS
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+
+
+@pytest.fixture(params=["local", "cosmos"])
+def queries(request, monkeypatch):
+    """Parameters of every query sent to the container"""
+    movies = make_catalogue(50, DIM)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", request.param)
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "HYBRID_SEARCH_ENABLED", False)
+    container = FakeContainer(movies)
+    sent = []
+    query_items = container.query_items
+
+    def recorded(query, parameters=None, **kwargs):
+        sent.append({p["name"]: p["value"] for p in parameters or []})
+        return query_items(query, parameters, **kwargs)
+
+    monkeypatch.setattr(container, "query_items", recorded)
+    vector_search.set_clients(container, FakeEmbeddings(DIM))
+    vector_search.catalogue_updated()
+    if request.param == "local":
+        vector_search.get_local_backend()
+    sent.clear()
+    yield sent
+    vector_search.set_clients()
+
+
+def test_results_leave_the_plots_out(queries):
+    results = vector_search.search_with_filtersAndPrompt("a heist in the rain", 5, YEARS, RATINGS)
+    assert len(results) == 5
+    for movie in results:
+        assert set(movie) == set(RANKING_FIELDS) | {"similarity_score"}
+
+
+def test_plots_are_fetched_once_for_the_cards_shown(queries):
+    results = vector_search.search_with_filtersAndPrompt("a heist in the rain", 5, YEARS, RATINGS)
+    ids = [movie["id"] for movie in results]
+    queries.clear()
+
+    details = vector_search.get_movie_details(ids[:3])
+    assert set(details) == set(ids[:3])
+    assert all(set(movie_details) == set(DETAIL_FIELDS) and movie_details["plot_summary"]
+               for movie_details in details.values())
+    fetches = len(queries)
+
+    # only the two cards not seen yet are looked up
+    full = vector_search.with_details(results)
+    assert all(movie["plot_synopsis"] for movie in full)
+    if vector_search.SEARCH_BACKEND == "cosmos":
+        assert fetches == 1 and queries[-1]["@ids"] == ids[3:]
+    vector_search.get_movie_details(ids)
+    assert len(queries) == (2 if vector_search.SEARCH_BACKEND == "cosmos" else 0)
+
+
+def test_catalogue_update_drops_cached_plots(queries):
+    vector_search.get_movie_details(["1", "2"])
+    vector_search.catalogue_updated()
+    queries.clear()
+    vector_search.get_movie_details(["1", "2"])
+    assert len(queries) == (1 if vector_search.SEARCH_BACKEND == "cosmos" else 0)
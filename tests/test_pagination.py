@@ -0,0 +1,58 @@
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+QUERY = "a heist in the rain"
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """top_k of every search that reached the local index"""
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "HYBRID_SEARCH_ENABLED", False)
+    monkeypatch.setattr(vector_search, "DIVERSITY_RERANK_ENABLED", False)
+    monkeypatch.setattr(vector_search, "RESULT_WINDOW", 10)
+    vector_search.set_clients(FakeContainer(make_catalogue(80, DIM)), FakeEmbeddings(DIM))
+    backend = vector_search.get_local_backend()
+    search, calls = backend.search, []
+
+    def counted(query_embedding, top_k=5, *args, **kwargs):
+        calls.append(top_k)
+        return search(query_embedding, top_k, *args, **kwargs)
+
+    monkeypatch.setattr(backend, "search", counted)
+    yield calls
+    vector_search.set_clients()
+
+
+def test_next_page_and_fewer_results_come_from_the_window(searches):
+    first = vector_search.search_page(QUERY, 0, 6, YEARS, RATINGS)
+    second = vector_search.search_page(QUERY, 6, 4, YEARS, RATINGS)
+    # the slider moved down to 3 results
+    fewer = vector_search.search_with_filtersAndPrompt(QUERY, 3, YEARS, RATINGS)
+    assert searches == [10]
+    assert fewer == first[:3]
+    window = vector_search.search_with_filtersAndPrompt(QUERY, 10, YEARS, RATINGS)
+    assert first + second == window
+    assert len({movie["id"] for movie in window}) == 10
+
+
+def test_paging_past_the_window_widens_it_once(searches):
+    first = vector_search.search_page(QUERY, 0, 10, YEARS, RATINGS)
+    assert searches == [10]
+    second = vector_search.search_page(QUERY, 10, 5, YEARS, RATINGS)
+    third = vector_search.search_page(QUERY, 15, 5, YEARS, RATINGS)
+    assert searches == [10, 20]
+    assert first + second + third == vector_search.search_with_filtersAndPrompt(QUERY, 20, YEARS, RATINGS)
+    assert searches == [10, 20]
+
+
+def test_other_filters_are_their_own_window(searches):
+    vector_search.search_page(QUERY, 0, 5, YEARS, RATINGS)
+    vector_search.search_page(QUERY, 0, 5, YEARS, [7.0, 10.0])
+    assert searches == [10, 10]
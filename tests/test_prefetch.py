@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from prefetch import Prefetcher
+
+DIM = 16
+SEARCH = dict(query_text="a heist in the rain", top_k=5, year_range=[1921, 2025], rating_range=[0.0, 10.0], genre=[])
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "cosmos")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "HYBRID_SEARCH_ENABLED", False)
+    container, model = FakeContainer(make_catalogue(60, DIM)), FakeEmbeddings(DIM)
+    vector_search.set_clients(container, model)
+    vector_search.catalogue_updated()
+    yield container, model
+    vector_search.set_clients()
+
+
+def test_taken_prefetch_returns_the_search_and_its_trace(clients):
+    container, model = clients
+    prefetcher = Prefetcher()
+    prefetcher.start("rag", lambda: vector_search.search_with_filtersAndPrompt(**SEARCH))
+    results, traces = prefetcher.take("rag")
+    assert results == vector_search.search_with_filtersAndPrompt(**SEARCH)
+    assert [trace["entry_point"] for trace in traces] == ["search_with_filtersAndPrompt"]
+    assert (container.calls, model.calls) == (1, 1)
+
+
+def test_prefetched_search_is_served_from_the_result_cache(clients):
+    container, model = clients
+    prefetcher = Prefetcher()
+    prefetcher.start("rag", lambda: vector_search.search_with_filtersAndPrompt(**SEARCH))
+    prefetcher.future.result()
+    # the prefetch isn't taken (the inputs changed and changed back), the search it ran is still cached
+    assert prefetcher.take("other inputs") is None
+    results = vector_search.search_with_filtersAndPrompt(**SEARCH)
+    assert len(results) == 5
+    assert (container.calls, model.calls) == (1, 1)
+
+
+def test_inputs_changed_during_the_debounce_are_never_searched(clients):
+    container, model = clients
+    prefetcher = Prefetcher()
+    started = threading.Event()
+    prefetcher.start("first", lambda: started.set(), delay=0.2)
+    prefetcher.start("rag", lambda: vector_search.search_with_filtersAndPrompt(**SEARCH), delay=0.05)
+    assert prefetcher.take("rag")[0] == vector_search.search_with_filtersAndPrompt(**SEARCH)
+    assert not started.is_set()
+    assert (container.calls, model.calls) == (1, 1)
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+LIKED = [3, 17]
+
+
+@pytest.fixture(params=["local", "cosmos"])
+def movies(request, monkeypatch):
+    movies = make_catalogue(300, DIM)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", request.param)
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "RRF_DEPTH", 50)
+    monkeypatch.setattr(vector_search, "RESULT_WINDOW", 10)
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(DIM))
+    yield movies
+    vector_search.set_clients()
+
+
+def ranked(movies, query, excluded, depth):
+    """Brute force: catalogue rows by similarity to query, excluded rows left out"""
+    embeddings = np.array([movie["embedding"] for movie in movies], dtype=np.float32)
+    scores = embeddings @ (query / np.linalg.norm(query))
+    return [row for row in np.argsort(-scores, kind="stable") if row not in excluded][:depth]
+
+
+def closest_to_liked(movies):
+    """The movie closest to the first liked one, its neighbours are the ones a dislike should push down"""
+    return ranked(movies, np.asarray(movies[LIKED[0]]["embedding"]), set(LIKED), 1)
+
+
+def recommend(movies, method, disliked, top_k=10):
+    return vector_search.recommend([movies[row]["title"] for row in LIKED],
+                                   [movies[row]["title"] for row in disliked], top_k, YEARS, RATINGS, method=method)
+
+
+def test_centroid_searches_around_liked_minus_disliked(movies):
+    dislikes = closest_to_liked(movies)
+    vectors = {row: np.asarray(movies[row]["embedding"], dtype=np.float32) for row in LIKED + dislikes}
+    centroid = np.mean([vectors[row] for row in LIKED], axis=0)
+    centroid -= vector_search.RECOMMEND_NEGATIVE_WEIGHT * np.mean([vectors[row] for row in dislikes], axis=0)
+    expected = ranked(movies, centroid, set(LIKED + dislikes), 10)
+    assert [movie["id"] for movie in recommend(movies, "centroid", dislikes)] == [movies[row]["id"] for row in expected]
+
+
+def test_rrf_fuses_one_list_per_movie(movies):
+    dislikes = closest_to_liked(movies)
+    excluded = set(LIKED + dislikes)
+    fused = {}
+    for row, weight in [(row, 1.0) for row in LIKED] + [(row, -vector_search.RECOMMEND_NEGATIVE_WEIGHT) for row in dislikes]:
+        for rank, found in enumerate(ranked(movies, np.asarray(movies[row]["embedding"]), excluded, 50)):
+            fused[found] = fused.get(found, 0.0) + weight / (vector_search.RRF_K + rank + 1)
+    expected = sorted((row for row in fused if fused[row] > 0), key=lambda row: -fused[row])[:10]
+
+    results = recommend(movies, "rrf", dislikes)
+    assert [movie["id"] for movie in results] == [movies[row]["id"] for row in expected]
+    assert [movie["similarity_score"] for movie in results] == pytest.approx([fused[row] for row in expected])
+
+
+@pytest.mark.parametrize("method", ["centroid", "rrf"])
+def test_disliked_movies_push_their_neighbours_down(movies, method):
+    dislikes = closest_to_liked(movies)
+    neighbours = {movies[row]["id"] for row in ranked(movies, np.asarray(movies[dislikes[0]]["embedding"]),
+                                                      set(LIKED + dislikes), 20)}
+    liked_only = recommend(movies, method, [], top_k=30)
+    with_disliked = recommend(movies, method, dislikes, top_k=30)
+    inputs = {movies[row]["id"] for row in LIKED + dislikes}
+    assert not inputs & {movie["id"] for movie in with_disliked}
+
+    def positions(results):
+        ids = [movie["id"] for movie in results]
+        return [ids.index(movie_id) if movie_id in ids else len(ids) for movie_id in neighbours]
+
+    assert sum(positions(with_disliked)) > sum(positions(liked_only))
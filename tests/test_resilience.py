@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, Upstream, deadline, is_upstream_failure
+
+
+def fail():
+    raise ConnectionError("upstream down")
+
+
+def test_circuit_opens_and_recovers_through_one_trial():
+    breaker = CircuitBreaker("test", failures=2, reset_seconds=0.05)
+    breaker.failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_released_trial_lets_the_next_call_try():
+    breaker = CircuitBreaker("test", failures=1, reset_seconds=0.0)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_upstream_rejects_calls_while_open():
+    upstream = Upstream("test", breaker=CircuitBreaker("test", failures=2, reset_seconds=60))
+    for _ in range(2):
+        with pytest.raises(ConnectionError, match="upstream down"):
+            upstream.call(fail)
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        upstream.call(lambda: calls.append(1))
+    assert calls == []
+
+
+class HttpError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def test_only_unhealthy_upstream_errors_count_as_failures():
+    assert is_upstream_failure(ConnectionError())
+    assert is_upstream_failure(TimeoutError())
+    assert is_upstream_failure(HttpError(429)) and is_upstream_failure(HttpError(503))
+    assert is_upstream_failure(RateLimitError())
+    assert not is_upstream_failure(HttpError(400)) and not is_upstream_failure(HttpError(404))
+    assert not is_upstream_failure(ValueError("bad query"))
+
+
+def test_bad_requests_do_not_open_the_circuit():
+    upstream = Upstream("test", breaker=CircuitBreaker("test", failures=2, reset_seconds=60))
+
+    def bad_request():
+        raise HttpError(400)
+
+    async def bad_request_async():
+        bad_request()
+
+    for _ in range(3):
+        with pytest.raises(HttpError):
+            upstream.call(bad_request)
+        with pytest.raises(HttpError):
+            asyncio.run(upstream.call_async(bad_request_async))
+    assert upstream.breaker.state == "closed"
+
+
+def test_hedges_stay_within_budget_across_threads():
+    upstream = Upstream("test", timeout_floor=2.0, timeout_ceiling=2.0, hedge_budget=0.25, workers=64)
+    for _ in range(20):
+        upstream.call(lambda: time.sleep(0.001))
+    # every call is a straggler, only the budget decides how many get hedged
+    threads = [threading.Thread(target=upstream.call, args=(lambda: time.sleep(0.05),)) for _ in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert upstream._calls == 60
+    assert upstream._hedges <= 0.25 * upstream._calls
+
+
+def test_stalled_call_times_out_and_counts_as_failure():
+    upstream = Upstream("test", timeout_floor=0.05, timeout_ceiling=0.05, hedge=False)
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        upstream.call(lambda: time.sleep(0.5))
+    assert time.monotonic() - started < 0.3
+    assert upstream.breaker._failed == 1
+
+
+def test_request_deadline_cuts_the_call_without_blaming_the_upstream():
+    upstream = Upstream("test", timeout_floor=1.0, timeout_ceiling=1.0, hedge=False)
+    with deadline(0.05):
+        with pytest.raises(DeadlineExceeded):
+            upstream.call(lambda: time.sleep(0.3))
+    assert upstream.breaker._failed == 0
+
+
+def test_straggler_is_hedged():
+    upstream = Upstream("test", timeout_floor=2.0, timeout_ceiling=2.0, hedge_budget=1.0)
+    for _ in range(20):
+        upstream.call(lambda: time.sleep(0.001))
+    attempts = []
+    lock = threading.Lock()
+
+    def first_stalls():
+        with lock:
+            attempts.append(1)
+            stall = len(attempts) == 1
+        time.sleep(1.0 if stall else 0.001)
+        return len(attempts)
+
+    started = time.monotonic()
+    assert upstream.call(first_stalls) == 2
+    assert time.monotonic() - started < 0.5
+
+
+@pytest.fixture
+def container(monkeypatch):
+    container = FakeContainer(make_catalogue(40, 8))
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "cosmos")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "HYBRID_SEARCH_ENABLED", False)
+    monkeypatch.setitem(vector_search._upstreams, "cosmos",
+                        Upstream("cosmos", breaker=CircuitBreaker("cosmos", failures=2, reset_seconds=60)))
+    vector_search.set_clients(container, FakeEmbeddings(8))
+    yield container
+    vector_search.set_clients()
+
+
+def test_outage_serves_last_good_results_as_degraded(container, monkeypatch):
+    good = vector_search.vector_search("a heist in the rain", 5)
+    assert len(good) == 5 and not vector_search.is_degraded(good)
+
+    monkeypatch.setattr(container, "query_items", lambda *args, **kwargs: fail())
+    for _ in range(3):
+        served = vector_search.vector_search("a heist in the rain", 5)
+        assert [movie["id"] for movie in served] == [movie["id"] for movie in good]
+        assert all(movie["degraded"] for movie in served)
+    assert vector_search.get_upstream("cosmos").breaker.state == "open"
+    assert not vector_search.is_degraded(good)
+
+    # nothing good to fall back on and no local index
+    assert vector_search.vector_search("a search never answered", 5) == []
+
+
+def test_degraded_answer_leaves_cached_results_alone(container, monkeypatch):
+    monkeypatch.setattr(vector_search, "RESULT_WINDOW", 10)
+    query, filters = "a heist in the rain", ([1921, 2025], [0.0, 10.0])
+    first_page = vector_search.search_page(query, 0, 10, *filters)
+    monkeypatch.setattr(container, "query_items", lambda *args, **kwargs: fail())
+    # past the cached window, answered from the last good results
+    assert vector_search.is_degraded(vector_search.search_page(query, 0, 15, *filters))
+    assert vector_search.search_page(query, 0, 10, *filters) == first_page
+    assert not vector_search.is_degraded(first_page)
+
+
+def test_guarded_embeddings_create_their_upstream_on_first_use(monkeypatch):
+    monkeypatch.setattr(vector_search, "_upstreams", {})
+    monkeypatch.setattr(vector_search, "_guarded_embeddings", None)
+    vector_search.set_clients(FakeContainer([]), FakeEmbeddings(8))
+    try:
+        # a thread, so a deadlock fails the test instead of hanging it
+        thread = threading.Thread(target=vector_search.get_guarded_embeddings, daemon=True)
+        thread.start()
+        thread.join(2)
+        assert not thread.is_alive()
+        assert vector_search.get_guarded_embeddings().upstream is vector_search.get_upstream("embedding")
+    finally:
+        vector_search.set_clients()
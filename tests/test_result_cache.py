@@ -0,0 +1,90 @@
+import time
+
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from result_cache import ResultCache, result_key
+
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+
+
+def key(query="heist", genres=("Drama", "Crime"), ratings=(0, 10), top_k=5):
+    return result_key("prompt", query, [1990, 2000], list(ratings), list(genres), top_k)
+
+
+def test_key_normalizes_query_filters_and_genre_order():
+    assert key("  A Heist   in the RAIN ") == key("a heist in the rain")
+    assert key(genres=("Crime", "Drama")) == key(genres=("Drama", "Crime"))
+    assert key(ratings=(0.0, 10.0)) == key(ratings=(0, 10))
+    assert key(top_k=5) != key(top_k=10)
+    assert key(genres=("Drama",)) != key()
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ResultCache(ttl_seconds=0.05)
+    cache.put(key(), [{"id": "1"}])
+    assert cache.get(key()) == [{"id": "1"}]
+    time.sleep(0.06)
+    assert cache.get(key()) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_entries=2)
+    cache.put(key("a"), [{"id": "a"}])
+    cache.put(key("b"), [{"id": "b"}])
+    cache.get(key("a"))
+    cache.put(key("c"), [{"id": "c"}])
+    assert cache.get(key("b")) is None
+    assert cache.get(key("a")) and cache.get(key("c"))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_callers_never_change_cached_results():
+    cache = ResultCache()
+    results = [{"id": "1"}]
+    cache.put(key(), results)
+    results[0]["title"] = "changed"
+    cache.get(key())[0]["degraded"] = True
+    assert cache.get(key()) == [{"id": "1"}]
+
+
+def test_invalidate_drops_entries_and_runs_hooks():
+    cache = ResultCache()
+    dropped = []
+    cache.on_invalidate(lambda: dropped.append(True))
+    cache.put(key("a"), [{"id": "a"}])
+    cache.put(key("b"), [{"id": "b"}])
+    cache.invalidate(lambda entry: entry[1] == "a")
+    assert cache.get(key("a")) is None and cache.get(key("b")) is not None
+    cache.invalidate()
+    assert len(cache) == 0 and dropped == [True, True]
+
+
+@pytest.fixture
+def movies(monkeypatch):
+    movies = make_catalogue(60, 16)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "SIMILAR_TABLE_PATH", "no_similar_table")
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(16))
+    yield movies
+    vector_search.set_clients()
+
+
+def test_title_typed_differently_shares_one_clean_entry(movies, monkeypatch):
+    title = movies[7]["title"]
+    typed = vector_search.find_similar(title.upper(), 5, YEARS, RATINGS)
+    monkeypatch.setattr(vector_search.get_local_backend(), "search", None)
+    exact = vector_search.find_similar(title, 5, YEARS, RATINGS)
+    assert exact == typed
+    assert movies[7]["id"] not in [movie["id"] for movie in exact]
+
+
+def test_catalogue_update_invalidates_searches(movies):
+    vector_search.find_similar(movies[7]["title"], 5, YEARS, RATINGS)
+    assert len(vector_search.result_cache) > 0
+    vector_search.catalogue_updated()
+    assert len(vector_search.result_cache) == 0
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from fakes import make_catalogue
+from filter_engine import FilterEngine
+from local_index import Catalogue
+from shards import Shard
+from snapshot import Snapshot, write_snapshot
+
+FILTERS = [
+    (None, None, None),
+    ([1990, 2010], None, None),
+    (None, [6.0, 10.0], ["Drama", "Comedy"]),
+    ([1950, 2000], [3.0, 8.0], ["Horror"]),
+]
+
+
+@pytest.fixture(params=["records", "snapshot"])
+def catalogue(request, tmp_path):
+    movies = make_catalogue(300, 16)
+    catalogue = Catalogue(movies, np.array([movie["embedding"] for movie in movies], dtype=np.float32))
+    if request.param == "snapshot":
+        write_snapshot(str(tmp_path), catalogue)
+        catalogue = Snapshot.load(str(tmp_path)).catalogue
+    return catalogue
+
+
+def test_shard_filters_cover_only_their_rows(catalogue):
+    full = FilterEngine.from_catalogue(catalogue)
+    shard = Shard(catalogue, 1, 3)
+    assert shard.filters.size == shard.end - shard.start
+    for year_range, rating_range, genre in FILTERS:
+        expected = full.mask(year_range, rating_range, genre)[shard.start:shard.end]
+        assert np.array_equal(shard.filters.mask(year_range, rating_range, genre), expected)
+
+
+def test_shards_together_match_an_exact_filtered_search(catalogue):
+    full = FilterEngine.from_catalogue(catalogue)
+    query = np.random.default_rng(1).standard_normal(16).astype(np.float32)
+    query /= np.linalg.norm(query)
+    shards = [Shard(catalogue, i, 3) for i in range(3)]
+    for year_range, rating_range, genre in FILTERS:
+        rows = np.concatenate([shard.search(query[None, :], 5, year_range, rating_range, genre, [[0, 150]])[0][0]
+                               for shard in shards])
+        allowed = np.flatnonzero(full.mask(year_range, rating_range, genre))
+        allowed = allowed[~np.isin(allowed, [0, 150])]
+        scores = catalogue.embeddings.scores(query, allowed)
+        best = set(allowed[np.argsort(-scores)[:5]].tolist())
+        assert best <= set(rows.tolist())
+        assert set(rows.tolist()) <= set(allowed.tolist())
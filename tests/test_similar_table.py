@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from local_index import Catalogue
+from similar_table import SimilarTable
+
+DIM = 16
+YEARS, RATINGS = [1921, 2025], [0.0, 10.0]
+
+
+def catalogue_of(movies):
+    return Catalogue(movies, np.array([movie["embedding"] for movie in movies], dtype=np.float32))
+
+
+@pytest.fixture
+def movies(monkeypatch, tmp_path):
+    movies = make_catalogue(40, DIM)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "SIMILAR_TABLE_PATH", str(tmp_path / "similar_table"))
+    monkeypatch.setattr(vector_search, "SIMILAR_TABLE_CHECK_SECONDS", -1)
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(DIM))
+    yield movies
+    vector_search.set_clients()
+
+
+def test_table_matches_an_exact_search(movies):
+    table = SimilarTable.build(catalogue_of(movies), top_n=10)
+    table.save(vector_search.SIMILAR_TABLE_PATH)
+    title = movies[4]["title"]
+    from_table = vector_search.find_similar(title, 5, YEARS, RATINGS)
+    vector_search.SIMILAR_TABLE_PATH = "no_similar_table"
+    vector_search.set_clients(FakeContainer(movies), FakeEmbeddings(DIM))
+    live = vector_search.find_similar(title, 5, YEARS, RATINGS)
+    assert [movie["id"] for movie in from_table] == [movie["id"] for movie in live]
+
+
+def test_updated_table_is_swapped_in(movies):
+    path = vector_search.SIMILAR_TABLE_PATH
+    SimilarTable.build(catalogue_of(movies), top_n=10).save(path)
+    first = vector_search.get_similar_table()
+    assert first is vector_search.get_similar_table()
+
+    movies.append({**movies[0], "id": "new", "title": "Zebra Crossing"})
+    first.update(catalogue_of(movies)).save(path)
+    stat = os.stat(os.path.join(path, "manifest.json"))
+    os.utime(os.path.join(path, "manifest.json"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    second = vector_search.get_similar_table()
+    assert second is not first
+    assert second.row_for_id("new") is not None
@@ -0,0 +1,34 @@
+import numpy as np
+
+import vector_search
+from fakes import make_catalogue
+from local_index import Catalogue, build_index
+from snapshot import Snapshot, write_snapshot
+
+
+def export(path, storage="float32", n_lists=8):
+    movies = make_catalogue(200, 16)
+    embeddings = np.array([movie["embedding"] for movie in movies], dtype=np.float32)
+    catalogue = Catalogue(movies, embeddings, storage=storage)
+    write_snapshot(str(path), catalogue, build_index(catalogue.embeddings, "ivf", n_lists=n_lists))
+
+
+def test_matching_settings_have_no_mismatches(tmp_path):
+    export(tmp_path, "int8", 8)
+    assert Snapshot.load(str(tmp_path)).config_mismatches("int8", 8) == []
+    assert Snapshot.load(str(tmp_path)).config_mismatches("int8") == []
+
+
+def test_tuned_settings_the_snapshot_lacks_are_warned_about(tmp_path, monkeypatch, capsys):
+    export(tmp_path, "float32", 8)
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", str(tmp_path))
+    monkeypatch.setattr(vector_search, "SEARCH_SHARDS", 0)
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "ivf")
+    monkeypatch.setattr(vector_search, "EMBEDDING_STORAGE", "int8")
+    monkeypatch.setattr(vector_search, "IVF_N_LISTS", "16")
+    backend, _ = vector_search._build_local_backend()
+    # still served from the snapshot as exported
+    assert backend.catalogue.embeddings.exact.storage == "float32"
+    assert backend.index.n_lists == 8
+    output = capsys.readouterr().out
+    assert "EMBEDDING_STORAGE=int8" in output and "IVF_N_LISTS=16" in output
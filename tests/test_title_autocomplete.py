@@ -0,0 +1,90 @@
+import snapshot as snapshot_module
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from title_autocomplete import TitleAutocomplete
+
+
+def movies(titles_ratings):
+    return [{"id": str(i), "title": title, "year": 2000, "rating": rating}
+            for i, (title, rating) in enumerate(titles_ratings)]
+
+
+def test_exact_and_title_prefix_beat_better_rated_word_prefixes():
+    catalogue = [(f"The Star Chronicle {i}", 9.0) for i in range(500)]
+    catalogue += [("Star", 2.0), ("Star Trek", 3.0)]
+    index = TitleAutocomplete(movies(catalogue))
+    assert index.suggest("star", 3)[:2] == ["Star", "Star Trek"]
+
+
+def test_word_prefix_pool_keeps_best_rated():
+    catalogue = [(f"The Night {i}", i / 100) for i in range(500)]
+    index = TitleAutocomplete(movies(catalogue))
+    assert index.suggest("night", 3) == ["The Night 499", "The Night 498", "The Night 497"]
+
+
+def test_fuzzy_when_nothing_prefixed():
+    index = TitleAutocomplete(movies([("The Dark Knight", 9.0), ("Inception", 8.8)]))
+    assert index.suggest("dark knigth", 1) == ["The Dark Knight"]
+    assert index.suggest("", 5) == []
+
+
+def test_cosmos_index_is_reloaded(monkeypatch):
+    catalogue = make_catalogue(20, 8)
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "cosmos")
+    vector_search.set_clients(FakeContainer(catalogue), FakeEmbeddings(8))
+    try:
+        version = vector_search.title_index_version()
+        assert vector_search.title_index_version() == version
+        catalogue.append({**catalogue[0], "id": "new", "title": "Zebra Crossing"})
+        monkeypatch.setattr(vector_search, "TITLE_LOOKUP_RELOAD_SECONDS", 0)
+        assert vector_search.title_index_version() != version
+        assert vector_search.get_title_autocomplete().suggest("zebra") == ["Zebra Crossing"]
+    finally:
+        vector_search.set_clients()
+
+
+def test_local_index_follows_snapshot_swaps(monkeypatch):
+    catalogue = make_catalogue(20, 8)
+    snapshot = {"version": None}
+    build = vector_search._build_local_backend
+
+    def build_from_container(version=None):
+        # a fake "snapshot": the backend is built from the container, the version comes from `snapshot`
+        current, snapshot["version"] = snapshot["version"], None
+        try:
+            return build()[0], version
+        finally:
+            snapshot["version"] = current
+
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", "snapshots")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_CHECK_SECONDS", -1)
+    monkeypatch.setattr(snapshot_module, "current_version", lambda path: snapshot["version"])
+    monkeypatch.setattr(vector_search, "_build_local_backend", build_from_container)
+    vector_search.set_clients(FakeContainer(catalogue), FakeEmbeddings(8))
+    try:
+        version = vector_search.title_index_version()
+        assert vector_search.get_title_autocomplete().suggest("zebra") == []
+        catalogue.append({**catalogue[0], "id": "new", "title": "Zebra Crossing"})
+        snapshot["version"] = "v2"
+        assert vector_search.title_index_version() != version
+        assert vector_search.get_title_autocomplete().suggest("zebra") == ["Zebra Crossing"]
+    finally:
+        vector_search.set_clients()
+
+
+def test_prefixed_pool_matches_brute_force():
+    catalogue = make_catalogue(3000, 4)
+    index = TitleAutocomplete(catalogue)
+    for query in ["s", "st", "star", "n", "night c", "g", "zz"]:
+        expected = {}
+        for row, key in enumerate(index.keys):
+            if key == query:
+                expected[row] = 0
+            elif key.startswith(query):
+                expected[row] = 1
+            elif any(word.startswith(query) for word in key.split(" ")) or f" {query}" in key:
+                expected[row] = 2
+        best = sorted(expected, key=lambda row: (expected[row], index._rank[row]))[:40]
+        assert index._prefixed(query, 40) == {row: expected[row] for row in best}
@@ -0,0 +1,87 @@
+import copy
+
+import numpy as np
+import pytest
+
+import vector_search
+from fakes import FakeContainer, FakeEmbeddings, make_catalogue
+from title_lookup import TitleLookup
+
+DIM = 16
+
+
+def new_movie(movies, movie_id, title, ts=5):
+    movie = copy.deepcopy(movies[0])
+    movie.update(id=movie_id, title=title, _ts=ts)
+    return movie
+
+
+@pytest.fixture
+def movies():
+    return make_catalogue(50, DIM)
+
+
+@pytest.fixture
+def local_backend(monkeypatch, movies):
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "local")
+    monkeypatch.setattr(vector_search, "LOCAL_INDEX_TYPE", "flat")
+    monkeypatch.setattr(vector_search, "SNAPSHOT_PATH", None)
+    monkeypatch.setattr(vector_search, "TITLE_LOOKUP_REFRESH_SECONDS", 0)
+    container = FakeContainer(movies)
+    vector_search.set_clients(container, FakeEmbeddings(DIM))
+    yield container
+    vector_search.set_clients()
+
+
+def test_refresh_adds_and_updates_rows(movies):
+    container = FakeContainer(movies)
+    lookup = TitleLookup.from_container(container)
+    movies.append(new_movie(movies, "new1", "Brand New"))
+    changed = copy.deepcopy(movies[3])
+    movies[3]["embedding"] = list(np.ones(DIM) / np.sqrt(DIM))
+    movies[3]["_ts"] = 6
+
+    assert lookup.refresh(container) == 2
+    assert len(lookup) == 51
+    assert lookup.row_for_id("new1") == 50
+    assert lookup.get("Brand New") is not None
+    np.testing.assert_allclose(lookup.embeddings[3], movies[3]["embedding"], rtol=1e-6)
+    assert changed["embedding"] != movies[3]["embedding"]
+    assert lookup.refresh(container) == 0
+
+
+def test_shared_lookup_is_never_refreshed(local_backend, movies):
+    backend = vector_search.get_local_backend()
+    lookup = vector_search.get_title_lookup()
+    assert lookup is backend.title_lookup
+    with pytest.raises(ValueError):
+        lookup.refresh(local_backend)
+
+
+def test_local_lookup_rows_stay_catalogue_rows(local_backend, movies):
+    backend = vector_search.get_local_backend()
+    vector_search.get_title_lookup()
+    local_backend.movies.append(new_movie(movies, "new1", "Brand New"))
+
+    lookup = vector_search.get_title_lookup()
+    assert len(lookup) == len(backend.catalogue) == 50
+    assert lookup.row_for_id("new1") is None
+    # int8 / PQ stores stay shared with the catalogue instead of becoming a float32 copy
+    assert lookup.embeddings is backend.catalogue.embeddings
+    details = vector_search.get_movie_details([movies[4]["id"]])
+    assert details[movies[4]["id"]]["plot_summary"] == movies[4]["plot_summary"]
+
+
+def test_cosmos_lookup_reload_drops_deleted_movies(monkeypatch, movies):
+    monkeypatch.setattr(vector_search, "SEARCH_BACKEND", "cosmos")
+    container = FakeContainer(movies)
+    vector_search.set_clients(container, FakeEmbeddings(DIM))
+    try:
+        assert vector_search.get_title_lookup().row_for_id(movies[0]["id"]) == 0
+        del movies[0]
+        monkeypatch.setattr(vector_search, "TITLE_LOOKUP_RELOAD_SECONDS", 0)
+        lookup = vector_search.get_title_lookup()
+        assert len(lookup) == 49
+        assert lookup.row_for_id("0") is None
+    finally:
+        vector_search.set_clients()
@@ -0,0 +1,158 @@
+import bisect
+from typing import Any, Dict, List
+
+import numpy as np
+
+from title_lookup import normalize_title
+
+TITLES_QUERY = """
+    SELECT c.id, c.title, c.year, c.rating
+    FROM c
+"""
+
+# match quality tiers, lower is better
+EXACT, PREFIX, WORD_PREFIX, SUBSTRING, FUZZY = range(5)
+
+
+def trigrams(text: str) -> List[str]:
+    padded = f"  {text} "
+    return list({padded[i:i + 3] for i in range(len(padded) - 2)})
+
+
+# autocomplete over the catalogue titles: bisect over sorted keys for prefixes,
+# trigram inverted index for infix and typo-tolerant matches
+
+class TitleAutocomplete:
+    def __init__(self, movies: List[Dict[str, Any]], min_similarity: float = 0.5):
+        self.min_similarity = min_similarity
+        self.ids = [movie.get("id") for movie in movies]
+        self.titles = [movie.get("title") or "" for movie in movies]
+        self.years = [movie.get("year") for movie in movies]
+        self.ratings = np.array([movie.get("rating") or 0.0 for movie in movies], dtype=np.float32)
+        self.keys = [normalize_title(title) for title in self.titles]
+
+        # every word start of every title, so "knight" finds "The Dark Knight"
+        word_starts = []
+        for row, key in enumerate(self.keys):
+            position = 0
+            for word in key.split(" "):
+                word_starts.append((key[position:], row))
+                position += len(word) + 1
+        word_starts.sort()
+        self._starts = [start for start, _ in word_starts]
+        self._start_rows = np.array([row for _, row in word_starts], dtype=np.int64)
+        # whole titles too, so exact and title prefix matches are found apart from the word prefix ones
+        order = sorted(range(len(self.keys)), key=self.keys.__getitem__)
+        self._sorted_keys = [self.keys[row] for row in order]
+        self._sorted_rows = np.array(order, dtype=np.int64)
+        self._sorted_position = np.empty(len(order), dtype=np.int64)
+        self._sorted_position[self._sorted_rows] = np.arange(len(order))
+        # rating rank of every row (0 is the best rated) alongside both sorted arrays, so a short prefix
+        # matching much of the catalogue is cut down to its best rated rows before anything is sorted
+        self._rank = np.empty(len(self.keys), dtype=np.int64)
+        self._rank[np.argsort(-self.ratings, kind="stable")] = np.arange(len(self.keys))
+        self._sorted_ranks = self._rank[self._sorted_rows]
+        self._start_ranks = self._rank[self._start_rows]
+        self.common_gram_rows = max(1000, len(self.keys) // 10)
+
+        postings: Dict[str, List[int]] = {}
+        for row, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                postings.setdefault(gram, []).append(row)
+        self._postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+    def __len__(self):
+        return len(self.titles)
+
+    @classmethod
+    def from_container(cls, container) -> "TitleAutocomplete":
+        return cls(list(container.query_items(query=TITLES_QUERY, enable_cross_partition_query=True)))
+
+    @classmethod
+    def from_titles(cls, titles: List[str]) -> "TitleAutocomplete":
+        return cls([{"id": None, "title": title} for title in titles])
+
+    def _prefixed(self, query: str, limit: int) -> Dict[int, int]:
+        """Rows with a word starting with query and their tier, at most `limit` of them. Tiers are
+        filled best first, the best rated rows of a tier when it doesn't fit"""
+        first = bisect.bisect_left(self._sorted_keys, query)
+        exact_end = bisect.bisect_right(self._sorted_keys, query, first)
+        last = bisect.bisect_left(self._sorted_keys, query + "\uffff", exact_end)
+        start = bisect.bisect_left(self._starts, query)
+        end = bisect.bisect_left(self._starts, query + "\uffff", start)
+
+        tiers: Dict[int, int] = {}
+        ranges = [
+            (EXACT, self._sorted_rows[first:exact_end], self._sorted_ranks[first:exact_end], None),
+            (PREFIX, self._sorted_rows[exact_end:last], self._sorted_ranks[exact_end:last], None),
+            # titles starting with query have a word starting with it too, they are in a better tier already
+            (WORD_PREFIX, self._start_rows[start:end], self._start_ranks[start:end], (first, last)),
+        ]
+        for tier, rows, ranks, title_range in ranges:
+            left = limit - len(tiers)
+            if left <= 0:
+                break
+            tiers.update(dict.fromkeys(self._best_rated(rows, ranks, left, title_range).tolist(), tier))
+        return tiers
+
+    def _best_rated(self, rows: np.ndarray, ranks: np.ndarray, limit: int, title_range=None) -> np.ndarray:
+        """The `limit` best rated distinct rows (ranks are their rating ranks), leaving out rows whose
+        position among the sorted titles is in title_range. Only rows ranked under a threshold are looked
+        at, the threshold grows until enough of them are left."""
+        total = len(self.keys)
+        if not len(rows) or limit <= 0:
+            return rows[:0]
+        # a guess at the rank under which about twice `limit` of these rows fall
+        threshold = min(total, max(2 * limit, 2 * limit * total // len(rows)))
+        while True:
+            candidates = np.unique(rows[ranks < threshold])
+            if title_range is not None and len(candidates):
+                positions = self._sorted_position[candidates]
+                candidates = candidates[(positions < title_range[0]) | (positions >= title_range[1])]
+            if len(candidates) >= limit or threshold >= total:
+                break
+            threshold = min(total, threshold * 4)
+        if len(candidates) > limit:
+            candidates = candidates[np.argpartition(self._rank[candidates], limit - 1)[:limit]]
+        return candidates
+
+    def _fuzzy(self, query: str, limit: int) -> List[int]:
+        query_grams = trigrams(query)
+        needed = max(1, int(np.ceil(self.min_similarity * len(query_grams))))
+        postings = sorted((self._postings[gram] for gram in query_grams if gram in self._postings), key=len)
+        # grams shared by a big part of the catalogue say little and cost the most to count,
+        # skip them and lower the bar by the same amount
+        common = [p for p in postings if len(p) > self.common_gram_rows]
+        rare = postings[:len(postings) - len(common)]
+        if len(rare) >= needed:
+            postings, needed = rare, max(1, needed - len(common))
+        if len(postings) < needed:
+            return []
+        counts = np.bincount(np.concatenate(postings), minlength=len(self.keys))
+        rows = np.flatnonzero(counts >= needed)
+        if len(rows) > limit:
+            rows = rows[np.argsort(-counts[rows], kind="stable")[:limit]]
+        return rows.tolist()
+
+    def search(self, query: str, max_results: int = 5) -> List[Dict[str, Any]]:
+        """Best matching titles, ranked by match quality then rating"""
+        query = normalize_title(query)
+        if not query:
+            return []
+
+        # gather a few times more candidates than needed, ranking happens below
+        pool = max_results * 20
+        tiers = self._prefixed(query, pool)
+        if len(tiers) < max_results:
+            for row in self._fuzzy(query, pool):
+                if row not in tiers:
+                    tiers[row] = SUBSTRING if query in self.keys[row] else FUZZY
+
+        ranked = sorted(tiers, key=lambda row: (tiers[row], -self.ratings[row], len(self.keys[row])))
+        return [
+            {"id": self.ids[row], "title": self.titles[row], "year": self.years[row], "rating": float(self.ratings[row])}
+            for row in ranked[:max_results]
+        ]
+
+    def suggest(self, query: str, max_results: int = 5) -> List[str]:
+        return [match["title"] for match in self.search(query, max_results)]
@@ -0,0 +1,111 @@
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+LOOKUP_QUERY = """
+    SELECT c.id, c.title, c.embedding, c._ts
+    FROM c
+"""
+
+CHANGED_SINCE_QUERY = """
+    SELECT c.id, c.title, c.embedding, c._ts
+    FROM c
+    WHERE c._ts > @since
+"""
+
+
+def normalize_title(title: str) -> str:
+    return " ".join(title.split()).casefold()
+
+
+# title -> row table so find_similar resolves the source embedding without a database round trip
+
+class TitleLookup:
+    def __init__(self, ids: List[str], titles: List[str], embeddings, last_modified: int = 0):
+        self.ids = np.array(ids, dtype=object)
+        self.titles = list(titles)
+        # embedding stores from the local catalogue are kept as they are, rows decode to float32 on access
+        self.embeddings = embeddings if hasattr(embeddings, "scores") else np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.last_modified = last_modified
+        self.built_at = self.loaded_at = time.time()
+        self._shared = False
+        self._rebuild()
+
+    def _rebuild(self):
+        self._rows_by_id = {movie_id: row for row, movie_id in enumerate(self.ids)}
+        self._rows_by_title: Dict[str, List[int]] = {}
+        for row, title in enumerate(self.titles):
+            self._rows_by_title.setdefault(normalize_title(title), []).append(row)
+
+    def __len__(self):
+        return len(self.titles)
+
+    @classmethod
+    def from_container(cls, container) -> "TitleLookup":
+        ids, titles, embeddings, last_modified = [], [], [], 0
+        for item in container.query_items(query=LOOKUP_QUERY, enable_cross_partition_query=True):
+            if not item.get("embedding"):
+                continue
+            ids.append(item["id"])
+            titles.append(item.get("title") or "")
+            embeddings.append(item["embedding"])
+            last_modified = max(last_modified, item.get("_ts") or 0)
+        return cls(ids, titles, np.asarray(embeddings, dtype=np.float32), last_modified)
+
+    @classmethod
+    def from_catalogue(cls, catalogue) -> "TitleLookup":
+        """Share the embedding matrix of an already loaded local catalogue"""
+        ids = catalogue.column("id")
+        titles = [title or "" for title in catalogue.column("title")]
+        lookup = cls(ids, titles, catalogue.embeddings, catalogue.last_modified)
+        lookup._shared = True
+        return lookup
+
+    def rows(self, title: str) -> List[int]:
+        return self._rows_by_title.get(normalize_title(title), [])
+
+    def row_for_id(self, movie_id: str) -> Optional[int]:
+        return self._rows_by_id.get(movie_id)
+
+    def get(self, title: str) -> Optional[np.ndarray]:
+        """Embedding of the first movie with this title, None if it isn't in the table"""
+        rows = self.rows(title)
+        if not rows:
+            return None
+        return self.embeddings[rows[0]]
+
+    def refresh(self, container) -> int:
+        """Pull rows added or re-embedded since the last load, returns how many changed.
+        Deletions are not visible through _ts, reload with from_container to drop them.
+        A lookup shared with a local catalogue can't be refreshed, its rows must stay the catalogue's rows."""
+        if self._shared:
+            raise ValueError("title lookup shares the local catalogue's rows, load a new snapshot instead")
+        parameters = [{"name": "@since", "value": self.last_modified}]
+        changed = list(container.query_items(
+            query=CHANGED_SINCE_QUERY,
+            parameters=parameters,
+            enable_cross_partition_query=True
+        ))
+        self.loaded_at = time.time()
+        changed = [item for item in changed if item.get("embedding")]
+        if not changed:
+            return 0
+
+        new_rows = []
+        for item in changed:
+            self.last_modified = max(self.last_modified, item.get("_ts") or 0)
+            row = self._rows_by_id.get(item["id"])
+            if row is None:
+                new_rows.append(item)
+                continue
+            self.embeddings[row] = item["embedding"]
+            self.titles[row] = item.get("title") or ""
+
+        if new_rows:
+            self.ids = np.concatenate([self.ids, np.array([item["id"] for item in new_rows], dtype=object)])
+            self.titles.extend(item.get("title") or "" for item in new_rows)
+            added = np.asarray([item["embedding"] for item in new_rows], dtype=np.float32)
+            self.embeddings = np.ascontiguousarray(np.vstack([self.embeddings, added]))
+        self._rebuild()
+        return len(changed)
@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from local_index import Catalogue, FlatIndex, IVFIndex, LocalSearchBackend, normalize_rows, top_k_matrix
+from quantization import STORAGE_TYPES, make_store
+from filter_engine import FilterEngine
+
+# recall@k and latency of the local search configurations (index, filtered over-fetch, quantization) against
+# exact brute force search over the same catalogue. the cheapest configuration meeting the target recall is
+# written to SEARCH_CONFIG_PATH, which vector_search loads at import
+#
+#   python tuning.py --target-recall 0.95 --queries 500
+#   python tuning.py --prompts prompts.txt --storage float32,int8 --n-probe 4,8,16,32
+
+# settings a tuned config may set, anything already in the environment or .env wins over the file
+SEARCH_CONFIG_SETTINGS = ["LOCAL_INDEX_TYPE", "IVF_N_LISTS", "IVF_N_PROBE", "EMBEDDING_STORAGE", "PQ_SUBSPACES",
+                          "PQ_RERANK", "FILTER_OVERFETCH", "PREFILTER_SELECTIVITY"]
+
+# rows scored against the exact matrix at a time while computing the ground truth
+TRUTH_CHUNK_QUERIES = 256
+
+Filters = Tuple[Optional[List[int]], Optional[List[float]], Optional[List[str]]]
+UNFILTERED: Filters = (None, None, None)
+
+
+def apply_search_config(path: Optional[str]) -> Dict[str, str]:
+    """Put the settings of a tuned config into os.environ where they aren't set yet, returns the ones applied"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            settings = json.load(f).get("settings", {})
+    except (OSError, ValueError) as e:
+        print(f"Error reading search config {path}: {e}")
+        return {}
+    applied = {}
+    for name in SEARCH_CONFIG_SETTINGS:
+        if settings.get(name) is not None and name not in os.environ:
+            os.environ[name] = applied[name] = str(settings[name])
+    return applied
+
+
+def exact_matrix(store) -> np.ndarray:
+    """The catalogue embeddings as one float32 matrix"""
+    exact = store.exact
+    if hasattr(exact, "matrix") and exact.matrix.dtype == np.float32:
+        return np.asarray(exact.matrix)
+    print(f"Warning: catalogue stored as {exact.storage}, ground truth is exact search over the decoded vectors")
+    return np.concatenate([exact[start:start + 65536] for start in range(0, len(exact), 65536)])
+
+
+def sample_queries(matrix: np.ndarray, count: int, noise: float, rng) -> np.ndarray:
+    """Catalogue rows perturbed so a movie doesn't trivially find itself"""
+    queries = matrix[rng.choice(len(matrix), min(count, len(matrix)), replace=False)]
+    queries = queries + noise * rng.standard_normal(queries.shape).astype(np.float32)
+    return normalize_rows(queries)
+
+
+def sample_filters(catalogue: Catalogue, count: int, fraction: float, rng) -> List[Filters]:
+    """Year/rating/genre filters like the UI sends, built around a random movie so every filter matches something"""
+    genres = catalogue.column("genres")
+    filters = []
+    for _ in range(count):
+        if rng.random() >= fraction:
+            filters.append(UNFILTERED)
+            continue
+        row = int(rng.integers(len(catalogue)))
+        year = int(catalogue.years[row])
+        width = int(rng.choice([2, 5, 10, 25]))
+        min_rating = float(min(rng.choice([0.0, 5.0, 7.0]), catalogue.ratings[row]))
+        movie_genres = genres[row] or []
+        genre = [str(rng.choice(movie_genres))] if movie_genres and rng.random() < 0.5 else []
+        filters.append(([year - width, year + width], [min_rating, 10.0], genre))
+    return filters
+
+
+def ground_truth(matrix: np.ndarray, queries: np.ndarray, filters: List[Filters], masks, top_k: int) -> List[np.ndarray]:
+    """Exact top_k rows for every query, one matrix multiply per chunk of queries"""
+    truth = []
+    for start in range(0, len(queries), TRUTH_CHUNK_QUERIES):
+        scores = queries[start:start + TRUTH_CHUNK_QUERIES] @ matrix.T
+        for i, row_scores in enumerate(scores):
+            mask = masks(filters[start + i])
+            if mask is not None:
+                row_scores[~mask] = -np.inf
+        best = top_k_matrix(scores, top_k)
+        for i, rows in enumerate(best):
+            # a selective filter can match fewer than top_k movies
+            truth.append(rows[np.isfinite(scores[i, rows])])
+    return truth
+
+
+def evaluate(backend: LocalSearchBackend, queries: np.ndarray, filters: List[Filters], truth: List[np.ndarray],
+             top_k: int, ids: np.ndarray) -> Dict[str, float]:
+    """recall@k overall and on the filtered queries alone, latency percentiles in ms"""
+    recalls, latencies = [], []
+    for query, query_filters, expected in zip(queries, filters, truth):
+        started = time.perf_counter()
+        results = backend.search(query, top_k, *query_filters)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if len(expected):
+            found = {result["id"] for result in results}
+            recalls.append(sum(movie_id in found for movie_id in ids[expected]) / len(expected))
+        else:
+            recalls.append(1.0)
+    recalls = np.array(recalls)
+    filtered = np.array([query_filters is not UNFILTERED for query_filters in filters])
+    return {
+        "recall": float(recalls.mean()),
+        "unfiltered_recall": float(recalls[~filtered].mean()) if (~filtered).any() else 1.0,
+        "filtered_recall": float(recalls[filtered].mean()) if filtered.any() else 1.0,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def store_bytes(store) -> int:
+    return store.nbytes + (store.exact.nbytes if store.approximate else 0)
+
+
+def _floats(value: str) -> List[float]:
+    return [float(v) for v in value.split(",") if v]
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def load_catalogue(snapshot_path: Optional[str]) -> Catalogue:
+    from snapshot import Snapshot, current_version
+    if snapshot_path and current_version(snapshot_path):
+        snapshot = Snapshot.load(snapshot_path)
+        print(f"Evaluating snapshot {snapshot.version}")
+        return snapshot.catalogue
+    import vector_search
+    return Catalogue.from_container(vector_search.get_container())
+
+
+def load_prompts(path: str) -> np.ndarray:
+    import vector_search
+    with open(path) as f:
+        prompts = [line.strip() for line in f if line.strip()]
+    return normalize_rows(vector_search.embedding_cache.embed_queries(vector_search.get_embedding_model(), prompts,
+                                                                      vector_search.EMBEDDING_BATCH_SIZE))
+
+
+def pick(results: List[Dict[str, Any]], target_recall: float, optimize: str) -> Optional[Dict[str, Any]]:
+    """Cheapest configuration whose unfiltered and filtered recall both meet the target"""
+    passing = [r for r in results
+               if min(r["measured"]["unfiltered_recall"], r["measured"]["filtered_recall"]) >= target_recall]
+    if not passing:
+        return None
+    if optimize == "memory":
+        return min(passing, key=lambda r: (r["measured"]["memory_mib"], r["measured"]["p50_ms"]))
+    return min(passing, key=lambda r: (r["measured"]["p50_ms"], r["measured"]["memory_mib"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall and latency of local search configurations "
+                                                 "and write the cheapest one meeting a target recall")
+    parser.add_argument("--snapshot", default=os.getenv("SNAPSHOT_PATH"),
+                        help="snapshot root to evaluate, reads the container when there is none")
+    parser.add_argument("--queries", type=int, default=300, help="perturbed catalogue rows used as queries")
+    parser.add_argument("--prompts", help="file with one prompt per line, embedded and used as the queries instead")
+    parser.add_argument("--filtered-fraction", type=float, default=0.5, help="share of queries with filters")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--optimize", default="latency", choices=["latency", "memory"],
+                        help="what the cheapest passing configuration minimizes")
+    parser.add_argument("--storage", default=",".join(STORAGE_TYPES))
+    parser.add_argument("--pq-subspaces", default="0,32", help="product quantization sub-vectors, 0 for none")
+    parser.add_argument("--pq-rerank", type=int, default=int(os.getenv("PQ_RERANK", "8")))
+    parser.add_argument("--index", default="flat,ivf")
+    parser.add_argument("--n-lists", default="", help="IVF lists, comma separated (default sqrt of the rows)")
+    parser.add_argument("--n-probe", default="4,8,16,32")
+    parser.add_argument("--overfetch", default="1,2,4", help="FILTER_OVERFETCH values")
+    parser.add_argument("--prefilter", default="0.02,0.05,0.2", help="PREFILTER_SELECTIVITY values")
+    parser.add_argument("--output", default=os.getenv("SEARCH_CONFIG_PATH", "search_config.json"))
+    parser.add_argument("--no-write", action="store_true", help="only print the measurements")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    catalogue = load_catalogue(args.snapshot)
+    matrix = exact_matrix(catalogue.embeddings)
+    ids = np.array(catalogue.column("id"), dtype=object)
+    queries = load_prompts(args.prompts) if args.prompts else sample_queries(matrix, args.queries, 0.05, rng)
+    filters = sample_filters(catalogue, len(queries), args.filtered_fraction, rng)
+
+    # one filter engine and one set of IVF lists shared by every configuration
+    engine = FilterEngine.from_catalogue(catalogue)
+
+    def masks(query_filters: Filters) -> Optional[np.ndarray]:
+        return None if query_filters is UNFILTERED else engine.mask(*query_filters)
+
+    started = time.perf_counter()
+    truth = ground_truth(matrix, queries, filters, masks, args.top_k)
+    print(f"{len(matrix)} movies x {matrix.shape[1]} dims, {len(queries)} queries "
+          f"({sum(f is not UNFILTERED for f in filters)} filtered), ground truth in {time.perf_counter() - started:.1f}s")
+
+    indexes = args.index.split(",")
+    ivf_lists = []
+    if "ivf" in indexes:
+        for n_lists in _ints(args.n_lists) or [None]:
+            ivf_lists.append(IVFIndex(matrix, n_lists))
+
+    header = (f"{'storage':<16} {'index':<12} {'probe':>5} {'overf':>5} {'prefil':>6} {'MiB':>8} "
+              f"{'recall':>7} {'filt':>7} {'p50 ms':>7} {'p95 ms':>7}")
+    print(header)
+    results = []
+    for storage in args.storage.split(","):
+        for pq_subspaces in _ints(args.pq_subspaces):
+            store = make_store(matrix, storage, pq_subspaces, args.pq_rerank)
+            tuned = Catalogue(catalogue.records, store, years=catalogue.years, ratings=catalogue.ratings)
+            grid = []
+            if "flat" in indexes:
+                # a flat index always brute forces the filtered rows, over-fetch and prefilter don't apply
+                grid.append(({"LOCAL_INDEX_TYPE": "flat"}, FlatIndex(store), [None], [None], [None]))
+            for trained in ivf_lists:
+                order, bounds = trained.list_arrays()
+                index = IVFIndex.from_lists(store, trained.centroids, order, bounds)
+                grid.append(({"LOCAL_INDEX_TYPE": "ivf", "IVF_N_LISTS": index.n_lists}, index,
+                             [p for p in _ints(args.n_probe) if p <= index.n_lists] or [index.n_lists],
+                             _floats(args.overfetch), _floats(args.prefilter)))
+            for settings, index, probes, overfetches, prefilters in grid:
+                backend = LocalSearchBackend(tuned, index=index)
+                backend.filters = engine
+                for n_probe in probes:
+                    for overfetch in overfetches:
+                        for prefilter in prefilters:
+                            if n_probe is not None:
+                                index.n_probe = n_probe
+                                backend.overfetch, backend.prefilter_selectivity = overfetch, prefilter
+                            measured = evaluate(backend, queries, filters, truth, args.top_k, ids)
+                            measured["memory_mib"] = store_bytes(store) / 2 ** 20
+                            config = dict(settings, EMBEDDING_STORAGE=storage, PQ_SUBSPACES=pq_subspaces,
+                                          PQ_RERANK=args.pq_rerank)
+                            if n_probe is not None:
+                                config.update(IVF_N_PROBE=n_probe, FILTER_OVERFETCH=overfetch,
+                                              PREFILTER_SELECTIVITY=prefilter)
+                            results.append({"settings": config, "measured": measured})
+                            print(f"{store.storage:<16} {settings['LOCAL_INDEX_TYPE'] + ' ' + str(settings.get('IVF_N_LISTS', '')):<12} "
+                                  f"{n_probe or '-':>5} {overfetch or '-':>5} {prefilter or '-':>6} "
+                                  f"{measured['memory_mib']:>8.1f} {measured['unfiltered_recall']:>7.3f} "
+                                  f"{measured['filtered_recall']:>7.3f} {measured['p50_ms']:>7.2f} {measured['p95_ms']:>7.2f}")
+
+    best = pick(results, args.target_recall, args.optimize)
+    if best is None:
+        top = max(results, key=lambda r: min(r["measured"]["unfiltered_recall"], r["measured"]["filtered_recall"]))
+        print(f"Error: no configuration reaches recall {args.target_recall}, best was {top['settings']} "
+              f"at {top['measured']}")
+        return
+    print(f"Cheapest configuration with recall >= {args.target_recall}: {best['settings']}")
+    if args.no_write:
+        return
+    config = {
+        "generated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rows": len(matrix),
+        "queries": len(queries),
+        "top_k": args.top_k,
+        "target_recall": args.target_recall,
+        "optimize": args.optimize,
+        "settings": best["settings"],
+        "measured": best["measured"],
+    }
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Wrote {args.output}, vector_search picks it up on the next start")
+    if args.snapshot:
+        # storage, PQ and the IVF lists were fixed when the snapshot was exported
+        print("Run `python snapshot.py export` so the snapshot is stored and indexed with these settings")
+
+
+if __name__ == "__main__":
+    main()
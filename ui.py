@@ -1,7 +1,22 @@
 import streamlit as st
 from typing import List, Dict, Any, Tuple
-import vector_search
 import os
+from title_autocomplete import TitleAutocomplete
+import json
+import metrics
+from prefetch import Prefetcher
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# with RECOMMENDER_SERVICE_URL set the app is a thin client of service.py, otherwise it searches in-process
+if os.getenv("RECOMMENDER_SERVICE_URL"):
+    import service_client as vector_search
+else:
+    import vector_search
+
+# per-stage timings of the last search under the results, also turned on with ?debug=1
+SEARCH_DEBUG_PANEL = os.getenv("SEARCH_DEBUG_PANEL", "false").lower() == "true"
 
 # UI COMPONENTS
 
@@ -17,7 +32,9 @@ def create_rating_stars(rating):
     
     return stars_html
 
-def display_movie_card(movie: Dict[str, Any], col):
+def display_movie_card(movie: Dict[str, Any], col, details: Dict[str, Any] = None):
+    # plot text is only fetched for flipped cards, see main_app
+    details = details or {}
     with col:
         # unique key for each movie's flip state
         flip_state_key = f"flip_state_{movie['id']}"
@@ -45,7 +62,7 @@ def display_movie_card(movie: Dict[str, Any], col):
                             <div class="content-section full-height">
                                 <h4>📖 Summary</h4>
                                 <div class="scrollable-content">
-                                    <p class="summary-text">{movie['plot_synopsis']}</p>
+                                    <p class="summary-text">{details.get('plot_synopsis', '')}</p>
                                 </div>
                             </div>
                         </div>
@@ -73,7 +90,7 @@ def display_movie_card(movie: Dict[str, Any], col):
                             <div class="synopsis-section">
                                 <h4>🎭 Synopsis</h4>
                                 <div class="scrollable-content synopsis-scroll">
-                                    <p class="synopsis-text">{movie['plot_summary']}</p>
+                                    <p class="synopsis-text">{details.get('plot_summary', '')}</p>
                                 </div>
                             </div>
                         </div>
@@ -124,22 +141,38 @@ def load_css():
     with open(css_file) as f:
         st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
 
-def search_movie_titles(query: str, movie_titles: List[str], max_results: int = 5) -> List[str]:
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_title_index(version) -> TitleAutocomplete:
+    """Catalogue title index of one catalogue version, shared by every session"""
+    try:
+        return vector_search.get_title_autocomplete()
+    except Exception as e:
+        print(f"Error loading catalogue titles, falling back to the sample list: {e}")
+        return TitleAutocomplete.from_titles(MOVIE_TITLES)
+
+def title_index() -> TitleAutocomplete:
+    """Title index of the current catalogue, rebuilt after a snapshot swap or title reload"""
+    try:
+        version = vector_search.title_index_version()
+    except Exception as e:
+        print(f"Error checking the catalogue title version: {e}")
+        version = None
+    return load_title_index(version)
+
+def search_movie_titles(query: str, max_results: int = 5) -> List[Dict[str, Any]]:
     """Search for movie titles that match the query"""
     if not query:
         return []
-    
-    query = query.lower().strip()
+    return title_index().search(query, max_results)
+
+def resolve_title_lines(text: str) -> List[Dict[str, Any]]:
+    """Best catalogue match for every non-empty line"""
     matches = []
-    
-    for title in movie_titles:
-        if query in title.lower():
-            matches.append(title)
-    
-    # Sort by how early the query appears in the title
-    matches.sort(key=lambda x: x.lower().find(query))
-    
-    return matches[:max_results]
+    for line in text.splitlines():
+        found = search_movie_titles(line.strip(), max_results=1) if line.strip() else []
+        if found:
+            matches.append(found[0])
+    return matches
 
 # sample list of movie titles
 MOVIE_TITLES = [
@@ -156,6 +189,34 @@ MOVIE_TITLES = [
     "Joker", "1917", "Parasite", "Get Out", "La La Land", "Mad Max: Fury Road"
 ]
 
+def display_debug_panel(traces: List[Dict[str, Any]]):
+    """Stage by stage timings, Cosmos request charge and retries of the last search"""
+    with st.expander("🐞 Search trace", expanded=False):
+        for trace in traces:
+            st.markdown(f"**{trace['entry_point']}** — {trace['total_ms']:.1f} ms")
+            st.table(trace['stages'])
+
+# speculative search: started as soon as the inputs are complete, picked up by the button
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+PREFETCH_DEBOUNCE_MS = float(os.getenv("PREFETCH_DEBOUNCE_MS", "400"))
+
+def prefetch_key(kind: str, args: Dict[str, Any]) -> str:
+    return json.dumps([kind, args], sort_keys=True, default=list)
+
+def get_prefetcher() -> Prefetcher:
+    if 'prefetcher' not in st.session_state:
+        st.session_state.prefetcher = Prefetcher()
+    return st.session_state.prefetcher
+
+def prefetched_or_run(key: str, search) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Results and traces of the prefetch for these inputs, or of running the search now"""
+    prefetched = get_prefetcher().take(key) if PREFETCH_ENABLED else None
+    if prefetched is not None:
+        return prefetched
+    with metrics.collect_traces() as traces:
+        results = search()
+    return results, [trace.as_dict() for trace in traces]
+
 # MAIN STREAMLIT APP
 
 def main_app():
@@ -180,6 +241,7 @@ def main_app():
             'selected_genres': []
         }
         st.session_state.selected_movie = ""
+        st.session_state.selected_movie_id = None
     
     # sample list of genres
     PREDEFINED_GENRES = [
@@ -208,7 +270,7 @@ def main_app():
     
     active_tab = st.radio(
         "Choose search type:",
-        ["🧠 AI Mood Search", "🔍 Find Similar Movies"],
+        ["🧠 AI Mood Search", "🔍 Find Similar Movies", "💞 More Like These"],
         horizontal=True,
         label_visibility="collapsed"
     )
@@ -217,6 +279,8 @@ def main_app():
     prompt = ""
     movie_name = ""
     num_recs = 3
+    liked_movies = []
+    disliked_movies = []
     
     # Display the appropriate search interface based on active tab
     if active_tab == "🧠 AI Mood Search":
@@ -237,7 +301,7 @@ def main_app():
                 label_visibility="collapsed"
             )
         
-    else:  # "🔍 Find Similar Movies"
+    elif active_tab == "🔍 Find Similar Movies":
         st.markdown("**Find movies similar to ones you love**")
         search2, button_similar_slider = st.columns([2,1],gap="medium")
         with button_similar_slider:
@@ -258,7 +322,7 @@ def main_app():
             
             # Search for matching movies
             if search_query:
-                matching_movies = search_movie_titles(search_query, MOVIE_TITLES, max_results=5)
+                matching_movies = search_movie_titles(search_query, max_results=5)
                 
                 if matching_movies:
                     st.markdown("**🔍 Matching Movies:**")
@@ -266,15 +330,21 @@ def main_app():
                     # Create columns for the movie buttons
                     movie_cols = st.columns(len(matching_movies))
                     
-                    for idx, movie_title in enumerate(matching_movies):
+                    for idx, match in enumerate(matching_movies):
+                        movie_title = match['title']
+                        # year tells remakes with the same title apart
+                        label = f"🎬 {movie_title} ({match['year']})" if match.get('year') else f"🎬 {movie_title}"
+                        is_selected = (st.session_state.selected_movie == movie_title
+                                       and st.session_state.selected_movie_id == match['id'])
                         with movie_cols[idx]:
                             if st.button(
-                                f"🎬 {movie_title}", 
+                                label, 
                                 key=f"movie_btn_{idx}",
                                 use_container_width=True,
-                                type="secondary" if st.session_state.selected_movie != movie_title else "primary"
+                                type="primary" if is_selected else "secondary"
                             ):
                                 st.session_state.selected_movie = movie_title
+                                st.session_state.selected_movie_id = match['id']
                                 st.rerun()
                     
                     # Show selected movie
@@ -286,6 +356,35 @@ def main_app():
             else:
                 st.info("💡 Start typing to search for movies...")
 
+    else:  # "💞 More Like These"
+        st.markdown("**Mix the movies you love, and leave out the ones you don't**")
+        liked_col, disliked_col, multi_slider = st.columns([2,2,1], gap="medium")
+        with multi_slider:
+            num_recs = st.slider(
+                "Number of recommendations",
+                1, 6, 3,
+                key="multi_slider",
+                help="Select how many movies you want to see"
+            )
+        with liked_col:
+            liked_text = st.text_area(
+                "Movies you loved (one per line):",
+                placeholder="Inception\nThe Matrix",
+                key="liked_input"
+            )
+            liked_movies = resolve_title_lines(liked_text)
+            if liked_movies:
+                st.success("✅ " + ", ".join(f"**{match['title']}**" for match in liked_movies))
+        with disliked_col:
+            disliked_text = st.text_area(
+                "Movies to steer away from (optional):",
+                placeholder="Titanic",
+                key="disliked_input"
+            )
+            disliked_movies = resolve_title_lines(disliked_text)
+            if disliked_movies:
+                st.error("🚫 " + ", ".join(f"**{match['title']}**" for match in disliked_movies))
+
     # FILTERS SECTION
     filter_col1, filter_col2, filter_col3 = st.columns(3, gap="large")
     
@@ -332,6 +431,21 @@ def main_app():
         'selected_genres': selected_genres
     }
 
+    # SPECULATIVE PREFETCH - start the search for the current inputs before the button is pressed
+    filter_args = dict(year_range=year_range, rating_range=rating_range, genre=selected_genres)
+    rag_args = dict(query_text=prompt, top_k=num_recs, **filter_args)
+    similar_args = dict(movie_name=st.session_state.selected_movie, top_k=num_recs,
+                        movie_id=st.session_state.selected_movie_id, **filter_args)
+    rag_key = prefetch_key("rag", rag_args)
+    similar_key = prefetch_key("similar", similar_args)
+    if PREFETCH_ENABLED:
+        if active_tab == "🧠 AI Mood Search" and prompt:
+            # debounced, a prompt that is edited again before it fires is never searched
+            get_prefetcher().start(rag_key, lambda: vector_search.search_with_filtersAndPrompt(**rag_args),
+                                   delay=PREFETCH_DEBOUNCE_MS / 1000)
+        elif active_tab == "🔍 Find Similar Movies" and st.session_state.selected_movie:
+            get_prefetcher().start(similar_key, lambda: vector_search.find_similar(**similar_args))
+
     # SINGLE ACTION BUTTON SECTION
     st.markdown("### 🚀 Generate Recommendations")
     
@@ -339,6 +453,9 @@ def main_app():
     if active_tab == "🧠 AI Mood Search":
         button_label = "✨ Generate AI Recommendations"
         button_type = "primary"
+    elif active_tab == "💞 More Like These":
+        button_label = "💞 Recommend a Mix"
+        button_type = "primary"
     else:
         button_label = "🔍 Find Similar Movies"
         button_type = "primary"
@@ -349,35 +466,59 @@ def main_app():
             # AI Mood Search 
             if prompt:
                 with st.spinner("🔮 Analyzing your vibe with Azure AI..."):
-                    st.session_state.recommendations = vector_search.search_with_filtersAndPrompt(
-                        query_text=prompt,
-                        top_k=num_recs,
-                        year_range=st.session_state.current_filters['year_range'],
-                        rating_range=st.session_state.current_filters['rating_range'],
-                        genre=st.session_state.current_filters['selected_genres']
+                    st.session_state.recommendations, st.session_state.debug_traces = prefetched_or_run(
+                        rag_key, lambda: vector_search.search_with_filtersAndPrompt(**rag_args)
                     )
                     st.session_state.mode = "rag"
                     st.session_state.search_term = f'for "{prompt}"'
+                    st.session_state.last_search = {'query': prompt, 'page_size': num_recs,
+                                                    'filters': dict(st.session_state.current_filters)}
                     # Reset all flip states when new recommendations come
                     for movie in st.session_state.recommendations:
                         st.session_state[f"flip_state_{movie['id']}"] = False
                         st.session_state[f"summary_state_{movie['id']}"] = False
             else:
                 st.warning("Please describe what you're in the mood for!")
+
+        elif active_tab == "💞 More Like These":
+            if liked_movies:
+                with st.spinner("💞 Blending your favourites..."), metrics.collect_traces() as traces:
+                    multi_args = dict(
+                        liked=[match['title'] for match in liked_movies],
+                        disliked=[match['title'] for match in disliked_movies],
+                        liked_ids=[match['id'] for match in liked_movies],
+                        disliked_ids=[match['id'] for match in disliked_movies]
+                    )
+                    st.session_state.recommendations = vector_search.recommend(
+                        top_k=num_recs,
+                        year_range=st.session_state.current_filters['year_range'],
+                        rating_range=st.session_state.current_filters['rating_range'],
+                        genre=st.session_state.current_filters['selected_genres'],
+                        **multi_args
+                    )
+                    st.session_state.debug_traces = [trace.as_dict() for trace in traces]
+                    st.session_state.mode = "multi"
+                    st.session_state.search_term = "like " + " + ".join(f'"{match["title"]}"' for match in liked_movies)
+                    st.session_state.last_search = {'query': multi_args, 'page_size': num_recs,
+                                                    'filters': dict(st.session_state.current_filters)}
+                    for movie in st.session_state.recommendations:
+                        st.session_state[f"flip_state_{movie['id']}"] = False
+                        st.session_state[f"summary_state_{movie['id']}"] = False
+            else:
+                st.warning("Please add at least one movie you loved!")
                 
         else:  # "🔍 Find Similar Movies"
             if st.session_state.selected_movie:
                 movie_name = st.session_state.selected_movie
                 with st.spinner("📡 Searching vector database..."):
-                    st.session_state.recommendations = vector_search.find_similar(
-                        movie_name=movie_name,
-                        top_k=num_recs,
-                        year_range=st.session_state.current_filters['year_range'],
-                        rating_range=st.session_state.current_filters['rating_range'],
-                        genre=st.session_state.current_filters['selected_genres']
+                    st.session_state.recommendations, st.session_state.debug_traces = prefetched_or_run(
+                        similar_key, lambda: vector_search.find_similar(**similar_args)
                     )
                     st.session_state.mode = "similar"
                     st.session_state.search_term = f'similar to "{movie_name}"'
+                    st.session_state.last_search = {'query': movie_name, 'page_size': num_recs,
+                                                    'movie_id': st.session_state.selected_movie_id,
+                                                    'filters': dict(st.session_state.current_filters)}
                     # Reset all flip states when new recommendations come
                     for movie in st.session_state.recommendations:
                         st.session_state[f"flip_state_{movie['id']}"] = False
@@ -408,16 +549,54 @@ def main_app():
         
         if active_filters:
             st.info(f"📊 Active filters: {', '.join(active_filters)}")
+
+        if any(movie.get('degraded') for movie in st.session_state.recommendations):
+            st.warning("⚠️ Search is slow or unavailable right now, showing saved or approximate results.")
         
         num_movies = len(st.session_state.recommendations)
         cols = st.columns(min(num_movies, 3))
         
+        # one batched, cached fetch for the plot text of every flipped card
+        flipped_ids = [movie['id'] for movie in st.session_state.recommendations
+                       if st.session_state.get(f"flip_state_{movie['id']}")]
+        details = vector_search.get_movie_details(flipped_ids) if flipped_ids else {}
+
         for i, movie in enumerate(st.session_state.recommendations):
-            display_movie_card(movie, cols[i % 3])
+            display_movie_card(movie, cols[i % 3], details.get(movie['id']))
+
+        # Show more - served from the over-fetched result window, no new search
+        last_search = st.session_state.get('last_search')
+        if last_search and st.button("➕ Show More", use_container_width=True):
+            page_args = dict(
+                offset=len(st.session_state.recommendations),
+                limit=last_search['page_size'],
+                year_range=last_search['filters']['year_range'],
+                rating_range=last_search['filters']['rating_range'],
+                genre=last_search['filters']['selected_genres']
+            )
+            with metrics.collect_traces() as traces:
+                if st.session_state.mode == "rag":
+                    more = vector_search.search_page(last_search['query'], **page_args)
+                elif st.session_state.mode == "multi":
+                    more = vector_search.recommend_page(**last_search['query'], **page_args)
+                else:
+                    more = vector_search.similar_page(last_search['query'], movie_id=last_search.get('movie_id'), **page_args)
+            st.session_state.debug_traces = [trace.as_dict() for trace in traces]
+            if more:
+                for movie in more:
+                    st.session_state[f"flip_state_{movie['id']}"] = False
+                    st.session_state[f"summary_state_{movie['id']}"] = False
+                st.session_state.recommendations = st.session_state.recommendations + more
+                st.rerun()
+            else:
+                st.info("🎬 That's all the movies matching your search.")
     
     elif st.session_state.mode != "welcome":
         st.warning("🤷 No movies found matching your search criteria and filters. Try adjusting your search or filters.")
 
+    if (SEARCH_DEBUG_PANEL or st.query_params.get("debug") == "1") and st.session_state.get('debug_traces'):
+        display_debug_panel(st.session_state.debug_traces)
+
     # FOOTER
     st.markdown("""
         <div style="text-align: center; margin-top: 4rem; padding: 2rem; color: #6b7280; border-top: 1px solid rgba(255,255,255,0.1);">
@@ -1,12 +1,35 @@
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
-from azure.cosmos import CosmosClient
-from typing import Dict, Any, Tuple, Optional, List
+import time
+
+_import_started = time.perf_counter()
+
+from typing import TYPE_CHECKING, Dict, Any, Tuple, Optional, List
 
 from dotenv import load_dotenv
 import os
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from local_index import Catalogue, LocalSearchBackend, RANKING_FIELDS, DETAIL_FIELDS, normalize_rows
+from embedding_cache import EmbeddingCache, model_name
+from title_lookup import TitleLookup, normalize_title
+from result_cache import ResultCache, result_key
+from tuning import apply_search_config
+import metrics
+
+# the other subsystems are imported by the getters that first need them, like the Cosmos and OpenAI clients
+if TYPE_CHECKING:
+    from lexical_index import LexicalSearch
+    from resilience import Upstream
+    from similar_table import SimilarTable
+    from title_autocomplete import TitleAutocomplete
 
 load_dotenv()
+# index, quantization and over-fetch settings picked by tuning.py, the environment and .env still win
+apply_search_config(os.getenv("SEARCH_CONFIG_PATH", "search_config.json"))
 
 EMBEDDING_MODEL_ENDPOINT = os.getenv("EMBEDDING_MODEL_ENDPOINT")
 COSMOS_CONNECTION_STRING = os.getenv("COSMOS_CONNECTION_STRING")
@@ -14,22 +37,478 @@ CONTAINER_NAME = os.getenv("CONTAINER_NAME")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 subscription_key = os.getenv("subscription_key")
 
-cosmos_client = CosmosClient.from_connection_string(COSMOS_CONNECTION_STRING)
-database = cosmos_client.get_database_client(DATABASE_NAME)
-container = database.get_container_client(CONTAINER_NAME)
+# per-stage timings and counters: "none" (default) or "prometheus", served on METRICS_PORT when set
+METRICS_SINK = os.getenv("METRICS_SINK", "none")
+METRICS_PORT = os.getenv("METRICS_PORT")
 
-embedding_model = AzureOpenAIEmbeddings(
-    azure_endpoint=EMBEDDING_MODEL_ENDPOINT,
-    api_key=subscription_key,
-)
+if METRICS_SINK == "prometheus":
+    metrics.set_sink(metrics.PrometheusSink())
+    if METRICS_PORT:
+        try:
+            metrics.get_sink().serve(int(METRICS_PORT))
+        except OSError as e:
+            print(f"Error starting metrics exporter on port {METRICS_PORT}: {e}")
 
-def vector_search(query_text,top_k=5):
+# clients are created on first use and shared by every session in the process,
+# so importing this module stays cheap and doesn't fail when azure is unreachable
+_clients_lock = threading.Lock()
+_container = None
+_embedding_model = None
+
+# seconds spent importing this module and creating each client, to track cold starts
+STARTUP_TIMINGS: Dict[str, float] = {}
+
+
+def get_container():
+    global _container
+    if _container is None:
+        with _clients_lock:
+            if _container is None:
+                started = time.perf_counter()
+                from azure.cosmos import CosmosClient
+                cosmos_client = CosmosClient.from_connection_string(COSMOS_CONNECTION_STRING)
+                database = cosmos_client.get_database_client(DATABASE_NAME)
+                _container = database.get_container_client(CONTAINER_NAME)
+                STARTUP_TIMINGS["cosmos_client"] = time.perf_counter() - started
+    return _container
+
+
+def get_embedding_model():
+    global _embedding_model
+    if _embedding_model is None:
+        with _clients_lock:
+            if _embedding_model is None:
+                started = time.perf_counter()
+                from langchain_openai import AzureOpenAIEmbeddings
+                _embedding_model = AzureOpenAIEmbeddings(
+                    azure_endpoint=EMBEDDING_MODEL_ENDPOINT,
+                    api_key=subscription_key,
+                )
+                STARTUP_TIMINGS["embedding_model"] = time.perf_counter() - started
+    return _embedding_model
+
+
+def set_clients(container=None, embedding_model=None):
+    """Swap in other clients (benchmarks, local stand-ins) and drop everything built from the old ones"""
+    global _container, _embedding_model, _local_backend, _title_lookup, _title_autocomplete, _similar_table, _lexical_search
+    with _clients_lock:
+        _container = container
+        _embedding_model = embedding_model
+    _local_backend = _title_lookup = _title_autocomplete = _similar_table = _lexical_search = None
+    # the disk tier is keyed by deployment and outlives the clients, only the memory tier goes
+    embedding_cache.clear(persistent=False)
+    catalogue_updated()
+
+
+# keeps `vector_search.container` / `vector_search.embedding_model` working for existing callers
+def __getattr__(name):
+    if name == "container":
+        return get_container()
+    if name == "embedding_model":
+        return get_embedding_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# "cosmos" pushes VectorDistance to the container, "local" searches an in-process index
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "cosmos")
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "ivf")
+IVF_N_LISTS = os.getenv("IVF_N_LISTS")
+IVF_N_PROBE = int(os.getenv("IVF_N_PROBE", "8"))
+PREFILTER_SELECTIVITY = float(os.getenv("PREFILTER_SELECTIVITY", "0.05"))
+FILTER_OVERFETCH = float(os.getenv("FILTER_OVERFETCH", "2.0"))
+# "float32", "float16" or "int8" in memory; PQ_SUBSPACES > 0 adds product quantized candidate generation
+# re-ranked exactly over PQ_RERANK x top_k candidates
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32")
+PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "0"))
+PQ_RERANK = int(os.getenv("PQ_RERANK", "8"))
+
+_local_backend = None
+
+# query embeddings are cached so slider-only reruns don't re-embed the same prompt
+EMBEDDING_CACHE_BYTES = int(os.getenv("EMBEDDING_CACHE_BYTES", str(64 * 1024 * 1024)))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_BYTES, EMBEDDING_CACHE_PATH)
+
+# identical embedding calls and Cosmos queries in flight at the same time (from any session) share one upstream
+# request; cache misses arriving within EMBEDDING_BATCH_WINDOW_MS of each other are embedded in one batch
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "10"))
+EMBEDDING_MICRO_BATCH_SIZE = int(os.getenv("EMBEDDING_MICRO_BATCH_SIZE", "64"))
+
+_coalescing_embeddings = None
+_cosmos_flight = None
+
+# tail-latency protection: every embedding call and Cosmos query times out after UPSTREAM_TIMEOUT_MULTIPLIER x its
+# upstream's recent p99 (clamped to the floor/ceiling), is hedged with a duplicate once it runs past the p95, and
+# is not attempted while that upstream's circuit is open. A search still failing or past SEARCH_DEADLINE_MS is
+# answered in degraded mode: the last good results for the same search, else the local snapshot index
+RESILIENCE_ENABLED = os.getenv("RESILIENCE_ENABLED", "true").lower() == "true"
+SEARCH_DEADLINE_MS = float(os.getenv("SEARCH_DEADLINE_MS", "8000"))
+UPSTREAM_TIMEOUT_FLOOR_MS = float(os.getenv("UPSTREAM_TIMEOUT_FLOOR_MS", "1000"))
+UPSTREAM_TIMEOUT_CEILING_MS = float(os.getenv("UPSTREAM_TIMEOUT_CEILING_MS", "6000"))
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.getenv("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+# at most this share of calls get a hedged duplicate, every hedged Cosmos query costs its RUs twice
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.1"))
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+UPSTREAM_WORKERS = int(os.getenv("UPSTREAM_WORKERS", "32"))
+DEGRADED_CACHE_ENTRIES = int(os.getenv("DEGRADED_CACHE_ENTRIES", "4096"))
+
+
+_upstreams: Dict[str, "Upstream"] = {}
+_guarded_embeddings = None
+
+
+def get_upstream(name: str) -> "Upstream":
+    """The timeouts, hedging and circuit breaker shared by every call to one upstream ("embedding", "cosmos")"""
+    upstream = _upstreams.get(name)
+    if upstream is None:
+        with _clients_lock:
+            if name not in _upstreams:
+                from resilience import CircuitBreaker, Upstream
+                _upstreams[name] = Upstream(name, UPSTREAM_TIMEOUT_FLOOR_MS / 1000, UPSTREAM_TIMEOUT_CEILING_MS / 1000,
+                                            UPSTREAM_TIMEOUT_MULTIPLIER, HEDGE_ENABLED, HEDGE_BUDGET,
+                                            CircuitBreaker(name, CIRCUIT_FAILURES, CIRCUIT_RESET_SECONDS),
+                                            UPSTREAM_WORKERS)
+            upstream = _upstreams[name]
+    return upstream
+
+
+def get_guarded_embeddings():
+    """The embedding model with timeouts, hedging and a circuit breaker when RESILIENCE_ENABLED is on"""
+    global _guarded_embeddings
+    model = get_embedding_model()
+    if not RESILIENCE_ENABLED:
+        return model
+    guarded = _guarded_embeddings
+    if guarded is None or guarded.model is not model:
+        upstream = get_upstream("embedding")
+        with _clients_lock:
+            if _guarded_embeddings is None or _guarded_embeddings.model is not model:
+                from resilience import GuardedEmbeddings
+                _guarded_embeddings = GuardedEmbeddings(model, upstream)
+            guarded = _guarded_embeddings
+    return guarded
+
+
+def get_query_embedder():
+    """The embedding model, behind the shared dispatcher when COALESCE_REQUESTS is on"""
+    global _coalescing_embeddings
+    model = get_guarded_embeddings()
+    if not COALESCE_REQUESTS:
+        return model
+    dispatcher = _coalescing_embeddings
+    if dispatcher is None or dispatcher.model is not model:
+        with _clients_lock:
+            if _coalescing_embeddings is None or _coalescing_embeddings.model is not model:
+                from dispatcher import CoalescingEmbeddings
+                _coalescing_embeddings = CoalescingEmbeddings(model, EMBEDDING_BATCH_WINDOW_MS / 1000,
+                                                              EMBEDDING_MICRO_BATCH_SIZE)
+            dispatcher = _coalescing_embeddings
+    return dispatcher
+
+
+def embed_query(query_text: str) -> List[float]:
+    with metrics.stage("embedding"):
+        return embedding_cache.embed_query(get_query_embedder(), query_text)
+
+
+def query_cosmos(container, db_query: str, parameters: Optional[List[Dict[str, Any]]] = None,
+                 stage_name: str = "cosmos_query") -> List[Dict[str, Any]]:
+    """metrics.query_cosmos, identical concurrent queries share one round trip"""
+    global _cosmos_flight
+
+    def run():
+        if not RESILIENCE_ENABLED:
+            return metrics.query_cosmos(container, db_query, parameters, stage_name)
+        return get_upstream("cosmos").call(lambda: metrics.query_cosmos(container, db_query, parameters, stage_name))
+
+    if not COALESCE_REQUESTS:
+        return run()
+    from dispatcher import SingleFlight, request_key
+    if _cosmos_flight is None:
+        with _clients_lock:
+            if _cosmos_flight is None:
+                _cosmos_flight = SingleFlight("cosmos")
+    return _cosmos_flight.do(request_key(id(container), db_query, parameters), run,
+                            copy=lambda items: [dict(item) for item in items])
+
+
+# repeat searches (popular prompts, popular titles with default filters) are served from memory
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+RESULT_CACHE_ENTRIES = int(os.getenv("RESULT_CACHE_ENTRIES", "1024"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "600"))
+
+result_cache = ResultCache(RESULT_CACHE_ENTRIES, RESULT_CACHE_TTL_SECONDS)
+
+
+# the first search over-fetches a window of ranked results, later pages and slider changes are slices of it
+RESULT_WINDOW = int(os.getenv("RESULT_WINDOW", "100"))
+
+
+def ranked_window(kind: str, query: str, needed: int, year_range, rating_range, genre, compute) -> List[Dict[str, Any]]:
+    """At least `needed` ranked results (fewer if the catalogue runs out).
+    compute(n, needed) fetches up to the top n and must return at least `needed` when they exist."""
+    if not RESULT_CACHE_ENABLED:
+        return compute(needed, needed)
+    # window sizes are multiples of RESULT_WINDOW so growing past the end refetches once, not every page
+    window = RESULT_WINDOW * max(1, -(-needed // RESULT_WINDOW))
+    key = result_key(kind, query, year_range, rating_range, genre, window)
+    results = result_cache.get(key)
+    metrics.count("result_cache_total", kind=kind, result="hit" if results is not None and len(results) >= needed else "miss")
+    if results is None or len(results) < needed:
+        results = compute(window, needed)
+        # empty lists are usually errors, don't pin them for a whole TTL, nor degraded stand-ins
+        if results and not is_degraded(results):
+            result_cache.put(key, results)
+    return results
+
+
+# degraded mode: a search whose upstreams failed or ran out of time is answered from the last good results
+# of the same search (kept past the result cache TTL), else fallback(n) on the local snapshot index.
+# degraded results carry "degraded": True and are never cached as normal ones
+
+last_good = ResultCache(DEGRADED_CACHE_ENTRIES, float("inf"))
+
+
+def is_degraded(results: List[Dict[str, Any]]) -> bool:
+    return any(movie.get("degraded") for movie in results)
+
+
+def resilient(kind: str, query: str, year_range, rating_range, genre, compute, fallback):
+    """Wraps a ranked_window compute function: runs it within SEARCH_DEADLINE_MS and serves degraded results
+    when it raises. fallback(n) answers from the local index, or returns None."""
+    key = result_key(kind, query, year_range, rating_range, genre, 0)
+
+    from resilience import deadline
+
+    def run(n, needed):
+        try:
+            with deadline(SEARCH_DEADLINE_MS / 1000 if RESILIENCE_ENABLED else None):
+                results = compute(n, needed)
+        except Exception as e:
+            print(f"Error in {kind} search: {e}")
+            if not RESILIENCE_ENABLED:
+                return []
+            return degraded_results(kind, key, n, fallback, e)
+        if results and RESILIENCE_ENABLED:
+            last_good.put(key, results)
+        return results
+
+    return run
+
+
+def degraded_results(kind: str, key, top_k, fallback, error: Exception) -> List[Dict[str, Any]]:
+    with metrics.stage("degraded", reason=type(error).__name__) as span:
+        source = "last_good"
+        results = last_good.get(key)
+        if results is None:
+            source = "local_index"
+            try:
+                results = fallback(top_k)
+            except Exception as e:
+                print(f"Error in degraded {kind} search: {e}")
+                results = None
+        if results is None:
+            source, results = "none", []
+        results = results[:top_k]
+        for movie in results:
+            movie["degraded"] = True
+        span["source"] = source
+        span["results"] = len(results)
+    metrics.count("degraded_responses_total", kind=kind, source=source)
+    trace = metrics.current_trace()
+    if trace is not None:
+        trace.attrs["degraded"] = source
+    return results
+
+
+def local_fallback_backend():
+    """The local index for degraded answers: the search backend itself, or an exported snapshot when
+    searching Cosmos. None without either, building one from the container would hit the failing upstream."""
+    from snapshot import current_version
+    if SEARCH_BACKEND == "local" or (SNAPSHOT_PATH and current_version(SNAPSHOT_PATH)):
+        return get_local_backend()
+    return None
+
+
+def catalogue_updated():
+    """Call after movies are added, removed or re-embedded so no stale results are served"""
+    result_cache.invalidate()
+
+
+# title -> embedding table for find_similar. Against Cosmos it is refreshed incrementally from c._ts and
+# reloaded in full every TITLE_LOOKUP_RELOAD_SECONDS to drop deleted movies. The local backend's table shares
+# the catalogue's rows and only changes with a new snapshot
+TITLE_LOOKUP_ENABLED = os.getenv("TITLE_LOOKUP_ENABLED", "true").lower() == "true"
+TITLE_LOOKUP_REFRESH_SECONDS = float(os.getenv("TITLE_LOOKUP_REFRESH_SECONDS", "300"))
+TITLE_LOOKUP_RELOAD_SECONDS = float(os.getenv("TITLE_LOOKUP_RELOAD_SECONDS", "3600"))
+
+_title_lookup = None
+
+
+def get_title_lookup() -> TitleLookup:
+    global _title_lookup
+    if SEARCH_BACKEND == "local":
+        return get_local_backend().title_lookup
+    if _title_lookup is None:
+        _title_lookup = TitleLookup.from_container(get_container())
+    elif time.time() - _title_lookup.built_at > TITLE_LOOKUP_RELOAD_SECONDS:
+        try:
+            _title_lookup = TitleLookup.from_container(get_container())
+            catalogue_updated()
+        except Exception as e:
+            print(f"Error reloading title lookup: {e}")
+    elif time.time() - _title_lookup.loaded_at > TITLE_LOOKUP_REFRESH_SECONDS:
+        try:
+            if _title_lookup.refresh(get_container()):
+                catalogue_updated()
+        except Exception as e:
+            print(f"Error refreshing title lookup: {e}")
+    return _title_lookup
+
+
+def resolve_embedding(movie_name: str, movie_id: Optional[str] = None):
+    """Source embedding for find_similar, from the local table when possible"""
+    if TITLE_LOOKUP_ENABLED:
+        try:
+            with metrics.stage("title_lookup") as span:
+                lookup = get_title_lookup()
+                row = lookup.row_for_id(movie_id) if movie_id is not None else None
+                embedding = lookup.embeddings[row] if row is not None else lookup.get(movie_name)
+                span["found"] = embedding is not None
+            if embedding is not None:
+                return embedding.tolist()
+        except Exception as e:
+            print(f"Error loading title lookup: {e}")
+    return get_embedding(get_container(), movie_name)
+
+
+# catalogue title autocomplete, rebuilt for every new snapshot with the local backend and every
+# TITLE_LOOKUP_RELOAD_SECONDS against Cosmos
+
+_title_autocomplete = None
+_title_autocomplete_built_at = 0.0
+_title_index_version = 0
+
+
+def get_title_autocomplete() -> "TitleAutocomplete":
+    global _title_autocomplete, _title_autocomplete_built_at, _title_index_version
+    from title_autocomplete import TitleAutocomplete
+    if SEARCH_BACKEND == "local":
+        # a new snapshot drops the index
+        get_local_backend()
+    elif _title_autocomplete is not None and time.time() - _title_autocomplete_built_at > TITLE_LOOKUP_RELOAD_SECONDS:
+        _title_autocomplete = None
+    if _title_autocomplete is None:
+        if SEARCH_BACKEND == "local":
+            _title_autocomplete = TitleAutocomplete(get_local_backend().catalogue.records)
+        else:
+            _title_autocomplete = TitleAutocomplete.from_container(get_container())
+        _title_autocomplete_built_at = time.time()
+        _title_index_version += 1
+    return _title_autocomplete
+
+
+def title_index_version() -> int:
+    """Changes every time get_title_autocomplete builds a new index, for callers caching it"""
+    get_title_autocomplete()
+    return _title_index_version
+
+
+# builds the local index from a snapshot of the container on first use, or memory-maps an exported
+# snapshot (python snapshot.py export) and swaps to a newer one when CURRENT changes
+
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH")
+SNAPSHOT_CHECK_SECONDS = float(os.getenv("SNAPSHOT_CHECK_SECONDS", "30"))
+SNAPSHOT_VERIFY = os.getenv("SNAPSHOT_VERIFY", "false").lower() == "true"
+# > 0 splits the snapshot across that many worker processes and scatters every search to them (see service.py)
+SEARCH_SHARDS = int(os.getenv("SEARCH_SHARDS", "0"))
+
+_backend_lock = threading.Lock()
+_snapshot_version = None
+_snapshot_checked_at = 0.0
+
+
+def _build_local_backend(version: Optional[str] = None) -> Tuple[LocalSearchBackend, Optional[str]]:
+    params = {}
+    if LOCAL_INDEX_TYPE == "ivf":
+        params = {"n_lists": int(IVF_N_LISTS) if IVF_N_LISTS else None, "n_probe": IVF_N_PROBE}
+    from snapshot import Snapshot, current_version
+    has_snapshot = bool(SNAPSHOT_PATH and current_version(SNAPSHOT_PATH))
+    if SEARCH_SHARDS > 0:
+        if has_snapshot:
+            # worker processes, multiprocessing is only imported by apps that shard
+            from shards import ShardedSearchBackend
+            backend = ShardedSearchBackend(SNAPSHOT_PATH, version, SEARCH_SHARDS, PQ_RERANK, PQ_SUBSPACES,
+                                           SNAPSHOT_VERIFY)
+            return backend, backend.version
+        print("Error: SEARCH_SHARDS needs an exported snapshot (SNAPSHOT_PATH), searching in-process instead")
+    if has_snapshot:
+        snapshot = Snapshot.load(SNAPSHOT_PATH, version, SNAPSHOT_VERIFY, PQ_RERANK, PQ_SUBSPACES, IVF_N_PROBE)
+        for mismatch in snapshot.config_mismatches(EMBEDDING_STORAGE, params.get("n_lists")):
+            print(f"Warning: snapshot {snapshot.version} has {mismatch}, run `python snapshot.py export` to apply it")
+        # the saved IVF lists are only reused when the app asks for an ivf index
+        index = snapshot.index if LOCAL_INDEX_TYPE == "ivf" else None
+        backend = LocalSearchBackend(snapshot.catalogue, LOCAL_INDEX_TYPE, PREFILTER_SELECTIVITY, FILTER_OVERFETCH,
+                                     index, **params)
+        return backend, snapshot.version
+    catalogue = Catalogue.from_container(get_container(), EMBEDDING_STORAGE, PQ_SUBSPACES, PQ_RERANK)
+    return LocalSearchBackend(catalogue, LOCAL_INDEX_TYPE, PREFILTER_SELECTIVITY, FILTER_OVERFETCH, **params), None
+
+
+def _check_snapshot():
+    """Swap in the snapshot CURRENT points at if it changed. The new backend is built completely before the
+    switch, searches already running finish on the old one."""
+    global _local_backend, _snapshot_version, _snapshot_checked_at, _title_lookup, _title_autocomplete, _lexical_search
+    from snapshot import current_version
+    _snapshot_checked_at = time.time()
+    version = current_version(SNAPSHOT_PATH)
+    if version is None or version == _snapshot_version:
+        return
     try:
-        query_embedding = embedding_model.embed_query(query_text)
+        backend, version = _build_local_backend(version)
     except Exception as e:
-        print("Error in embedding")
+        print(f"Error loading snapshot {version}: {e}")
+        return
+    with _backend_lock:
+        previous = _local_backend
+        _local_backend, _snapshot_version = backend, version
+        if SEARCH_BACKEND == "local":
+            _title_lookup = _title_autocomplete = _lexical_search = None
+    catalogue_updated()
+    # sharded backends own worker processes
+    if hasattr(previous, "close"):
+        previous.close(delay=SNAPSHOT_CHECK_SECONDS)
 
 
+def get_local_backend() -> LocalSearchBackend:
+    global _local_backend, _snapshot_version, _snapshot_checked_at
+    if _local_backend is None:
+        with _backend_lock:
+            if _local_backend is None:
+                _local_backend, _snapshot_version = _build_local_backend()
+                _snapshot_checked_at = time.time()
+    elif SNAPSHOT_PATH and time.time() - _snapshot_checked_at > SNAPSHOT_CHECK_SECONDS:
+        _check_snapshot()
+    return _local_backend
+
+
+def vector_search(query_text,top_k=5):
+    with metrics.trace("vector_search", top_k=top_k):
+        search = resilient("vector", query_text, None, None, None, lambda n, needed: _vector_search(query_text, n),
+                           lambda n: prompt_fallback(query_text, n, None, None, None))
+        return search(top_k, top_k)
+
+
+def _vector_search(query_text, top_k):
+    # embedding and Cosmos errors are raised, resilient() turns them into degraded results or []
+    query_embedding = embed_query(query_text)
+
+    if SEARCH_BACKEND == "local":
+        return local_search(query_embedding, top_k)
+
     db_query = """
         SELECT TOP @top_k
             c.id,
@@ -37,8 +516,6 @@ def vector_search(query_text,top_k=5):
             c.genres,
             c.rating,
             c.year,
-            c.plot_summary,
-            c.plot_synopsis,
             VectorDistance(c.embedding, @query_embedding) AS similarity_score
         FROM c
         ORDER BY VectorDistance(c.embedding, @query_embedding)
@@ -48,20 +525,18 @@ def vector_search(query_text,top_k=5):
         {"name": "@top_k", "value": top_k}
     ]
 
-    try:
-        results = list(container.query_items(
-            query=db_query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
+    return query_cosmos(get_container(), db_query, parameters)
+
+
+def local_search(query_embedding, top_k, year_range=None, rating_range=None, genre=None) -> List[Dict[str, Any]]:
+    with metrics.stage("local_search") as span:
+        results = get_local_backend().search(query_embedding, top_k, year_range, rating_range, genre)
+        span["results"] = len(results)
         return results
     
-    except Exception as e:
-        print("Error in vector search: {e} could not find vector")
-        return []
-    
     
 def get_embedding(container, movie_name: str):
+    from resilience import CircuitOpenError, DeadlineExceeded
     find_movie_query = """
         SELECT VALUE c.embedding 
         FROM c
@@ -72,102 +547,428 @@ def get_embedding(container, movie_name: str):
     ]
 
     try:
-        result_items = list(container.query_items(
-            query=find_movie_query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
+        result_items = query_cosmos(container, find_movie_query, parameters, "source_embedding")
         if result_items:
             return result_items[0]
         else:
             return None
             
+    except (DeadlineExceeded, CircuitOpenError):
+        # Cosmos is down or stalled, not a missing movie: let the search degrade
+        raise
     except Exception as e:
         print(f"Error fetching embedding for movie '{movie_name}': {e}")
         return None
 
 
-#find similar movies based on input
+# precomputed neighbours, built offline with `python similar_table.py build`. The manifest is written last,
+# a newer one (after `similar_table.py update`) is swapped in when checked every SIMILAR_TABLE_CHECK_SECONDS
+SIMILAR_TABLE_PATH = os.getenv("SIMILAR_TABLE_PATH", "similar_table")
+SIMILAR_TABLE_CHECK_SECONDS = float(os.getenv("SIMILAR_TABLE_CHECK_SECONDS", "30"))
 
-def find_similar(movie_name: str, top_k=5 ,year_range = [1921,2025], rating_range = [0.0,10.0], genre = None):
-    query_embedding = get_embedding(container,movie_name)
-    if query_embedding is None:
-        print(f"Error: Could not find embedding for source movie '{movie_name}'.")
-        return []
-    
-    if genre == None:
-        genre = []
+_similar_table = None
+_similar_table_mtime = None
+_similar_table_checked_at = 0.0
 
-    filters = get_filters(year_range,rating_range,genre)
 
-    if filters:
-        db_query = f"""
-        SELECT TOP @num_results
-            c.id,
-            c.title,
-            c.genres,
-            c.rating,
-            c.year,
-            c.plot_summary,
-            c.plot_synopsis,
-            VectorDistance(c.embedding, @embedding) AS similarity_score
-        FROM c
-        WHERE {filters}
-        ORDER BY VectorDistance(c.embedding, @embedding)
-    """
-    else:
-        db_query = f"""
-        SELECT TOP @num_results
+def get_similar_table() -> Optional["SimilarTable"]:
+    global _similar_table, _similar_table_mtime, _similar_table_checked_at
+    if _similar_table is not None and time.time() - _similar_table_checked_at <= SIMILAR_TABLE_CHECK_SECONDS:
+        return _similar_table
+    _similar_table_checked_at = time.time()
+    try:
+        mtime = os.stat(os.path.join(SIMILAR_TABLE_PATH, "manifest.json")).st_mtime_ns
+    except OSError:
+        return _similar_table
+    if _similar_table is None or mtime != _similar_table_mtime:
+        from similar_table import SimilarTable
+        previous = _similar_table
+        try:
+            _similar_table, _similar_table_mtime = SimilarTable.load(SIMILAR_TABLE_PATH), mtime
+        except Exception as e:
+            print(f"Error loading similar table: {e}")
+            return previous
+        if previous is not None:
+            # similar results cached from the old table
+            catalogue_updated()
+    return _similar_table
+
+
+def get_movies(movie_ids: List[str]) -> List[Dict[str, Any]]:
+    """Movies by id, in the order given"""
+    if SEARCH_BACKEND == "local":
+        backend = get_local_backend()
+        rows = [backend.title_lookup.row_for_id(movie_id) for movie_id in movie_ids]
+        records = backend.catalogue.records
+        return [{field: records[row].get(field) for field in RANKING_FIELDS} for row in rows if row is not None]
+
+    db_query = """
+        SELECT
             c.id,
             c.title,
             c.genres,
             c.rating,
-            c.year,
-            c.plot_summary,
-            c.plot_synopsis,
-            VectorDistance(c.embedding, @embedding) AS similarity_score
+            c.year
         FROM c
-        ORDER BY VectorDistance(c.embedding, @embedding)
+        WHERE ARRAY_CONTAINS(@ids, c.id)
     """
+    parameters = [{"name": "@ids", "value": list(movie_ids)}]
+    movies = {movie["id"]: movie for movie in query_cosmos(get_container(), db_query, parameters, "movies_by_id")}
+    return [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
+
+
+# plot text for movies already on screen, fetched in one batch when cards are flipped
+
+MOVIE_DETAILS_CACHE_SIZE = int(os.getenv("MOVIE_DETAILS_CACHE_SIZE", "4096"))
+
+_details_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_details_lock = threading.Lock()
+
+
+def get_movie_details(movie_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """plot_summary and plot_synopsis by movie id, only the ids not cached yet are fetched"""
+    details = {}
+    with _details_lock:
+        for movie_id in movie_ids:
+            if movie_id in _details_cache:
+                _details_cache.move_to_end(movie_id)
+                details[movie_id] = _details_cache[movie_id]
+    missing = [movie_id for movie_id in dict.fromkeys(movie_ids) if movie_id not in details]
+    if not missing:
+        return details
+
+    fetched = {}
+    try:
+        if SEARCH_BACKEND == "local":
+            backend = get_local_backend()
+            for movie_id in missing:
+                row = backend.title_lookup.row_for_id(movie_id)
+                if row is not None:
+                    record = backend.catalogue.records[row]
+                    fetched[movie_id] = {field: record.get(field) for field in DETAIL_FIELDS}
+        else:
+            db_query = """
+                SELECT c.id, c.plot_summary, c.plot_synopsis
+                FROM c
+                WHERE ARRAY_CONTAINS(@ids, c.id)
+            """
+            parameters = [{"name": "@ids", "value": missing}]
+            with metrics.trace("movie_details", movies=len(missing)):
+                for item in query_cosmos(get_container(), db_query, parameters, "movie_details"):
+                    fetched[item["id"]] = {field: item.get(field) for field in DETAIL_FIELDS}
+    except Exception as e:
+        print(f"Error fetching movie details: {e}")
+
+    with _details_lock:
+        for movie_id, movie_details in fetched.items():
+            _details_cache[movie_id] = movie_details
+        while len(_details_cache) > MOVIE_DETAILS_CACHE_SIZE:
+            _details_cache.popitem(last=False)
+    details.update(fetched)
+    return details
+
+
+result_cache.on_invalidate(_details_cache.clear)
+
+
+def with_details(movies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Search results with plot_summary and plot_synopsis filled in, for callers that need everything"""
+    details = get_movie_details([movie["id"] for movie in movies])
+    return [{**movie, **details.get(movie["id"], {})} for movie in movies]
+
+
+def similar_from_table(movie_name: str, top_k, year_range, rating_range, genre,
+                       min_results=None, movie_id=None) -> Optional[List[Dict[str, Any]]]:
+    """Answer find_similar from the precomputed table, None when a live query is needed"""
+    table = get_similar_table()
+    if table is None:
+        return None
+    with metrics.stage("similar_table") as span:
+        neighbours = table.lookup(movie_name, top_k, year_range, rating_range, genre, min_results, movie_id)
+        span["hit"] = neighbours is not None
+    if neighbours is None:
+        return None
+    try:
+        with metrics.stage("result_shaping"):
+            movies = get_movies([movie_id for movie_id, _ in neighbours])
+            scores = dict(neighbours)
+            for movie in movies:
+                movie["similarity_score"] = scores[movie["id"]]
+    except Exception as e:
+        print(f"Error fetching similar movies: {e}")
+        return None
+    return movies
+
+
+#find similar movies based on input
+
+# movie_id picks one movie when several share a title (remakes), the source is then excluded by id
+
+def find_similar(movie_name: str, top_k=5 ,year_range = [1921,2025], rating_range = [0.0,10.0], genre = None, movie_id = None):
+    if genre == None:
+        genre = []
+    return similar_page(movie_name, 0, top_k, year_range, rating_range, genre, movie_id)
+
+
+def similar_page(movie_name: str, offset=0, limit=5, year_range = [1921,2025], rating_range = [0.0,10.0], genre = None, movie_id = None):
+    """Results offset..offset+limit of find_similar, sliced from the cached window"""
+    if genre == None:
+        genre = []
+    query = f"{movie_name}\x00{movie_id}" if movie_id is not None else movie_name
+    with metrics.trace("find_similar", movie=movie_name, offset=offset, limit=limit):
+        results = ranked_window("similar", query, offset + limit, year_range, rating_range, genre,
+                                resilient("similar", query, year_range, rating_range, genre,
+                                          diversified(lambda n, needed: _find_similar(movie_name, n, year_range, rating_range, genre, needed, movie_id)),
+                                          lambda n: similar_fallback(movie_name, movie_id, n, year_range, rating_range, genre)))
+        return results[offset:offset + limit]
+
+
+def _find_similar(movie_name: str, top_k, year_range, rating_range, genre, min_results=None, movie_id=None):
+
+    precomputed = similar_from_table(movie_name, top_k, year_range, rating_range, genre, min_results, movie_id)
+    if precomputed is not None:
+        return precomputed
+
+    query_embedding = resolve_embedding(movie_name, movie_id)
+    if query_embedding is None:
+        print(f"Error: Could not find embedding for source movie '{movie_name}'.")
+        return []
+
+    filters, filter_parameters = get_filter_parameters(year_range,rating_range,genre)
+
+    db_query = build_vector_query(filters)
     parameters =[
         {"name": "@embedding", "value": query_embedding},
         {"name": "@num_results", "value": top_k + 1}
+    ] + filter_parameters
+
+    if SEARCH_BACKEND == "local":
+        results = local_search(query_embedding, top_k + 1, year_range, rating_range, genre)
+    else:
+        results = query_cosmos(get_container(), db_query, parameters)
+
+    with metrics.stage("post_filter"):
+        return without_source(results, movie_name, movie_id)[:top_k]
+
+
+def without_source(results: List[Dict[str, Any]], movie_name: str, movie_id=None) -> List[Dict[str, Any]]:
+    """Drops the source movie, by id or else by title compared the way the title lookup found it"""
+    if movie_id is not None:
+        return [result for result in results if result['id'] != movie_id]
+    source = normalize_title(movie_name)
+    return [result for result in results if normalize_title(result['title'] or "") != source]
+
+
+def similar_fallback(movie_name: str, movie_id, top_k, year_range, rating_range, genre) -> Optional[List[Dict[str, Any]]]:
+    """Degraded find_similar on the local index, the source embedding from its own title table"""
+    backend = local_fallback_backend()
+    if backend is None:
+        return None
+    lookup = backend.title_lookup
+    row = lookup.row_for_id(movie_id) if movie_id is not None else None
+    embedding = lookup.embeddings[row] if row is not None else lookup.get(movie_name)
+    if embedding is None:
+        return None
+    results = backend.search(embedding, top_k + 1, year_range, rating_range, genre)
+    return without_source(results, movie_name, movie_id)[:top_k]
+
+
+# "more like these": several liked movies, optionally some disliked ones, in one search.
+# "centroid" searches once around the weighted mean of the embeddings, "rrf" fuses one ranked list per
+# movie (one batched matrix search locally, concurrent queries against Cosmos). Every input movie is
+# excluded inside the search itself, no over-fetch and title filtering afterwards.
+
+RECOMMEND_METHOD = os.getenv("RECOMMEND_METHOD", "centroid")
+RECOMMEND_NEGATIVE_WEIGHT = float(os.getenv("RECOMMEND_NEGATIVE_WEIGHT", "0.5"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+RRF_DEPTH = int(os.getenv("RRF_DEPTH", "100"))
+
+SOURCES_QUERY = """
+    SELECT c.id, c.title, c.embedding
+    FROM c
+    WHERE ARRAY_CONTAINS(@titles, c.title) OR ARRAY_CONTAINS(@ids, c.id)
+"""
+
+
+def resolve_movies(movie_names: List[str], movie_ids: Optional[List[Optional[str]]] = None) -> List[Optional[Tuple[List[float], List[str]]]]:
+    """(embedding, ids to exclude) per input movie, None when it can't be found. A movie given by title only
+    stands for every movie with that title. Uses the title lookup, one Cosmos query covers the rest."""
+    movie_ids = list(movie_ids or [None] * len(movie_names))
+    resolved: List[Optional[Tuple[List[float], List[str]]]] = [None] * len(movie_names)
+    if TITLE_LOOKUP_ENABLED:
+        try:
+            with metrics.stage("title_lookup"):
+                lookup = get_title_lookup()
+                for i, (movie_name, movie_id) in enumerate(zip(movie_names, movie_ids)):
+                    rows = [lookup.row_for_id(movie_id)] if movie_id is not None else lookup.rows(movie_name)
+                    rows = [row for row in rows if row is not None]
+                    if rows:
+                        resolved[i] = (lookup.embeddings[rows[0]].tolist(), [str(lookup.ids[row]) for row in rows])
+        except Exception as e:
+            print(f"Error loading title lookup: {e}")
+
+    missing = [i for i, found in enumerate(resolved) if found is None]
+    if not missing:
+        return resolved
+    parameters = [
+        {"name": "@titles", "value": [movie_names[i] for i in missing if movie_ids[i] is None]},
+        {"name": "@ids", "value": [movie_ids[i] for i in missing if movie_ids[i] is not None]},
     ]
+    try:
+        items = query_cosmos(get_container(), SOURCES_QUERY, parameters, "source_embedding")
+    except Exception as e:
+        print(f"Error fetching source movies: {e}")
+        return resolved
+    for i in missing:
+        if movie_ids[i] is not None:
+            matches = [item for item in items if item["id"] == movie_ids[i]]
+        else:
+            matches = [item for item in items if item["title"] == movie_names[i]]
+        matches = [item for item in matches if item.get("embedding")]
+        if matches:
+            resolved[i] = (matches[0]["embedding"], [item["id"] for item in matches])
+    return resolved
+
+
+def recommend(liked: List[str], disliked: Optional[List[str]] = None, top_k=5, year_range = [1921,2025],
+              rating_range = [0.0,10.0], genre = None, method: Optional[str] = None,
+              liked_ids: Optional[List[Optional[str]]] = None, disliked_ids: Optional[List[Optional[str]]] = None):
+    """Movies like all of `liked` and unlike `disliked`, none of the input movies included"""
+    return recommend_page(liked, disliked, 0, top_k, year_range, rating_range, genre, method, liked_ids, disliked_ids)
+
+
+def recommend_page(liked: List[str], disliked: Optional[List[str]] = None, offset=0, limit=5,
+                   year_range = [1921,2025], rating_range = [0.0,10.0], genre = None, method: Optional[str] = None,
+                   liked_ids: Optional[List[Optional[str]]] = None, disliked_ids: Optional[List[Optional[str]]] = None):
+    """Results offset..offset+limit of recommend, sliced from the cached window"""
+    genre = genre or []
+    disliked = disliked or []
+    method = method or RECOMMEND_METHOD
+    liked_ids = list(liked_ids or [None] * len(liked))
+    disliked_ids = list(disliked_ids or [None] * len(disliked))
+    query = "\x00".join([method] + [f"+{name}\x01{movie_id}" for name, movie_id in sorted(zip(liked, liked_ids), key=str)]
+                        + [f"-{name}\x01{movie_id}" for name, movie_id in sorted(zip(disliked, disliked_ids), key=str)])
+    with metrics.trace("recommend", liked=len(liked), disliked=len(disliked), method=method, offset=offset, limit=limit):
+        results = ranked_window("recommend", query, offset + limit, year_range, rating_range, genre,
+                                lambda n, needed: _recommend(liked, disliked, n, year_range, rating_range, genre,
+                                                             method, liked_ids, disliked_ids))
+        return results[offset:offset + limit]
+
+
+def _recommend(liked, disliked, top_k, year_range, rating_range, genre, method, liked_ids, disliked_ids):
+    sources = resolve_movies(list(liked) + list(disliked), list(liked_ids) + list(disliked_ids))
+    weights = [1.0] * len(liked) + [-RECOMMEND_NEGATIVE_WEIGHT] * len(disliked)
+    for name, found in zip(list(liked) + list(disliked), sources):
+        if found is None:
+            print(f"Error: Could not find embedding for source movie '{name}'.")
+    exclude_ids = sorted({movie_id for found in sources if found is not None for movie_id in found[1]})
+    embeddings = [(found[0], weight) for found, weight in zip(sources, weights) if found is not None]
+    if not any(weight > 0 for _, weight in embeddings):
+        return []
 
     try:
-        results = list(container.query_items(
-            query=db_query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
-
-        filtered_results = [
-            result for result in results 
-            if result['title'] != movie_name
-        ]
-
-        return filtered_results[:top_k]
-        
+        if method == "rrf":
+            return _recommend_rrf(embeddings, exclude_ids, top_k, year_range, rating_range, genre)
+        if method != "centroid":
+            raise ValueError(f"Unknown recommend method '{method}'")
+        vectors = normalize_rows(np.asarray([vector for vector, _ in embeddings], dtype=np.float32))
+        positive = np.asarray([weight > 0 for _, weight in embeddings])
+        centroid = vectors[positive].mean(axis=0)
+        if (~positive).any():
+            centroid -= RECOMMEND_NEGATIVE_WEIGHT * vectors[~positive].mean(axis=0)
+        return _search_excluding([centroid.tolist()], exclude_ids, top_k, year_range, rating_range, genre)[0]
     except Exception as e:
-        print(f"Error in finding similar movies: {e}")
+        print(f"Error in recommendations: {e}")
         return []
 
 
-# converts Range of filters to a String query
+def _search_excluding(query_embeddings: List[List[float]], exclude_ids: List[str], top_k, year_range, rating_range,
+                      genre) -> List[List[Dict[str, Any]]]:
+    """top_k results per query, none of exclude_ids. Locally one batched search, against Cosmos the
+    queries run concurrently and the ids are excluded in the WHERE clause"""
+    if SEARCH_BACKEND == "local":
+        backend = get_local_backend()
+        exclude_rows = [row for row in (backend.title_lookup.row_for_id(movie_id) for movie_id in exclude_ids)
+                        if row is not None]
+        with metrics.stage("local_search", queries=len(query_embeddings)):
+            if len(query_embeddings) == 1:
+                return [backend.search(query_embeddings[0], top_k, year_range, rating_range, genre, exclude_rows)]
+            return backend.search_batch(query_embeddings, top_k, year_range, rating_range, genre,
+                                        [exclude_rows] * len(query_embeddings))
 
-def get_filters(year_range: Tuple[int,int], rating_range: Tuple[float,float], genres_list: List[str]) -> str:
-    conditions = []
-    conditions.append(f"c.year >= {year_range[0]}  AND c.year <= {year_range[1]}")
-    conditions.append(f"c.rating >= {rating_range[0]} AND c.rating <= {rating_range[1]}")
-    
+    filters, filter_parameters = get_filter_parameters(year_range, rating_range, genre)
+    db_query = build_vector_query(f"{filters} AND NOT ARRAY_CONTAINS(@exclude_ids, c.id)")
+    container = get_container()
+
+    def run(query_embedding):
+        parameters = [
+            {"name": "@embedding", "value": query_embedding},
+            {"name": "@num_results", "value": top_k},
+            {"name": "@exclude_ids", "value": exclude_ids},
+        ] + filter_parameters
+        return query_cosmos(container, db_query, parameters)
+
+    if len(query_embeddings) == 1:
+        return [run(query_embeddings[0])]
+    with ThreadPoolExecutor(max_workers=min(8, len(query_embeddings))) as pool:
+        return list(pool.map(run, query_embeddings))
+
+
+def _recommend_rrf(embeddings, exclude_ids, top_k, year_range, rating_range, genre) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion: each movie scores weight / (RRF_K + rank) in every list it appears in"""
+    depth = max(RRF_DEPTH, top_k)
+    ranked_lists = _search_excluding([vector for vector, _ in embeddings], exclude_ids, depth, year_range,
+                                     rating_range, genre)
+    with metrics.stage("result_shaping"):
+        fused: Dict[str, float] = {}
+        movies: Dict[str, Dict[str, Any]] = {}
+        for (_, weight), results in zip(embeddings, ranked_lists):
+            for rank, movie in enumerate(results):
+                fused[movie["id"]] = fused.get(movie["id"], 0.0) + weight / (RRF_K + rank + 1)
+                movies.setdefault(movie["id"], movie)
+        # movies only close to the disliked ones end up below zero and are dropped
+        ranked = sorted((movie_id for movie_id in fused if fused[movie_id] > 0), key=lambda movie_id: -fused[movie_id])
+        return [{**movies[movie_id], "similarity_score": fused[movie_id]} for movie_id in ranked[:top_k]]
+
+
+# same filters as query parameters, so no user input ends up in the query text
+
+def get_filter_parameters(year_range: Tuple[int,int], rating_range: Tuple[float,float], genres_list: List[str]) -> Tuple[str, List[Dict[str, Any]]]:
+    conditions = [
+        "c.year >= @min_year AND c.year <= @max_year",
+        "c.rating >= @min_rating AND c.rating <= @max_rating",
+    ]
+    parameters = [
+        {"name": "@min_year", "value": year_range[0]},
+        {"name": "@max_year", "value": year_range[1]},
+        {"name": "@min_rating", "value": rating_range[0]},
+        {"name": "@max_rating", "value": rating_range[1]},
+    ]
     if genres_list:
         genre_filter = []
-        for genres in genres_list:
-            escaped_genre = genres.replace("'", "''")
-            genre_filter.append(f"ARRAY_CONTAINS(c.genres, '{escaped_genre})")
-        if genre_filter:
-            conditions.append(f"({' OR '.join(genre_filter)})")
-    return " AND ".join(conditions) if conditions else ""
+        for i, genre in enumerate(genres_list):
+            genre_filter.append(f"ARRAY_CONTAINS(c.genres, @genre{i})")
+            parameters.append({"name": f"@genre{i}", "value": genre})
+        conditions.append(f"({' OR '.join(genre_filter)})")
+    return " AND ".join(conditions), parameters
+
+
+# vector query used by find_similar and search_with_filtersAndPrompt
+
+def build_vector_query(filters: str) -> str:
+    where = f"WHERE {filters}" if filters else ""
+    return f"""
+        SELECT TOP @num_results
+            c.id,
+            c.title,
+            c.genres,
+            c.rating,
+            c.year,
+            VectorDistance(c.embedding, @embedding) AS similarity_score
+        FROM c
+        {where}
+        ORDER BY VectorDistance(c.embedding, @embedding)
+    """
 
 
 # search function with filters
@@ -175,60 +976,230 @@ def get_filters(year_range: Tuple[int,int], rating_range: Tuple[float,float], ge
 def search_with_filtersAndPrompt(query_text:str, top_k=5 ,year_range = [1921,2025], rating_range = [0.0,10.0], genre = None):
     if genre == None:
         genre = []
-    
-    query_embedding = embedding_model.embed_query(query_text)
-    filters = get_filters(year_range,rating_range,genre)
-
-    if filters:
-        db_query = f"""
-            SELECT TOP @num_results
-                c.id,
-                c.title,
-                c.genres,
-                c.rating,
-                c.year,
-                c.plot_summary,
-                c.plot_synopsis,
-                VectorDistance(c.embedding, @embedding) AS similarity_score
-            FROM c
-            WHERE {filters}
-            ORDER BY VectorDistance(c.embedding, @embedding)
-        """
-    else:
-        db_query = f"""
-            SELECT TOP @num_results
-                c.id,
-                c.title,
-                c.genres,
-                c.rating,
-                c.year,
-                c.plot_summary,
-                c.plot_synopsis,
-                VectorDistance(c.embedding, @embedding) AS similarity_score
-            FROM c
-            ORDER BY VectorDistance(c.embedding, @embedding)
-        """
+    return search_page(query_text, 0, top_k, year_range, rating_range, genre)
+
+
+def search_page(query_text: str, offset=0, limit=5, year_range = [1921,2025], rating_range = [0.0,10.0], genre = None):
+    """Results offset..offset+limit of search_with_filtersAndPrompt, sliced from the cached window"""
+    if genre == None:
+        genre = []
+    with metrics.trace("search_with_filtersAndPrompt", offset=offset, limit=limit):
+        results = ranked_window("prompt", query_text, offset + limit, year_range, rating_range, genre,
+                                resilient("prompt", query_text, year_range, rating_range, genre,
+                                          diversified(lambda n, needed: _search_with_filtersAndPrompt(query_text, n, year_range, rating_range, genre, needed)),
+                                          lambda n: prompt_fallback(query_text, n, year_range, rating_range, genre)))
+        return results[offset:offset + limit]
+
+
+def _search_with_filtersAndPrompt(query_text: str, top_k, year_range, rating_range, genre, min_results=None):
+    if HYBRID_SEARCH_ENABLED:
+        return _hybrid_search(query_text, top_k, year_range, rating_range, genre, min_results or top_k)
+    query_embedding = embed_query(query_text)
+    return _prompt_vector_search(query_embedding, top_k, year_range, rating_range, genre)
+
+
+def _prompt_vector_search(query_embedding, top_k, year_range, rating_range, genre):
+    if SEARCH_BACKEND == "local":
+        return local_search(query_embedding, top_k, year_range, rating_range, genre)
+
+    filters, filter_parameters = get_filter_parameters(year_range,rating_range,genre)
+
+    db_query = build_vector_query(filters)
     parameters = [
         {"name": "@embedding", "value": query_embedding},
         {"name": "@num_results", "value": top_k}
-    ]
+    ] + filter_parameters
 
-    try:
-        results = list(container.query_items(
-            query=db_query,
-            parameters=parameters,
-            enable_cross_partition_query=True
-        ))
+    return query_cosmos(get_container(), db_query, parameters)
+
+
+_fallback_lexical = None
+
+
+def prompt_fallback(query_text: str, top_k, year_range, rating_range, genre) -> Optional[List[Dict[str, Any]]]:
+    """Degraded prompt search on the local index: by the cached embedding of the prompt, or by BM25 over the
+    local catalogue when the embedding isn't cached (the endpoint is what failed)"""
+    global _fallback_lexical
+    from lexical_index import LexicalSearch, fuse
+    backend = local_fallback_backend()
+    if backend is None:
+        return None
+    embedding = embedding_cache.get(query_text, model_name(get_query_embedder()))
+    if embedding is not None:
+        return backend.search(embedding, top_k, year_range, rating_range, genre)
+    if SEARCH_BACKEND == "local":
+        lexical = get_lexical_search()
+    else:
+        if _fallback_lexical is None or _fallback_lexical[0] is not backend:
+            _fallback_lexical = (backend, LexicalSearch.from_catalogue(backend.catalogue, backend.filters))
+        lexical = _fallback_lexical[1]
+    return fuse([], lexical.search(query_text, top_k, year_range, rating_range, genre), 1.0)
+
+
+# hybrid search: BM25 over title + plot text fused with the vector results, so exact names and phrases
+# in the prompt ("Keyser Soze", "set in Tokyo") rank the movies that contain them
+
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "false").lower() == "true"
+# share of the fused score coming from BM25, 0 is pure vector search and 1 pure keyword search
+HYBRID_LEXICAL_WEIGHT = float(os.getenv("HYBRID_LEXICAL_WEIGHT", "0.3"))
+# keyword queries of at most this many terms are answered by BM25 alone when it finds enough movies,
+# skipping the embedding call; 0 always embeds
+HYBRID_KEYWORD_ONLY_TERMS = int(os.getenv("HYBRID_KEYWORD_ONLY_TERMS", "2"))
+
+_lexical_search = None
+
+
+def get_lexical_search() -> "LexicalSearch":
+    global _lexical_search
+    if _lexical_search is None:
+        from lexical_index import LexicalSearch
+        if SEARCH_BACKEND == "local":
+            backend = get_local_backend()
+            _lexical_search = LexicalSearch.from_catalogue(backend.catalogue, backend.filters)
+        else:
+            _lexical_search = LexicalSearch.from_container(get_container())
+    return _lexical_search
+
+
+def lexical_search(query_text: str, top_k, year_range=None, rating_range=None, genre=None) -> List[Dict[str, Any]]:
+    with metrics.stage("lexical_search") as span:
+        try:
+            results = get_lexical_search().search(query_text, top_k, year_range, rating_range, genre)
+        except Exception as e:
+            # the vector results are still fused on their own
+            print(f"Error in lexical search: {e}")
+            results = []
+        span["results"] = len(results)
         return results
-    
+
+
+def keyword_only_results(query_text: str, lexical_results: List[Dict[str, Any]], needed: int) -> Optional[List[Dict[str, Any]]]:
+    """BM25 results alone for a short keyword query with enough matches, None when the embedding is needed"""
+    from lexical_index import fuse, tokenize
+    if 0 < len(tokenize(query_text)) <= HYBRID_KEYWORD_ONLY_TERMS and len(lexical_results) >= needed:
+        metrics.count("embedding_skipped_total")
+        return fuse([], lexical_results, 1.0)
+    return None
+
+
+def fuse_hybrid(query_embedding, vector_results: List[Dict[str, Any]], lexical_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    from lexical_index import fuse
+    vector_scores = None
+    if SEARCH_BACKEND == "local":
+        # keyword-only matches get their real similarity from the catalogue matrix
+        backend = get_local_backend()
+        query = normalize_rows(query_embedding)
+
+        def vector_scores(movie_ids: List[str]) -> Dict[str, float]:
+            found = [(movie_id, backend.title_lookup.row_for_id(movie_id)) for movie_id in movie_ids]
+            found = [(movie_id, row) for movie_id, row in found if row is not None]
+            if not found:
+                return {}
+            rows = np.array([row for _, row in found], dtype=np.int64)
+            scores = backend.catalogue.embeddings.exact.scores(query, rows)
+            return {movie_id: float(score) for (movie_id, _), score in zip(found, scores)}
+
+    with metrics.stage("fusion") as span:
+        results = fuse(vector_results, lexical_results, HYBRID_LEXICAL_WEIGHT, vector_scores)
+        span["results"] = len(results)
+        return results
+
+
+def _hybrid_search(query_text: str, top_k, year_range, rating_range, genre, needed) -> List[Dict[str, Any]]:
+    lexical_results = lexical_search(query_text, top_k, year_range, rating_range, genre)
+    keyword_results = keyword_only_results(query_text, lexical_results, needed)
+    if keyword_results is not None:
+        return keyword_results
+    query_embedding = embed_query(query_text)
+    vector_results = _prompt_vector_search(query_embedding, top_k, year_range, rating_range, genre)
+    return fuse_hybrid(query_embedding, vector_results, lexical_results)[:top_k]
+
+
+# diversity re-ranking: over-fetch DIVERSITY_CANDIDATES once, then order them by maximal marginal relevance
+# so near-duplicates (sequels, remakes, one franchise) don't take most of the cards
+
+DIVERSITY_RERANK_ENABLED = os.getenv("DIVERSITY_RERANK_ENABLED", "false").lower() == "true"
+# 1 ranks by relevance only, lower values push similar movies further down
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+DIVERSITY_CANDIDATES = int(os.getenv("DIVERSITY_CANDIDATES", "200"))
+
+
+def candidate_embeddings(results: List[Dict[str, Any]]) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+    """Unit length embeddings of the results from the title lookup table, and which ones were found"""
+    if SEARCH_BACKEND != "local" and not TITLE_LOOKUP_ENABLED:
+        return None, None
+    try:
+        lookup = get_title_lookup()
     except Exception as e:
-        print("Error in vector search: {e} could not find vector")
+        print(f"Error loading title lookup: {e}")
+        return None, None
+    rows = [lookup.row_for_id(movie["id"]) for movie in results]
+    rows = np.array([-1 if row is None else row for row in rows], dtype=np.int64)
+    known = rows >= 0
+    embeddings = np.zeros((len(results), lookup.embeddings.shape[1]), dtype=np.float32)
+    if known.any():
+        embeddings[known] = normalize_rows(lookup.embeddings[rows[known]])
+    return embeddings, known
+
+
+def diversify(results: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+    import diversity
+    with metrics.stage("diversity", candidates=len(results)):
+        embeddings, known = candidate_embeddings(results)
+        return diversity.rerank(results, top_k, MMR_LAMBDA, embeddings, known)
+
+
+def diversified(compute):
+    """Wraps a ranked_window compute function: fetch at least DIVERSITY_CANDIDATES, keep the top n by MMR"""
+    if not DIVERSITY_RERANK_ENABLED:
+        return compute
+    return lambda n, needed: diversify(compute(max(n, DIVERSITY_CANDIDATES), needed), n)
+
+
+# batched variants for offline jobs, exact search over the local catalogue matrix
+
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+
+
+def batch_search_with_filtersAndPrompt(query_texts: List[str], top_k=5, year_range = [1921,2025], rating_range = [0.0,10.0], genre = None) -> List[List[Dict[str, Any]]]:
+    if not query_texts:
         return []
+    with metrics.trace("batch_search", queries=len(query_texts)):
+        try:
+            with metrics.stage("embedding", texts=len(query_texts)):
+                query_embeddings = embedding_cache.embed_queries(get_embedding_model(), query_texts, EMBEDDING_BATCH_SIZE)
+        except Exception as e:
+            print(f"Error in batch embedding: {e}")
+            return [[] for _ in query_texts]
+        with metrics.stage("local_search"):
+            return get_local_backend().search_batch(query_embeddings, top_k, year_range, rating_range, genre or [])
 
-    
-    
+
+def batch_find_similar(movie_names: List[str], top_k=5, year_range = [1921,2025], rating_range = [0.0,10.0], genre = None) -> List[List[Dict[str, Any]]]:
+    backend = get_local_backend()
+    lookup = backend.title_lookup
+    positions, source_rows, exclude_rows = [], [], []
+    for i, movie_name in enumerate(movie_names):
+        rows = lookup.rows(movie_name)
+        if not rows:
+            print(f"Error: Could not find embedding for source movie '{movie_name}'.")
+            continue
+        positions.append(i)
+        source_rows.append(rows[0])
+        exclude_rows.append(rows)
+
+    results = [[] for _ in movie_names]
+    if not positions:
+        return results
+    with metrics.trace("batch_find_similar", queries=len(positions)), metrics.stage("local_search"):
+        found = backend.search_batch(backend.catalogue.embeddings[source_rows], top_k, year_range, rating_range,
+                                     genre or [], exclude_rows)
+    for i, movie_results in zip(positions, found):
+        results[i] = movie_results
+    return results
 
 
+STARTUP_TIMINGS["import"] = time.perf_counter() - _import_started
 
 
 # movie = "Wet Hot American Summer"